@@ -26,6 +26,23 @@ from glob import glob
 import random
 import time
 import math
+import heapq
+import json
+import threading
+import struct
+import mmap
+from io import BytesIO
+from collections import deque
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
 
 # System status.
 
@@ -47,7 +64,10 @@ class Config:
     # Game display and timing properties.
 
     clock = None # initialised later
+    timer = None # a FrameTimer when timing frames
+    profiler = None # a Profiler when sampling the program
     framerate = 30
+    max_frame_skip = 5 # game ticks without showing them when running late
     repeat_delay, repeat_interval = 200, 200
     next_screen_delay = 5000
     end_music_delay = 500 # when no audio exists
@@ -56,6 +76,7 @@ class Config:
     # Template values for the big screen size.
 
     big_screen_size = 720, 720
+    big_object_size = 60, 60
     big_car_speed = 12
     big_computer_speed_advantage = 1
 
@@ -72,12 +93,16 @@ class Config:
     credits = 0
     sound = 1
     skip_intros = 0
+    record_file = None
+    replay = None # an InputLog when replaying a game
     left_buttons = (pygame.K_z, pygame.K_LEFT)
     right_buttons = (pygame.K_x, pygame.K_RIGHT)
     up_buttons = (pygame.K_k, pygame.K_UP)
     down_buttons = (pygame.K_m, pygame.K_DOWN)
     smoke_buttons = (pygame.K_l, pygame.K_SPACE)
     snapshot_buttons = (pygame.K_s,)
+    timing_buttons = (pygame.K_t,)
+    profile_buttons = (pygame.K_p,)
     coin_buttons = (pygame.K_c,)
     start_buttons = (pygame.K_1,)
     quit_buttons = (pygame.K_ESCAPE,)
@@ -89,6 +114,7 @@ class Config:
     reset_window_buttons = (pygame.K_F5,)
     help_buttons = (pygame.K_h,)
     snapshot_prefix = "snapshot-"
+    profile_prefix = "profile-"
 
     # Gameplay properties.
 
@@ -102,7 +128,11 @@ class Config:
     if not os.path.exists(data_dir):
         data_dir = "/usr/share/rally7/data"
 
+    bundle_name = "rally7.pack"
+    bundle = None # initialised later
     size_dir = "big"
+    scale = 1
+    cache_dir = os.path.join(os.path.expanduser("~"), ".rally7", "cache")
     music = {}
     music_types = ["wav", "ogg", "mid"]
 
@@ -112,6 +142,9 @@ class Config:
     objects = {}
     characters = {}
     infos = {}
+    image_directories = [(".", "objects"), ("characters", "characters"), ("special", "specials"), ("info", "infos")]
+    source_images = {}
+    scaled_images = {}
     special_size = 0, 0
     object_size = 0, 0
     character_size = 0, 0
@@ -120,6 +153,26 @@ class Config:
     wall_sets = []
     bgcolour = (255, 160, 90)
 
+    # Caches of prepared images, limited in size (in bytes).
+
+    rotation_cache = None # initialised later
+    rotation_cache_limit = 4 * 1024 * 1024
+    chunk_cache_limit = 24 * 1024 * 1024
+    glyph_cache = None # initialised later
+    glyph_cache_limit = 1024 * 1024
+    text_cache = None # initialised later
+    text_cache_limit = 2 * 1024 * 1024
+
+    # Atlases providing the images as areas of a few large surfaces.
+
+    atlas = None # initialised later
+    character_atlas = None # initialised later
+    atlas_width = 1024
+
+    # Areas of the display changed since the display was last updated.
+
+    dirty_rects = []
+
     # Maps.
 
     symbols = {
@@ -150,7 +203,7 @@ class Config:
     # The size of the play area, along with the offset from the top left of the
     # map to the actual play area.
 
-    map_size = 32, 56
+    map_size = default_map_size = 32, 56
     map_border = 5, 6
     start_area_x = map_border[0] + 10, map_border[0] + 20
     start_area_y = map_border[1] + 48, map_border[1] + 55
@@ -304,6 +357,28 @@ class Config:
         )
         ]
 
+    # Conversions compiled into a table indexed by neighbourhood, and the
+    # converted maps for each map and wall choice, with the number of maps kept
+    # before the cache is emptied.
+
+    conversion_table = None # initialised later
+    map_cache = {}
+    map_cache_limit = 8
+
+    # Generated maps, used instead of the above map when enabled, with the
+    # proportion of dead ends opened up to make loops, the number of other walls
+    # opened, the number of walls of each kind switched on challenging levels,
+    # the number of mazes carved before giving up on a seed, and the maps for
+    # each seed, with the number of maps kept before the cache is emptied.
+
+    generated_maps = 0
+    maze_braiding = 0.8
+    maze_loops = 20
+    maze_switches = 6
+    maze_attempts = 10
+    maze_cache = {}
+    maze_cache_limit = 8
+
 def map_to_exact(position):
     x, y = position
     return x * Config.object_size[0], y * Config.object_size[1]
@@ -340,18 +415,38 @@ def set_small_screen():
     Config.car_speed = Config.big_car_speed / 2
     Config.computer_speed_advantage = float(Config.big_computer_speed_advantage) / 2
     Config.size_dir = "small"
+    Config.scale = 0.5
 
 def set_medium_screen():
     Config.screen_size = int(Config.big_screen_size[0] * float(4) / 5), int(Config.big_screen_size[1] * float(4) / 5)
     Config.car_speed = Config.big_car_speed * float(4) / 5
     Config.computer_speed_advantage = float(Config.big_computer_speed_advantage) * float(4) / 5
     Config.size_dir = "medium"
+    Config.scale = 0.8
 
 def set_big_screen():
     Config.screen_size = Config.big_screen_size
     Config.car_speed = Config.big_car_speed
     Config.computer_speed_advantage = Config.big_computer_speed_advantage
     Config.size_dir = "big"
+    Config.scale = 1
+
+def set_scaled_screen(scale):
+    Config.screen_size = int(Config.big_screen_size[0] * scale), int(Config.big_screen_size[1] * scale)
+    Config.car_speed = Config.big_car_speed * scale
+    Config.computer_speed_advantage = float(Config.big_computer_speed_advantage) * scale
+    Config.size_dir = "scale-%s" % scale
+    Config.scale = scale
+
+def set_headless():
+
+    """
+    Set the object size for the current screen size without loading any
+    images, for use by simulations which show nothing.
+    """
+
+    Config.object_size = int(round(Config.big_object_size[0] * Config.scale)), \
+        int(round(Config.big_object_size[1] * Config.scale))
 
 def set_fullscreen():
     Config.screen_flags = pygame.FULLSCREEN
@@ -360,21 +455,24 @@ def set_window():
     Config.screen_flags = 0
 
 def init(screen):
+    reset_caches()
+    open_bundle()
     load_images()
     load_music()
 
     Config.character_size = init_images(Config.characters)
+    Config.character_atlas = Atlas(Config.characters.items())
 
     write(screen, cpos(5, 4), (255, 0, 0), "RALLY 7 PYGAME CABINET")
     write(screen, cpos(5, 6), (255, 255, 255), "PRESS H FOR CONTROL SET")
-    pygame.display.flip()
+    flip_display()
 
     Config.object_size = init_images(Config.objects)
     Config.special_size = init_images(Config.specials)
     Config.info_size = init_images(Config.infos)
 
     write(screen, cpos(5, 8), (127, 127, 127), "LOADED IMAGES")
-    pygame.display.flip()
+    flip_display()
 
     init_score_images(Config.objects)
 
@@ -383,23 +481,58 @@ def init(screen):
     init_walls(Config.wall_sets[0], (180, 0, 0), (0, 255, 0), "trees")
 
     write(screen, cpos(5, 10), (0, 255, 0), "LOADED SCENERY 1")
-    pygame.display.flip()
+    flip_display()
 
     Config.wall_sets.append({})
     init_walls(Config.wall_sets[1], (0, 0, 180), (0, 255, 255), "ocean")
 
     write(screen, cpos(5, 12), (0, 255, 255), "LOADED SCENERY 2")
-    pygame.display.flip()
+    flip_display()
 
     Config.wall_sets.append({})
     init_walls(Config.wall_sets[2], (100, 0, 0), (200, 100, 200), "mountains")
 
     write(screen, cpos(5, 14), (200, 100, 100), "LOADED SCENERY 3")
-    pygame.display.flip()
+    flip_display()
+
+    init_atlas()
 
     time.sleep(1)
 
+def init_atlas():
+
+    "Pack the object, scenery, special and information images into an atlas."
+
+    images = []
+    for collection in [Config.objects] + Config.wall_sets + [Config.specials, Config.infos]:
+        names = list(collection.keys())
+        names.sort()
+        for name in names:
+            image = collection[name]
+            images.append((image, image))
+    Config.atlas = Atlas(images)
+
 def init_walls(set, start_colour, end_colour, scenery):
+
+    """
+    Initialise the given wall 'set' using images blended from 'start_colour'
+    to 'end_colour', together with the given 'scenery' image. Previously
+    prepared walls are obtained from the image cache where possible.
+    """
+
+    sources = [Config.objects[name] for name in ("corner", "edge", "end", "wall", "solid", "single")]
+    name = "walls-%s" % image_digest(sources, start_colour, end_colour, Config.size_dir)
+    images = read_image_cache(name)
+
+    if images is None:
+        images = {}
+        make_walls(images, start_colour, end_colour)
+        write_image_cache(name, images)
+
+    set.update(images)
+    set["scenery"] = Config.objects[scenery]
+
+def make_walls(set, start_colour, end_colour):
     set["corner-top-left"] = image_copy(Config.objects["corner"])
     set["corner-top-right"] = pygame.transform.rotate(Config.objects["corner"], 270)
     set["corner-bottom-right"] = pygame.transform.rotate(Config.objects["corner"], 180)
@@ -424,8 +557,6 @@ def init_walls(set, start_colour, end_colour, scenery):
     for wall_name in Config.wall_names:
         recolour(set[wall_name], start_colour, end_colour)
 
-    set["scenery"] = Config.objects[scenery]
-
 def image_copy(image):
 
     """
@@ -438,29 +569,347 @@ def image_copy(image):
     else:
         return image.convert(image)
 
+def image_digest(images, *details):
+
+    """
+    Return a digest of the pixel data of the given 'images' combined with any
+    other 'details', suitable for naming cached images derived from them.
+    """
+
+    digest = md5()
+    for image in images:
+        digest.update(("%dx%d" % image.get_size()).encode("ascii"))
+        digest.update(pygame.image.tostring(image, "RGBA"))
+    digest.update(repr(details).encode("ascii"))
+    return digest.hexdigest()
+
+def read_image_cache(name):
+
+    """
+    Return a dictionary mapping names to images stored in the image cache under
+    the given 'name', or None if no usable images are stored.
+    """
+
+    filename = os.path.join(Config.cache_dir, name)
+    if not os.path.exists(filename):
+        return None
+
+    images = {}
+    try:
+        f = open(filename, "rb")
+        try:
+            if f.readline() != b"RALLY7-IMAGES 1\n":
+                return None
+
+            # Read the index of images, ending with an empty line.
+
+            index = []
+            while 1:
+                line = f.readline().decode("ascii").strip()
+                if not line:
+                    break
+                image_name, width, height = line.split()
+                index.append((image_name, (int(width), int(height))))
+
+            # Read the pixel data for each image.
+
+            for image_name, size in index:
+                data = f.read(size[0] * size[1] * 4)
+                images[image_name] = pygame.image.fromstring(data, size, "RGBA").convert_alpha()
+        finally:
+            f.close()
+
+    except (IOError, ValueError, pygame.error):
+        return None
+
+    return images
+
+def write_image_cache(name, images):
+
+    """
+    Store the given 'images' - a dictionary mapping names to images - in the
+    image cache under the given 'name'. Failure to store the images is ignored
+    since they can always be prepared again.
+    """
+
+    filename = os.path.join(Config.cache_dir, name)
+    names = list(images.keys())
+    names.sort()
+
+    try:
+        if not os.path.exists(Config.cache_dir):
+            os.makedirs(Config.cache_dir)
+
+        f = open(filename + ".tmp", "wb")
+        try:
+            f.write(b"RALLY7-IMAGES 1\n")
+            for image_name in names:
+                f.write(("%s %d %d\n" % ((image_name,) + images[image_name].get_size())).encode("ascii"))
+            f.write(b"\n")
+            for image_name in names:
+                f.write(pygame.image.tostring(images[image_name], "RGBA"))
+        finally:
+            f.close()
+
+        os.rename(filename + ".tmp", filename)
+
+    except (IOError, OSError):
+        pass
+
+# Data bundles.
+
+class Bundle:
+
+    """
+    A single file providing the game images and music, accessed using a memory
+    map so that images can be made directly from the stored pixel data.
+
+    The file starts with a header line and an index of entries, one per line,
+    ending with an empty line and followed by the data for the entries:
+
+    image <directory> <name> <width> <height> <offset>
+    music <name> <type> <offset> <length>
+
+    Image data is RGBA pixel data, music data is the content of a music file,
+    and each offset is relative to the end of the index.
+    """
+
+    header = b"RALLY7-PACK 1\n"
+
+    def __init__(self, filename):
+        self.filename = filename
+        f = open(filename, "rb")
+        try:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        if self.data.readline() != self.header:
+            raise ConfigError("File %s is not a game data bundle." % filename)
+
+        self.images = {}
+        self.music = {}
+
+        while 1:
+            fields = self.data.readline().decode("ascii").split()
+            if not fields:
+                break
+            if fields[0] == "image":
+                directory, name, width, height, offset = fields[1:]
+                if not self.images.get(directory):
+                    self.images[directory] = {}
+                self.images[directory][name] = (int(width), int(height)), int(offset)
+            elif fields[0] == "music":
+                name, music_type, offset, length = fields[1:]
+                if not self.music.get(name):
+                    self.music[name] = []
+                self.music[name].append(BundleMusic(self, music_type, int(offset), int(length)))
+
+        self.start = self.data.tell()
+
+    def buffer(self, offset, length):
+
+        "Return a buffer for the data at 'offset' having the given 'length'."
+
+        start = self.start + offset
+        try:
+            return buffer(self.data, start, length)
+        except NameError:
+            return memoryview(self.data)[start:start + length]
+
+    def read(self, offset, length):
+
+        "Return a copy of the data at 'offset' having the given 'length'."
+
+        start = self.start + offset
+        return self.data[start:start + length]
+
+    def get_images(self, directory):
+
+        """
+        Return a dictionary mapping names to images for the given 'directory',
+        with the images using the bundle data directly.
+        """
+
+        images = {}
+        for name, (size, offset) in self.images.get(directory, {}).items():
+            images[name] = pygame.image.frombuffer(self.buffer(offset, size[0] * size[1] * 4), size, "RGBA")
+        return images
+
+class BundleMusic:
+
+    "A music entry in a bundle."
+
+    def __init__(self, bundle, music_type, offset, length):
+        self.bundle = bundle
+        self.music_type = music_type
+        self.offset = offset
+        self.length = length
+
+    def open(self):
+
+        "Return a file object providing the music."
+
+        return BytesIO(self.bundle.read(self.offset, self.length))
+
+def open_bundle():
+
+    "Open any data bundle provided instead of separate data files."
+
+    filename = os.path.join(Config.data_dir, Config.bundle_name)
+    if Config.bundle is None or Config.bundle.filename != filename:
+        if os.path.exists(filename):
+            Config.bundle = Bundle(filename)
+            Config.source_images = {}
+        else:
+            Config.bundle = None
+
+def write_bundle(filename, data_dir):
+
+    """
+    Write a data bundle to 'filename' containing the big images and the music
+    from the given 'data_dir'.
+    """
+
+    index = []
+    blobs = []
+    offset = 0
+
+    for directory, attribute in Config.image_directories:
+        filenames = glob(os.path.join(data_dir, directory, "big", "*" + os.extsep + "png"))
+        filenames.sort()
+        for image_filename in filenames:
+            name = os.path.splitext(os.path.split(image_filename)[1])[0]
+            image = pygame.image.load(image_filename)
+            data = pygame.image.tostring(image, "RGBA")
+            index.append("image %s %s %d %d %d\n" % ((directory, name) + image.get_size() + (offset,)))
+            blobs.append(data)
+            offset += len(data)
+
+    for music_type in Config.music_types:
+        filenames = glob(os.path.join(data_dir, "music", "*" + os.extsep + music_type))
+        filenames.sort()
+        for music_filename in filenames:
+            name = os.path.splitext(os.path.split(music_filename)[1])[0]
+            f = open(music_filename, "rb")
+            try:
+                data = f.read()
+            finally:
+                f.close()
+            index.append("music %s %s %d %d\n" % (name, music_type, offset, len(data)))
+            blobs.append(data)
+            offset += len(data)
+
+    f = open(filename, "wb")
+    try:
+        f.write(Bundle.header)
+        for line in index:
+            f.write(line.encode("ascii"))
+        f.write(b"\n")
+        for data in blobs:
+            f.write(data)
+    finally:
+        f.close()
+
 def load_images():
 
-    "Load the images, forgetting any previously stored images."
+    """
+    Load the images for the current scale, forgetting any previously stored
+    images. Only the big images are read, with images for other scales being
+    derived from them. Images for each scale are kept in memory and, unless a
+    data bundle provides them, in the image cache, so that they need only be
+    prepared once.
+    """
 
-    Config.specials = {}
-    Config.objects = {}
-    Config.characters = {}
-    Config.infos = {}
+    for directory, attribute in Config.image_directories:
 
-    for directory, dictionary in [(".", Config.objects), ("characters", Config.characters), ("special", Config.specials), ("info", Config.infos)]:
-        subdirectory = os.path.join(Config.data_dir, directory, Config.size_dir)
+        # Identify the images using the details of the files providing them.
 
-        if not os.path.exists(subdirectory):
-            raise ConfigError(
-                "Images directory %s not present: please download the full game or prepare the images as documented." % subdirectory)
+        if Config.bundle is not None:
+            filenames = [Config.bundle.filename]
+            details = [directory]
+        else:
+            subdirectory = os.path.join(Config.data_dir, directory, "big")
 
-        pattern = os.path.join(subdirectory, "*" + os.extsep + "png")
-        for filename in glob(pattern):
-            path, ext = os.path.splitext(filename)
-            path, name = os.path.split(path)
-            dictionary[name] = pygame.image.load(filename).convert_alpha()
+            if not os.path.exists(subdirectory):
+                raise ConfigError(
+                    "Images directory %s not present: please download the full game or prepare the images as documented." % subdirectory)
+
+            pattern = os.path.join(subdirectory, "*" + os.extsep + "png")
+            filenames = glob(pattern)
+            filenames.sort()
+            details = []
+
+        for filename in filenames:
+            details.append((os.path.split(filename)[1], os.path.getsize(filename), os.path.getmtime(filename)))
+
+        name = "images-%s" % image_digest([], details, Config.scale)
+        images = Config.scaled_images.get(name)
+
+        if images is None:
+
+            # A bundle is read more quickly than the image cache, and so the
+            # images are scaled from the bundle without using the cache.
+
+            if Config.bundle is not None:
+                images = scale_images(load_source_images(directory, filenames), Config.scale)
+            else:
+                images = read_image_cache(name)
+                if images is None:
+                    images = scale_images(load_source_images(directory, filenames), Config.scale)
+                    write_image_cache(name, images)
+            Config.scaled_images[name] = images
+
+        # Provide images suitable for the current display.
+
+        converted = {}
+        for image_name, image in images.items():
+            converted[image_name] = image.convert_alpha()
+        setattr(Config, attribute, converted)
+
+def load_source_images(directory, filenames):
+
+    """
+    Return a dictionary mapping names to the big images in the given 'directory'
+    read from the given 'filenames' or from any data bundle, reading the images
+    only once.
+    """
+
+    images = Config.source_images.get(directory)
+    if images is None:
+        if Config.bundle is not None:
+            images = Config.bundle.get_images(directory)
+        else:
+            images = {}
+            for filename in filenames:
+                path, ext = os.path.splitext(filename)
+                path, name = os.path.split(path)
+                images[name] = pygame.image.load(filename)
+        Config.source_images[directory] = images
+    return images
+
+def scale_images(images, scale):
+
+    """
+    Return a dictionary mapping names to versions of the given 'images' scaled
+    by the given 'scale' factor.
+    """
+
+    scaled = {}
+    for name, image in images.items():
+        image = image.convert_alpha()
+        if scale != 1:
+            width, height = image.get_size()
+            image = pygame.transform.smoothscale(image, (int(round(width * scale)), int(round(height * scale))))
+        scaled[name] = image
+    return scaled
 
 def load_music():
+    if Config.bundle is not None:
+        for name, entries in Config.bundle.music.items():
+            Config.music[name] = entries
+        return
+
     subdirectory = os.path.join(Config.data_dir, "music")
 
     if not os.path.exists(subdirectory):
@@ -483,7 +932,10 @@ def play_music(name):
 
     for music in Config.music[name]:
         try:
-            pygame.mixer.music.load(music)
+            if hasattr(music, "open"):
+                pygame.mixer.music.load(music.open())
+            else:
+                pygame.mixer.music.load(music)
             pygame.mixer.music.play()
             set_music_end(1)
             return 1
@@ -515,6 +967,14 @@ def init_score_image(images, s, width):
     write(surface, (0, size * float(3)/8), (255, 255, 255), s)
     Config.objects[s] = pygame.transform.rotozoom(surface, 0, float(Config.object_size[0]) / size)
 
+def reset_caches():
+
+    "Forget any previously prepared images, making new, empty caches."
+
+    Config.rotation_cache = SurfaceCache(Config.rotation_cache_limit)
+    Config.glyph_cache = SurfaceCache(Config.glyph_cache_limit)
+    Config.text_cache = SurfaceCache(Config.text_cache_limit)
+
 def switch_map(map, new_walls=0):
     for y in range(1, len(map) - 1):
         row = map[y]
@@ -524,52 +984,838 @@ def switch_map(map, new_walls=0):
             new_row = row.replace(":", "#").replace("X", " ")
         map[y] = new_row
 
-def convert_map(map):
-    for y in range(1, len(map) - 1):
-        row = map[y]
-        new_row = [row[0]]
-        for x in range(1, len(row) - 1):
-            pattern = map[y-1][x-1:x+2] + row[x-1:x+2] + map[y+1][x-1:x+2]
-            symbol = match_conversion(pattern)
-            if symbol is not None:
-                new_row.append(symbol)
+def make_map(challenging=0, source=None):
+
+    """
+    Return a map for a level from the given 'source' map or from Config.map,
+    using the alternative walls if 'challenging' is set, with the wall symbols
+    converted for display. A ConfigError is raised if the map is not surrounded
+    by scenery.
+    """
+
+    source = source or Config.map
+    key = tuple(source), challenging and 1 or 0
+    map = Config.map_cache.get(key)
+    if map is None:
+        map = source[:]
+        switch_map(map, challenging)
+        if not has_border(map):
+            raise ConfigError("The map is not surrounded by scenery.")
+        convert_map(map)
+        if len(Config.map_cache) >= Config.map_cache_limit:
+            Config.map_cache = {}
+        Config.map_cache[key] = map
+    return map[:]
+
+def generate_map(seed):
+
+    """
+    Return a map generated from the given 'seed' in the format of Config.map,
+    having a play area of Config.map_size and the same start area, with rock
+    groups and walls switched on challenging levels. The same map is always
+    generated for a given seed and size. A ConfigError is raised if no valid
+    map is carved within Config.maze_attempts attempts.
+    """
+
+    key = seed, Config.map_size
+    map = Config.maze_cache.get(key)
+    if map is None:
+        rng = GameRandom(seed)
+        for attempt in range(0, Config.maze_attempts):
+            map = carve_maze(rng)
+            if validate_map(map):
+                break
+        else:
+            raise ConfigError("No valid %dx%d map could be generated for seed %d." % (Config.map_size + (seed,)))
+        if len(Config.maze_cache) >= Config.maze_cache_limit:
+            Config.maze_cache = {}
+        Config.maze_cache[key] = map
+    return map[:]
+
+def carve_maze(rng):
+
+    "Return a map carved as a maze using the random number generator 'rng'."
+
+    width, height = Config.map_size
+    grid = [["#"] * width for y in range(0, height)]
+
+    # Maze cells are found at even coordinates, with passages between them.
+
+    cells_x, cells_y = (width + 1) // 2, (height + 1) // 2
+
+    # The steps to other cells available in each column and each row, with the
+    # steps from a cell being those of its column followed by those of its row.
+
+    column_steps = [[(dx, 0) for dx in (1, -1) if 0 <= x + dx * 2 < cells_x * 2] for x in range(0, cells_x * 2)]
+    row_steps = [[(0, dy) for dy in (1, -1) if 0 <= y + dy * 2 < cells_y * 2] for y in range(0, cells_y * 2)]
+
+    # Walk from a random cell, backtracking at dead ends, so that every cell is
+    # reachable.
+
+    x, y = rng.randint(0, cells_x - 1) * 2, rng.randint(0, cells_y - 1) * 2
+    grid[y][x] = " "
+    stack = [(x, y)]
+    while stack:
+        x, y = stack[-1]
+        choices = [(dx, dy) for dx, dy in column_steps[x] + row_steps[y] if grid[y + dy * 2][x + dx * 2] == "#"]
+        if not choices:
+            stack.pop()
+            continue
+        dx, dy = choices[rng.randint(0, len(choices) - 1)]
+        grid[y + dy][x + dx] = " "
+        grid[y + dy * 2][x + dx * 2] = " "
+        stack.append((x + dx * 2, y + dy * 2))
+
+    # Open up most dead ends and some other walls, making loops so that red
+    # cars can be avoided. Since the passages walked above are left alone, the
+    # loop passages can later be blocked without making any cell unreachable.
+
+    loops = []
+    walls = []
+    for y in range(0, cells_y * 2, 2):
+        for x in range(0, cells_x * 2, 2):
+            steps = column_steps[x] + row_steps[y]
+            closed = [(dx, dy) for dx, dy in steps if grid[y + dy][x + dx] == "#"]
+            if len(closed) == len(steps) - 1 and rng.random() < Config.maze_braiding:
+                dx, dy = closed[rng.randint(0, len(closed) - 1)]
+                grid[y + dy][x + dx] = " "
+                loops.append((x + dx, y + dy))
+            for dx, dy in closed:
+                if dx > 0 or dy > 0:
+                    walls.append((x + dx, y + dy))
+
+    walls = [(x, y) for x, y in walls if grid[y][x] == "#"]
+    for x, y in rng.sample(walls, min(Config.maze_loops, len(walls))):
+        grid[y][x] = " "
+        loops.append((x, y))
+
+    # Clear the start area and the places where red cars appear on challenging
+    # levels.
+
+    bx, by = Config.map_border
+    area_x = Config.start_area_x[0] - bx, Config.start_area_x[1] - bx
+    area_y = Config.start_area_y[0] - by, min(Config.start_area_y[1] - by, height - 1)
+    for y in range(area_y[0], area_y[1] + 1):
+        for x in range(area_x[0], area_x[1] + 1):
+            grid[y][x] = " "
+    for y in range(0, 3):
+        for x in range(12, 19):
+            grid[y][x] = " "
+
+    loops = [(x, y) for x, y in loops
+        if not (area_x[0] - 1 <= x <= area_x[1] + 1 and area_y[0] - 1 <= y <= area_y[1])
+        and not (y < 4 and 11 <= x <= 19)]
+    loops = rng.sample(loops, len(loops))
+
+    # Close some loop passages on challenging levels and open some other walls,
+    # which always join cells reachable by the walked passages.
+
+    for x, y in loops[:Config.maze_switches]:
+        grid[y][x] = "X"
+    for x, y in rng.sample(walls, min(Config.maze_switches, len(walls))):
+        if grid[y][x] == "#":
+            grid[y][x] = ":"
+
+    # Put each rock group in two other loop passages.
+
+    for i, (x, y) in enumerate(loops[Config.maze_switches:Config.maze_switches + 20]):
+        grid[y][x] = str((i // 2 + 1) % 10)
+
+    # Surround the play area with the border.
+
+    border = "*" * (width + bx * 2)
+    map = [border] * by
+    for row in grid:
+        map.append("*" * bx + "".join(row) + "*" * bx)
+    map += [border] * by
+    return map
+
+def has_border(map):
+
+    "Return whether 'map' is surrounded by cells that cars cannot enter."
+
+    edges = map[0] + map[-1] + "".join([row[0] + row[-1] for row in map])
+    for symbol in Config.space_or_group_symbols:
+        if symbol in edges:
+            return 0
+    return 1
+
+def validate_map(map):
+
+    """
+    Return whether 'map' is surrounded by scenery, has two cells for each rock
+    group and whether all spaces can be reached from the start of the level
+    without crossing rocks, using either kind of wall.
+    """
+
+    for group in "0123456789":
+        if sum([row.count(group) for row in map]) != 2:
+            return 0
+
+    start_x, start_y = Config.map_border[0] + 15, Config.map_border[1] + 50
+
+    for challenging in (0, 1):
+        rows = map[:]
+        switch_map(rows, challenging)
+        if not has_border(rows):
+            return 0
+        width = len(rows[0])
+        cells = "".join(rows)
+
+        visited = bytearray(len(cells))
+        start = start_y * width + start_x
+        visited[start] = 1
+        queue = [start]
+        for i in queue:
+            for j in (i - 1, i + 1, i - width, i + width):
+                if not visited[j] and cells[j] == " ":
+                    visited[j] = 1
+                    queue.append(j)
+
+        if len(queue) != cells.count(" "):
+            return 0
+
+    return 1
+
+def get_conversion_table():
+
+    """
+    Return a table mapping each 3x3 neighbourhood of a wall, given as a bitmask
+    of the passable cells (from bit 0 at the top left to bit 8 at the bottom
+    right), to the symbol replacing the wall, or None if the wall is unchanged.
+    """
+
+    if Config.conversion_table is None:
+        table = []
+        for mask in range(0, 512):
+            pattern = "".join([(mask & (1 << c)) and " " or "#" for c in range(0, 9)])
+            table.append(match_conversion(pattern))
+        Config.conversion_table = table
+    return Config.conversion_table
+
+def convert_map(map):
+    if numpy is not None:
+        convert_map_array(map)
+        return
+
+    table = get_conversion_table()
+    passable = [[(c in Config.space_or_group_symbols and 1 or 0) for c in row] for row in map]
+
+    for y in range(1, len(map) - 1):
+        row = map[y]
+        above, here, below = passable[y-1:y+2]
+        new_row = list(row)
+        for x in range(1, len(row) - 1):
+            if row[x] == "#":
+                symbol = table[
+                    above[x-1] | above[x] << 1 | above[x+1] << 2 |
+                    here[x-1] << 3 | here[x+1] << 5 |
+                    below[x-1] << 6 | below[x] << 7 | below[x+1] << 8]
+                if symbol is not None:
+                    new_row[x] = symbol
+        map[y] = "".join(new_row)
+
+def convert_map_array(map):
+
+    "Convert 'map' like convert_map, using arrays for the whole map at once."
+
+    height, width = len(map), len(map[0])
+    symbols = numpy.frombuffer("".join(map).encode("ascii"), numpy.uint8).reshape(height, width)
+    lookup = numpy.zeros(256, numpy.uint16)
+    lookup[numpy.frombuffer(Config.space_or_group_symbols.encode("ascii"), numpy.uint8)] = 1
+    passable = lookup[symbols]
+
+    # Combine the neighbours of each inner cell into a bitmask.
+
+    masks = numpy.zeros((height - 2, width - 2), numpy.uint16)
+    for c in range(0, 9):
+        dy, dx = divmod(c, 3)
+        masks |= passable[dy:dy + height - 2, dx:dx + width - 2] << c
+
+    table = numpy.array([ord(symbol or "\0") for symbol in get_conversion_table()], numpy.uint8)
+    converted = table[masks]
+    inner = symbols[1:-1, 1:-1]
+    inner = numpy.where((inner == ord("#")) & (converted != 0), converted, inner).astype(numpy.uint8)
+
+    for y in range(1, height - 1):
+        row = symbols[y, :1].tobytes() + inner[y - 1].tobytes() + symbols[y, -1:].tobytes()
+        if not isinstance(row, str):
+            row = row.decode("ascii")
+        map[y] = row
+
+class WalkableGrid:
+
+    """
+    A compact grid recording which map cells cars may occupy, together with
+    tables mapping pixel coordinates to cells, so that car movements can be
+    checked without converting positions to map coordinates. Since maps are
+    surrounded by scenery, the neighbours of any walkable cell are found at
+    the grid positions before and after it and a row above and below it.
+    """
+
+    def __init__(self, map, cell_size):
+        self.width = len(map[0])
+        self.cell_size = cell_size
+        self.cells = bytearray(b"".join([
+            b"".join([(c in Config.space_or_group_symbols and b"\x01" or b"\x00") for c in row])
+            for row in map]))
+
+        # Tables mapping each pixel column to a map column and each pixel row
+        # to the start of a map row in the grid.
+
+        self.cell_x = [x // cell_size[0] for x in range(0, self.width * cell_size[0])]
+        self.row_y = [(y // cell_size[1]) * self.width for y in range(0, len(map) * cell_size[1])]
+
+    def passable(self, position):
+        return self.cells[self.row_y[int(position[1])] + self.cell_x[int(position[0])]]
+
+    def passable_cell(self, map_x, map_y):
+        return self.cells[map_y * self.width + map_x]
+
+    def centre_cell(self, position):
+
+        "Return the map cell containing the centre of an object at 'position'."
+
+        return self.cell_x[int(position[0] + self.cell_size[0] // 2)], \
+            self.row_y[int(position[1] + self.cell_size[1] // 2)] // self.width
+
+    def can_move(self, position, direction):
+
+        """
+        Return whether an object of the cell size at 'position' can move by the
+        given 'direction', being either horizontal or vertical, checking only
+        the cells entered by the leading edge of the object.
+        """
+
+        x, y = position
+        dx, dy = direction
+        cells, cell_x, row_y = self.cells, self.cell_x, self.row_y
+
+        if dy == 0:
+            if dx < 0:
+                column = cell_x[int(x + dx)]
+            else:
+                column = cell_x[int(x + dx + self.cell_size[0] - 1)]
+            return cells[row_y[int(y)] + column] and cells[row_y[int(y + self.cell_size[1] - 1)] + column]
+        else:
+            if dy < 0:
+                row = row_y[int(y + dy)]
+            else:
+                row = row_y[int(y + dy + self.cell_size[1] - 1)]
+            return cells[row + cell_x[int(x)]] and cells[row + cell_x[int(x + self.cell_size[0] - 1)]]
+
+class FlowField:
+
+    """
+    The distances to a target map cell from the reachable cells of a walkable
+    grid, found using a breadth-first search, so that any number of cars can
+    find their way to the target by stepping into neighbouring cells nearer to
+    the target. The search is only repeated when the target changes, and it
+    stops after reaching a limited number of cells, whose distances are the
+    only ones kept, so that it takes no longer and uses no more memory on large
+    maps than on small ones. Since maps are surrounded by scenery, the
+    neighbours of any walkable cell are found without checking the edges of
+    the grid.
+    """
+
+    steps = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+    limit = 1024 # more than the reachable cells of the usual map
+
+    def __init__(self, walkable):
+        self.walkable = walkable
+        self.target = None
+        self.distances = {}
+        self.queue = [0] * min(len(walkable.cells), self.limit)
+
+    def update(self, target):
+
+        "Find the distances to the 'target' map cell if it has changed."
+
+        if target == self.target:
+            return
+        self.target = target
+
+        self.distances = distances = {}
+        queue, cells, width = self.queue, self.walkable.cells, self.walkable.width
+        limit = len(queue)
+
+        start = target[1] * width + target[0]
+        if not cells[start]:
+            return
+
+        distances[start] = 0
+        queue[0] = start
+        head, tail = 0, 1
+
+        while head < tail:
+            current = queue[head]
+            head += 1
+            distance = distances[current] + 1
+            for neighbour in (current - 1, current + 1, current - width, current + width):
+                if cells[neighbour] and neighbour not in distances and tail < limit:
+                    distances[neighbour] = distance
+                    queue[tail] = neighbour
+                    tail += 1
+
+    def step(self, map_x, map_y, preferred=None):
+
+        """
+        Return the step, as a pair of signs, from the map cell at 'map_x' and
+        'map_y' to a neighbouring cell nearer the target, choosing 'preferred'
+        if it is such a step, or None if the cell is the target or unreachable.
+        """
+
+        width = self.walkable.width
+        distance = self.distances.get(map_y * width + map_x, -1)
+        if distance <= 0:
+            return None
+
+        steps = self.steps
+        if preferred in steps:
+            steps = [preferred] + steps
+
+        for dx, dy in steps:
+            x, y = map_x + dx, map_y + dy
+            if 0 <= x < width and self.distances.get(y * width + x) == distance - 1:
+                return dx, dy
+        return None
+
+class PathFinder:
+
+    """
+    A finder of shortest paths between map cells of a walkable grid using the
+    A* search, remembering the paths found so that objects following a path
+    need not search again from each cell along the way. Searches visiting too
+    many cells, as on large maps, give a path to the cell found nearest to the
+    target instead, with a new search being made from the end of such a path.
+    Since maps are surrounded by scenery, the neighbours of any walkable cell
+    are found without checking the edges of the grid.
+    """
+
+    cache_limit = 4096
+    search_limit = 1024 # more than the reachable cells of the usual map
+
+    def __init__(self, walkable):
+        self.walkable = walkable
+        self.cache = {}
+
+    def path(self, start, target):
+
+        """
+        Return a list of map cells, each given as an (x, y) tuple, leading from
+        the 'start' cell to the 'target' cell, or towards the target cell if it
+        is too far away, or None if no path exists.
+        """
+
+        width = self.walkable.width
+        start_index = start[1] * width + start[0]
+        target_index = target[1] * width + target[0]
+
+        key = start_index, target_index
+        if key not in self.cache:
+            path = self._search(start_index, target_index)
+            if len(self.cache) >= self.cache_limit:
+                self.cache = {}
+
+            # Remember the path from each cell along the way, except from the
+            # end of a path that does not reach the target, so that the search
+            # continues from there.
+
+            if path is None:
+                self.cache[key] = None
+            else:
+                end = len(path)
+                if path[-1] != target_index and end > 1:
+                    end -= 1
+                for i in range(0, end):
+                    self.cache[(path[i], target_index)] = path, i
+
+        entry = self.cache[key]
+        if entry is None:
+            return None
+        path, offset = entry
+        return [(index % width, index // width) for index in path[offset:]]
+
+    def length(self, start, target):
+
+        """
+        Return the number of steps from 'start' to 'target', or towards the target
+        if it is too far away, or None if unreachable.
+        """
+
+        path = self.path(start, target)
+        if path is None:
+            return None
+        return len(path) - 1
+
+    def _search(self, start, target):
+        cells, width = self.walkable.cells, self.walkable.width
+        if not cells[start] or not cells[target]:
+            return None
+
+        target_x, target_y = target % width, target // width
+
+        def estimate(index):
+            return abs(index % width - target_x) + abs(index // width - target_y)
+
+        # Entries are (estimated length, steps, cell) tuples, with cells being
+        # grid indexes so that no objects are ever compared.
+
+        previous = {start : None}
+        steps = {start : 0}
+        heap = [(estimate(start), 0, start)]
+        nearest = estimate(start), start
+        visited = 0
+
+        while heap:
+            total, taken, current = heapq.heappop(heap)
+            if current == target:
+                break
+            if taken > steps[current]:
+                continue
+
+            # On large maps, give up after visiting many cells, using the path
+            # to the cell found nearest to the target.
+
+            visited += 1
+            if visited > self.search_limit:
+                current = nearest[1]
+                break
+            nearest = min(nearest, (total - taken, current))
+
+            for neighbour in (current - 1, current + 1, current - width, current + width):
+                if not cells[neighbour]:
+                    continue
+                if neighbour not in steps or taken + 1 < steps[neighbour]:
+                    steps[neighbour] = taken + 1
+                    previous[neighbour] = current
+                    heapq.heappush(heap, (taken + 1 + estimate(neighbour), taken + 1, neighbour))
+        else:
+            return None
+
+        path = []
+        while current is not None:
+            path.append(current)
+            current = previous[current]
+        path.reverse()
+        return path
+
+# Surface caching.
+
+class SurfaceCache:
+
+    """
+    A cache of surfaces occupying no more than a given number of bytes, with
+    the least recently used surfaces being discarded to stay within the limit.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.entries = {}
+        self.size = 0
+        self.counter = 0
+
+    def get(self, key):
+
+        "Return the surface stored for 'key' or None if no surface is stored."
+
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.counter += 1
+        entry[1] = self.counter
+        return entry[0]
+
+    def put(self, key, surface, size=None):
+
+        """
+        Store the given 'surface' for 'key', discarding old surfaces if needed.
+        For objects holding surfaces, such as image atlases, the 'size' in bytes
+        must be given.
+        """
+
+        if key in self.entries:
+            self.remove(key)
+
+        self.counter += 1
+        if size is None:
+            size = surface.get_pitch() * surface.get_height()
+        self.entries[key] = [surface, self.counter, size]
+        self.size += size
+
+        while self.size > self.limit and len(self.entries) > 1:
+            oldest = None
+            for other_key, (other_surface, used, other_size) in self.entries.items():
+                if oldest is None or used < oldest[1]:
+                    oldest = other_key, used
+            self.remove(oldest[0])
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def remove(self, key):
+        surface, used, size = self.entries[key]
+        del self.entries[key]
+        self.size -= size
+
+    def clear(self):
+        self.entries = {}
+        self.size = 0
+
+# Image atlases.
+
+class Atlas:
+
+    """
+    A collection of images packed into a single surface, with each image being
+    shown by blitting its area of that surface.
+    """
+
+    def __init__(self, images, surface=None, areas=None):
+
+        """
+        Pack the given 'images' - a collection of (key, image) pairs - into a
+        new surface, unless an existing 'surface' and 'areas' are given.
+        """
+
+        if surface is not None:
+            self.surface = surface
+            self.areas = areas
+            return
+
+        self.areas = {}
+
+        # Place the images in rows, starting with the tallest images.
+
+        entries = []
+        width = Config.atlas_width
+        for index, (key, image) in enumerate(images):
+            if key in self.areas:
+                continue
+            self.areas[key] = None
+            w, h = image.get_size()
+            entries.append((-h, index, key, image))
+            width = max(width, w)
+        entries.sort()
+
+        x, y, row_height = 0, 0, 0
+        for minus_h, index, key, image in entries:
+            w, h = image.get_size()
+            if x + w > width:
+                x, y, row_height = 0, y + row_height, 0
+            self.areas[key] = pygame.Rect((x, y), (w, h))
+            x += w
+            row_height = max(row_height, h)
+
+        # Copy the images without blending them with the empty surface.
+
+        self.surface = pygame.Surface((width, max(1, y + row_height)), pygame.SRCALPHA, 32)
+        if pygame.display.get_surface() is not None:
+            self.surface = self.surface.convert_alpha()
+        self.surface.fill((0, 0, 0, 0))
+
+        for minus_h, index, key, image in entries:
+            self.surface.blit(image, self.areas[key], None, pygame.BLEND_RGBA_ADD)
+
+    def area(self, key):
+
+        "Return the area of the image for 'key' or None if no such image exists."
+
+        return self.areas.get(key)
+
+    def blit(self, surface, key, position):
+
+        "Blit the image for 'key' to 'surface' at 'position', returning the changed area."
+
+        return surface.blit(self.surface, position, self.areas[key])
+
+    def entry(self, key, position):
+
+        "Return an entry for use with blit_all, blitting the image for 'key' at 'position'."
+
+        return self.surface, position, self.areas[key]
+
+    def recoloured(self, colour):
+
+        "Return a copy of this atlas with all images shown in the given 'colour'."
+
+        surface = self.surface.copy()
+        pixels = pygame.surfarray.pixels3d(surface)
+        pixels[:,:,0] = colour[0]
+        pixels[:,:,1] = colour[1]
+        pixels[:,:,2] = colour[2]
+        del pixels
+        return Atlas(None, surface, self.areas)
+
+def image_entry(image, position):
+
+    """
+    Return an entry for use with blit_all, blitting 'image' at 'position' using
+    any atlas providing the image.
+    """
+
+    if Config.atlas is not None:
+        area = Config.atlas.area(image)
+        if area is not None:
+            return Config.atlas.surface, position, area
+    return image, position, None
+
+def blit_image(surface, image, position):
+
+    """
+    Blit 'image' to 'surface' at 'position' using any atlas providing the image,
+    returning the changed area.
+    """
+
+    return surface.blit(*image_entry(image, position))
+
+def blit_all(surface, entries):
+
+    """
+    Blit to 'surface' the given 'entries', each being a (source, position, area)
+    tuple, using a single call where supported.
+    """
+
+    if hasattr(surface, "blits"):
+        surface.blits(entries, 0)
+    else:
+        for source, position, area in entries:
+            surface.blit(source, position, area)
+
+def rotate(image, angle):
+
+    """
+    Return 'image' rotated by 'angle' degrees, using any previously rotated
+    version of the image.
+    """
+
+    key = image, angle
+    rotated = Config.rotation_cache.get(key)
+    if rotated is None:
+        rotated = pygame.transform.rotate(image, angle)
+        Config.rotation_cache.put(key, rotated)
+    return rotated
+
+# Display functions.
+
+def cpos(x, y):
+    return Config.character_size[0] * x, Config.character_size[1] * y
+
+def write(surface, position, colour, text):
+
+    """
+    Write 'text' in the given 'colour' at 'position' on 'surface', using any
+    previously rendered image of the text.
+    """
+
+    key = text, tuple(colour)
+    image = Config.text_cache.get(key)
+    if image is None:
+        image = render_text(text, colour)
+        Config.text_cache.put(key, image)
+    mark_dirty(surface, surface.blit(image, position))
+
+def render_text(text, colour):
+
+    "Return an image showing 'text' in the given 'colour'."
+
+    atlas = get_glyphs(colour)
+    areas = []
+    width = 0
+    for c in text:
+        area = atlas.area(c.upper())
+        areas.append(area)
+        if area is None:
+            width += Config.character_size[0]
+        else:
+            width += area.width
+
+    # Copy the glyphs without blending them with the empty image.
+
+    image = pygame.Surface((width, Config.character_size[1]), pygame.SRCALPHA, 32)
+    x = 0
+    for area in areas:
+        if area is None:
+            x += Config.character_size[0]
+            continue
+        image.blit(atlas.surface, (x, 0), area, pygame.BLEND_RGBA_ADD)
+        x += area.width
+
+    return image
+
+def get_glyphs(colour):
+
+    "Return an atlas of the character images in the given 'colour'."
+
+    key = tuple(colour)
+    atlas = Config.glyph_cache.get(key)
+    if atlas is None:
+        atlas = Config.character_atlas.recoloured(colour)
+        Config.glyph_cache.put(key, atlas, atlas.surface.get_pitch() * atlas.surface.get_height())
+    return atlas
+
+def mark_dirty(surface, rect):
+
+    """
+    Note that the area given by 'rect' on 'surface' needs showing when the
+    display is next updated, doing nothing if 'surface' is neither the display
+    nor a subsurface of the display.
+    """
+
+    display = pygame.display.get_surface()
+    if surface is not display:
+        if surface.get_parent() is not display:
+            return
+        rect = rect.move(surface.get_offset())
+    Config.dirty_rects.append(rect)
+
+def merge_rects(rects):
+
+    "Return a list of rectangles covering 'rects', combining overlapping ones."
+
+    merged = []
+    for rect in rects:
+        if not rect.width or not rect.height:
+            continue
+        i = 0
+        while i < len(merged):
+            if rect.colliderect(merged[i]):
+                rect = rect.union(merged[i])
+                del merged[i]
+                i = 0
             else:
-                new_row.append(row[x])
-        new_row.append(row[x+1])
-        map[y] = "".join(new_row)
+                i += 1
+        merged.append(rect)
+    return merged
 
-# Display functions.
+def update_display():
 
-def cpos(x, y):
-    return Config.character_size[0] * x, Config.character_size[1] * y
+    "Update only the areas of the display noted by mark_dirty."
 
-def write(surface, position, colour, text):
-    x, y = position
-    for c in text:
-        image = Config.characters.get(c.upper())
-        if image is None:
-            x += Config.character_size[0]
-            continue
-        pixels = pygame.surfarray.pixels3d(image)
-        pixels[:,:,0] = colour[0]
-        pixels[:,:,1] = colour[1]
-        pixels[:,:,2] = colour[2]
-        del pixels
-        surface.blit(image, (x, y))
-        x += image.get_rect().width
+    rects = merge_rects(Config.dirty_rects)
+    Config.dirty_rects = []
+    if rects:
+        pygame.display.update(rects)
+
+def flip_display():
+
+    "Update the entire display, forgetting any areas noted by mark_dirty."
+
+    Config.dirty_rects = []
+    pygame.display.flip()
 
 def recolour(image, start_colour, end_colour):
-    sr, sg, sb = start_colour
-    er, eg, eb = end_colour
+
+    """
+    Recolour 'image', blending each colour component from 'start_colour' to
+    'end_colour' according to the existing level of that component, working on
+    whole arrays of pixels at a time.
+    """
+
     pixels = pygame.surfarray.pixels3d(image)
-    for y in range(0, len(pixels)):
-        row = pixels[y]
-        for x in range(0, len(row)):
-            cell = row[x]
-            r = float(cell[0]) / 255
-            g = float(cell[1]) / 255
-            b = float(cell[2]) / 255
-            row[x] = (1-r)*sr + r*er, (1-g)*sg + g*eg, (1-b)*sb + b*eb
+    for channel in range(0, 3):
+        level = pixels[:,:,channel] / 255.0
+        pixels[:,:,channel] = (1 - level) * start_colour[channel] + level * end_colour[channel]
     del pixels
 
 def brightness(colour, level):
@@ -603,12 +1849,39 @@ def reset_requested(event):
             set_window()
         else:
             return 0
+
+        # Images prepared for the old display are no longer appropriate.
+
+        reset_caches()
         return 1
     return 0
 
+def player_action(event):
+
+    "Return the player action requested by 'event' or None if none was requested."
+
+    if event.type == pygame.KEYDOWN:
+        if event.key in Config.left_buttons:
+            return "left"
+        elif event.key in Config.right_buttons:
+            return "right"
+        elif event.key in Config.up_buttons:
+            return "up"
+        elif event.key in Config.down_buttons:
+            return "down"
+        elif event.key in Config.smoke_buttons:
+            return "smoke"
+    return None
+
 def snapshot_requested(event):
     return event.type == pygame.KEYDOWN and event.key in Config.snapshot_buttons
 
+def timing_requested(event):
+    return event.type == pygame.KEYDOWN and event.key in Config.timing_buttons
+
+def profile_requested(event):
+    return event.type == pygame.KEYDOWN and event.key in Config.profile_buttons
+
 def demo_requested(event):
     return event.type == pygame.KEYDOWN and event.key in Config.demo_buttons
 
@@ -638,8 +1911,25 @@ def music_ended(event):
 def save_screen(screen):
     pygame.image.save(screen, "%s%d.png" % (Config.snapshot_prefix, time.time()))
 
+def toggle_profiler():
+
+    """
+    Start sampling the program, or stop any sampling already started, writing
+    the samples to the profiler's file.
+    """
+
+    if Config.profiler is None:
+        Config.profiler = Profiler("%s%d.txt" % (Config.profile_prefix, time.time()))
+        Config.profiler.start()
+    else:
+        Config.profiler.stop()
+        Config.profiler = None
+
 # Utility functions.
 
+def get_layer(obj):
+    return obj.layer
+
 def sign(x):
     if x > 0:
         return 1
@@ -648,6 +1938,450 @@ def sign(x):
     else:
         return 0
 
+def find_space_cells(map, samples):
+
+    """
+    Return the map cells of spaces in 'map' for objects placed using the given
+    'samples': a list of row tenths and a list of column tenths.
+    """
+
+    # Produce the objects as coordinates in the results list.
+
+    results = []
+    for y, x in zip(*samples):
+        y = int(float(y)/10 * Config.map_size[1]) + Config.map_border[1]
+        row = map[y]
+
+        # Do not place objects in the start area.
+
+        if Config.start_area_y[1] >= y >= Config.start_area_y[0]:
+            count = (row[:Config.start_area_x[0]] + row[Config.start_area_x[1] + 1:]).count(" ")
+        else:
+            count = row.count(" ")
+
+        x = int(float(x)/10 * count)
+        index = row.index(" ")
+        while x > 0:
+            index = row.index(" ", index + 1)
+
+            # Do not place objects in the start area.
+
+            if y < Config.start_area_y[0] or index < Config.start_area_x[0] or index > Config.start_area_x[1]:
+                x -= 1
+        results.append((index, y))
+
+    return results
+
+def find_group_cells(map, samples):
+
+    """
+    Return the map cells in 'map' of rock groups chosen using the given
+    'samples': a list of group numbers and a list of occurrences (0 or 1).
+    """
+
+    results = []
+    for group, occurrence in zip(*samples):
+        nfound = 0
+        for y in range(0, Config.map_size[1]):
+            y = y + Config.map_border[1]
+            row = map[y]
+            count = row.count(str(group))
+            if occurrence < nfound + count:
+                x = nfound + count - occurrence - 1
+                index = row.index(str(group))
+                while x > 0:
+                    index = row.index(str(group), index + 1)
+                    x -= 1
+                results.append((index, y))
+                break
+            nfound += count
+    return results
+
+# Level rendering.
+
+class LevelRenderer:
+
+    """
+    A renderer for a level map, drawing the map cells once into a number of
+    chunk surfaces so that a view onto the map can be shown using a handful of
+    blits instead of one blit per visible cell.
+
+    Chunks are drawn when first shown or, one per frame, when next to the view,
+    with the least recently shown chunks being discarded to stay within
+    Config.chunk_cache_limit. Chunks at the right and bottom edges of the map
+    only cover the remaining cells.
+    """
+
+    chunk_size = 8, 8
+
+    def __init__(self, map):
+        self.map = map
+        self.cell_size = Config.object_size
+        self.chunk_pixels = self.chunk_size[0] * self.cell_size[0], self.chunk_size[1] * self.cell_size[1]
+        self.map_size = max([len(row) for row in map]), len(map)
+        self.map_pixels = self.map_size[0] * self.cell_size[0], self.map_size[1] * self.cell_size[1]
+        self.chunk_count = (self.map_size[0] + self.chunk_size[0] - 1) // self.chunk_size[0], \
+            (self.map_size[1] + self.chunk_size[1] - 1) // self.chunk_size[1]
+        self.chunks = SurfaceCache(Config.chunk_cache_limit)
+
+        self.chunk_bytes = self.chunk_pixels[0] * self.chunk_pixels[1] * pygame.display.get_surface().get_bytesize()
+
+    def _render_chunk(self, chunk_x, chunk_y):
+
+        "Render the chunk at 'chunk_x' and 'chunk_y' in the grid of chunks."
+
+        x_start = chunk_x * self.chunk_size[0]
+        y_start = chunk_y * self.chunk_size[1]
+
+        surface = pygame.Surface((
+            min(self.chunk_size[0], self.map_size[0] - x_start) * self.cell_size[0],
+            min(self.chunk_size[1], self.map_size[1] - y_start) * self.cell_size[1])).convert()
+        surface.fill(Config.bgcolour)
+
+        entries = []
+        blit_y = 0
+        for y in range(y_start, min(y_start + self.chunk_size[1], self.map_size[1])):
+            row = self.map[y]
+            blit_x = 0
+            for x in range(x_start, min(x_start + self.chunk_size[0], len(row))):
+                self._blit_symbol(entries, row[x], blit_x, blit_y)
+                blit_x += self.cell_size[0]
+            blit_y += self.cell_size[1]
+
+        blit_all(surface, entries)
+        return surface
+
+    def _blit_symbol(self, entries, c, blit_x, blit_y):
+        symbol = Config.symbols.get(c)
+        image = Config.objects.get(symbol)
+        if image is not None:
+            entries.append(image_entry(image, (blit_x, blit_y)))
+
+    def blit(self, screen, position):
+
+        """
+        Show the map on the given 'screen' with the top left of the screen
+        corresponding to the given exact 'position' on the map.
+        """
+
+        x, y = int(math.floor(position[0])), int(math.floor(position[1]))
+        width, height = screen.get_size()
+
+        # Only areas outside the map need filling with the background.
+
+        if x < 0 or y < 0 or x + width > self.map_pixels[0] or y + height > self.map_pixels[1]:
+            screen.fill(Config.bgcolour)
+
+        chunk_width, chunk_height = self.chunk_pixels
+        chunk_x_start = max(0, x // chunk_width)
+        chunk_x_end = min(self.chunk_count[0], (x + width - 1) // chunk_width + 1)
+        chunk_y_start = max(0, y // chunk_height)
+        chunk_y_end = min(self.chunk_count[1], (y + height - 1) // chunk_height + 1)
+
+        for chunk_y in range(chunk_y_start, chunk_y_end):
+            for chunk_x in range(chunk_x_start, chunk_x_end):
+                chunk = self.chunks.get((chunk_x, chunk_y))
+                if chunk is None:
+                    chunk = self._render_chunk(chunk_x, chunk_y)
+                    self.chunks.put((chunk_x, chunk_y), chunk)
+                screen.blit(chunk, (chunk_x * chunk_width - x, chunk_y * chunk_height - y))
+
+        # Draw chunks next to the view only if they can be kept with the chunks
+        # being shown.
+
+        if (chunk_x_end - chunk_x_start + 2) * (chunk_y_end - chunk_y_start + 2) * \
+            self.chunk_bytes <= Config.chunk_cache_limit:
+
+            self._prepare_chunk(chunk_x_start - 1, chunk_x_end + 1, chunk_y_start - 1, chunk_y_end + 1)
+
+    def _prepare_chunk(self, chunk_x_start, chunk_x_end, chunk_y_start, chunk_y_end):
+
+        """
+        Draw the first missing chunk in the given range of chunks, so that the
+        chunks are ready before they are shown.
+        """
+
+        for chunk_y in range(max(0, chunk_y_start), min(self.chunk_count[1], chunk_y_end)):
+            for chunk_x in range(max(0, chunk_x_start), min(self.chunk_count[0], chunk_x_end)):
+                if (chunk_x, chunk_y) not in self.chunks:
+                    self.chunks.put((chunk_x, chunk_y), self._render_chunk(chunk_x, chunk_y))
+                    return
+
+# Spatial indexing.
+
+class SpatialIndex:
+
+    """
+    A uniform grid of map cells holding game objects, so that objects near a
+    position can be found without considering every object. Objects are also
+    held in chunks of cells, so that the objects in a large area, such as a
+    view onto the map, can be found quickly. Objects must be updated in the
+    index whenever they move.
+    """
+
+    chunk_size = 16
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.chunks = {}
+        self.objects = {}
+        self.order = {}
+        self.added = 0
+        self.offsets = {}
+        self.rings = {}
+
+    def _cell(self, position):
+        return int(position[0] // self.cell_size[0]), int(position[1] // self.cell_size[1])
+
+    def add(self, obj):
+        self.added += 1
+        self.order[obj] = self.added
+        self._link(obj, self._cell(obj.position))
+
+    def remove(self, obj):
+        self._unlink(obj)
+        del self.order[obj]
+
+    def update(self, obj):
+
+        "Move 'obj' to the cell for its current position if it has changed."
+
+        cell = int(obj.position[0] // self.cell_size[0]), int(obj.position[1] // self.cell_size[1])
+        if self.objects[obj] != cell:
+            self._unlink(obj)
+            self._link(obj, cell)
+
+    def _link(self, obj, cell):
+        self.objects[obj] = cell
+        if cell not in self.cells:
+            self.cells[cell] = []
+        self.cells[cell].append(obj)
+
+        chunk = cell[0] // self.chunk_size, cell[1] // self.chunk_size
+        if chunk not in self.chunks:
+            self.chunks[chunk] = []
+        self.chunks[chunk].append(obj)
+
+    def _unlink(self, obj):
+        cell = self.objects[obj]
+        del self.objects[obj]
+        objects = self.cells[cell]
+        objects.remove(obj)
+        if not objects:
+            del self.cells[cell]
+
+        chunk = cell[0] // self.chunk_size, cell[1] // self.chunk_size
+        objects = self.chunks[chunk]
+        objects.remove(obj)
+        if not objects:
+            del self.chunks[chunk]
+
+    def in_area(self, position, size):
+
+        """
+        Return the objects that may overlap the area at the exact 'position' with
+        the given 'size', being those in the chunks of the cells in or next to
+        the area, in the order they were added to the index.
+        """
+
+        chunk_size = self.chunk_size
+        x_start = (int(position[0] // self.cell_size[0]) - 1) // chunk_size
+        x_end = int((position[0] + size[0]) // self.cell_size[0]) // chunk_size
+        y_start = (int(position[1] // self.cell_size[1]) - 1) // chunk_size
+        y_end = int((position[1] + size[1]) // self.cell_size[1]) // chunk_size
+
+        found = []
+        chunks = self.chunks
+        for chunk_y in range(y_start, y_end + 1):
+            for chunk_x in range(x_start, x_end + 1):
+                objects = chunks.get((chunk_x, chunk_y))
+                if objects:
+                    found += objects
+        found.sort(key=self.order.get)
+        return found
+
+    def near(self, position, distance=1):
+
+        """
+        Return the objects in cells no more than 'distance' cells away from the
+        cell containing 'position'. Objects overlapping an object at 'position'
+        are always found in neighbouring cells.
+        """
+
+        x, y = self._cell(position)
+        cells = self.cells
+        found = []
+        for dx, dy in self._offsets(distance):
+            objects = cells.get((x + dx, y + dy))
+            if objects:
+                found += objects
+        return found
+
+    def _offsets(self, distance):
+
+        "Return the cell offsets for cells no more than 'distance' cells away."
+
+        if distance not in self.offsets:
+            self.offsets[distance] = [(dx, dy) for dy in range(-distance, distance + 1)
+                for dx in range(-distance, distance + 1)]
+        return self.offsets[distance]
+
+    def within(self, position, radius):
+
+        """
+        Return a list of (distance, object) tuples for objects no further than
+        'radius' from 'position', nearest first and then in the order they were
+        added to the index.
+        """
+
+        found = []
+        for obj in self.near(position, int(radius // min(self.cell_size)) + 1):
+            distance = self._distance(position, obj)
+            if distance <= radius:
+                found.append((distance, self.order[obj], obj))
+        found.sort()
+        return [(distance, obj) for distance, added, obj in found]
+
+    def nearest(self, position, objects):
+
+        """
+        Return a (distance, object) tuple for the nearest of the given 'objects'
+        to 'position', preferring objects appearing earlier in 'objects' when
+        they are equally near, or None if no objects are given.
+        """
+
+        order = {}
+        for i, obj in enumerate(objects):
+            order[obj] = i
+
+        # Visit the cells in rings around the position until no nearer object
+        # can be found in the remaining rings, comparing the objects directly
+        # if the rings become larger than the number of objects warrants.
+
+        x, y = self._cell(position)
+        cells = self.cells
+        size = min(self.cell_size)
+        remaining = len(order) * 9
+        best = None
+        ring = 0
+
+        while 1:
+            if best is not None and (ring - 1) * size > best[0]:
+                break
+            offsets = self._ring(ring)
+            if len(offsets) > remaining:
+                for obj in objects:
+                    candidate = self._distance(position, obj), order[obj], obj
+                    if best is None or candidate[:2] < best[:2]:
+                        best = candidate
+                break
+            remaining -= len(offsets)
+            for dx, dy in offsets:
+                for obj in cells.get((x + dx, y + dy), ()):
+                    if obj in order:
+                        candidate = self._distance(position, obj), order[obj], obj
+                        if best is None or candidate[:2] < best[:2]:
+                            best = candidate
+            ring += 1
+
+        if best is None:
+            return None
+        return best[0], best[2]
+
+    def _ring(self, ring):
+
+        "Return the cell offsets for cells exactly 'ring' cells away."
+
+        if ring not in self.rings:
+            self.rings[ring] = [(dx, dy) for dx, dy in self._offsets(ring)
+                if max(abs(dx), abs(dy)) == ring]
+        return self.rings[ring]
+
+    def _distance(self, position, obj):
+        dx = obj.position[0] - position[0]
+        dy = obj.position[1] - position[1]
+        return math.sqrt(dx ** 2 + dy ** 2)
+
+# Radar display.
+
+class Radar:
+
+    """
+    A radar showing the map cells of objects as dots on a surface which keeps
+    the dots between updates, so that only dots whose map cell or colour has
+    changed need to be redrawn.
+    """
+
+    def __init__(self, surface, colour, map_size):
+        self.surface = surface
+        self.colour = colour
+        self.set_map_size(map_size)
+
+    def set_map_size(self, map_size):
+
+        "Scale the radar to show a play area of the given 'map_size' in cells."
+
+        width, height = self.surface.get_size()
+        self.dot_size = float(width) / map_size[0], float(height) / map_size[1]
+        self.clear()
+
+    def clear(self):
+
+        "Erase all dots from the radar."
+
+        mark_dirty(self.surface, self.surface.fill(self.colour))
+        self.markers = {}
+
+    def dot_rect(self, position):
+
+        "Return the dot area for an object at the given exact 'position'."
+
+        map_x, offset_x, map_y, offset_y = exact_to_map(position)
+        map_x, map_y = map_x - Config.map_border[0], map_y - Config.map_border[1]
+        return pygame.Rect(int(map_x * self.dot_size[0]), int(map_y * self.dot_size[1]),
+            max(1, int(self.dot_size[0])), max(1, int(self.dot_size[1])))
+
+    def update(self, markers):
+
+        """
+        Show the given 'markers', each being an (object, position, colour)
+        tuple, in order, with later markers appearing on top of earlier ones.
+        A colour of None causes the object to be omitted from the radar.
+        """
+
+        dots = []
+        current = {}
+        areas = []
+
+        for object, position, colour in markers:
+            if colour is None:
+                continue
+            rect = self.dot_rect(position)
+            dots.append((rect, colour))
+            current[object] = rect, colour
+
+            old = self.markers.get(object)
+            if old != (rect, colour):
+                areas.append(rect)
+                if old is not None:
+                    areas.append(old[0])
+
+        for object, (rect, colour) in self.markers.items():
+            if object not in current:
+                areas.append(rect)
+
+        self.markers = current
+
+        # Redraw only the changed areas, respecting the order of the dots.
+
+        for area in merge_rects(areas):
+            self.surface.fill(self.colour, area)
+            for rect, colour in dots:
+                if rect.colliderect(area):
+                    self.surface.fill(colour, rect.clip(area))
+            mark_dirty(self.surface, area)
+
 # Handlers for different sections of the game.
 
 class Handler:
@@ -700,7 +2434,11 @@ class Info(Handler):
         self.info_size = cpos(8, 24)
         self.radar_position = cpos(28, 7)
         self.radar_size = cpos(8, 14)
-        self.dot_size = float(self.radar_size[0]) / Config.map_size[0], float(self.radar_size[1]) / Config.map_size[1]
+        if self.screen is not None:
+            self.radar = Radar(self.screen.subsurface(pygame.Rect(self.radar_position, self.radar_size)),
+                self.radar_colour, Config.map_size)
+        else:
+            self.radar = None
         self.dot_flash_counter = 0
         self.dot_flash_rate = int(0.5 * Config.framerate)
         self.dot_flash_state = 1
@@ -740,13 +2478,15 @@ class Info(Handler):
         self.lives = 3
         self.new_hi_score = 0
 
-    def start_level(self):
+    def start_level(self, map_size=None):
 
         """
         Start a level, causing the display to be updated with the new level
-        details.
+        details. If specified, the 'map_size' of the level's play area is used
+        to scale the radar.
         """
 
+        self.radar.set_map_size(map_size or Config.map_size)
         self.show_level()
 
     def next_level(self):
@@ -809,7 +2549,7 @@ class Info(Handler):
 
         screen = self.screen
         screen.fill(self.info_colour, pygame.Rect(self.info_position, self.info_size))
-        screen.fill(self.radar_colour, pygame.Rect(self.radar_position, self.radar_size))
+        self.radar.clear()
         write(screen, cpos(28, 0), (255, 255, 255), "HI-SCORE")
         self._write_score(Config.hi_score, 1, (255, 0, 0))
         if self.in_game:
@@ -830,7 +2570,7 @@ class Info(Handler):
     def _write_score(self, score, y, colour):
         screen = self.screen
         s = str(score)
-        screen.fill(self.info_colour, pygame.Rect(cpos(28, y), cpos(8, 1)))
+        mark_dirty(screen, screen.fill(self.info_colour, pygame.Rect(cpos(28, y), cpos(8, 1))))
         write(screen, cpos(36-len(s), y), colour, s)
 
     def _fuel_gauge(self):
@@ -854,42 +2594,51 @@ class Info(Handler):
             screen.fill(colour, pygame.Rect((x, y), size))
             x += x_inc
 
-    def update(self, objects):
+    def toggle_timing(self):
+
+        "Show or hide the frame timing overlay, timing frames while it is shown."
+
+        if Config.timer is None:
+            Config.timer = FrameTimer()
+        Config.timer.overlay = not Config.timer.overlay
+
+        if not Config.timer.overlay:
+            if Config.timer.out is None:
+                Config.timer = None
+            self.radar.clear()
+
+    def show_timing(self, timer):
 
         """
-        Refresh the information on the panel using the given 'objects' to
-        reposition markers on the radar.
+        Show the 99th percentile times, in microseconds, of the phases of recent
+        frames from 'timer' over the radar.
         """
 
         screen = self.screen
-        self.reset_markers()
+        labels = timer.labels + ["FR"]
+        phases = timer.phases + ["frame"]
+        mark_dirty(screen, screen.fill(self.info_colour, pygame.Rect(cpos(28, 8), cpos(8, len(phases) + 1))))
+        write(screen, cpos(28, 8), (255, 255, 255), "P99 US")
+        for i, (label, phase) in enumerate(zip(labels, phases)):
+            write(screen, cpos(28, 9 + i), (0, 255, 0), "%s%6d" % (label, timer.percentile(phase, 0.99) * 1000000))
 
-        # Plot new markers, where appropriate.
+    def update(self, objects):
 
-        self.markers = []
-        for object in objects:
-            map_x, offset_x, map_y, offset_y = exact_to_map(object.position)
-            map_x, map_y = map_x - Config.map_border[0], map_y - Config.map_border[1]
-            position = self.radar_position[0] + map_x * self.dot_size[0], self.radar_position[1] + map_y * self.dot_size[1]
-            self.markers.append((position, object))
+        """
+        Refresh the information on the panel using the given 'objects' to
+        reposition markers on the radar.
+        """
 
+        self.markers = objects
         self.update_markers()
         self.update_fuel()
 
-    def reset_markers(self):
-
-        "Erase the markers on the radar."
-
-        screen = self.screen
-        for position, object in self.markers:
-            self.screen.fill(self.radar_colour, pygame.Rect(position, self.dot_size))
-
     def update_markers(self):
 
         "Update the markers on the radar."
 
-        screen = self.screen
-        for position, object in self.markers:
+        markers = []
+        for object in self.markers:
 
             # Make the player flash on and off.
 
@@ -898,9 +2647,11 @@ class Info(Handler):
                 # Indicate "targeted" objects.
 
                 if getattr(object, "targeted", 0):
-                    screen.fill(brightness(object.radar_colour, 0.5), pygame.Rect(position, self.dot_size))
+                    markers.append((object, object.position, brightness(object.radar_colour, 0.5)))
                 else:
-                    screen.fill(object.radar_colour, pygame.Rect(position, self.dot_size))
+                    markers.append((object, object.position, object.radar_colour))
+
+        self.radar.update(markers)
 
         # Loop the counter, changing the state on every loop.
 
@@ -918,7 +2669,7 @@ class Info(Handler):
         if flag is not None:
             if flag.flag_type == "S":
                 self.score_flag = self.score_flag * 2
-            flag.image = Config.objects[str(self.score_flag)]
+            flag.image = Config.objects.get(str(self.score_flag))
             self.score += self.score_flag
         self.update_score()
 
@@ -937,9 +2688,9 @@ class Info(Handler):
 
         screen = self.screen
         position = cpos(28, 21)
-        screen.fill(self.info_colour, pygame.Rect(position, cpos(8, 1)))
+        mark_dirty(screen, screen.fill(self.info_colour, pygame.Rect(position, cpos(8, 1))))
         for life in range(0, min(self.lives, 4)):
-            screen.blit(Config.infos["life"], position)
+            blit_image(screen, Config.infos["life"], position)
             position = position[0] + Config.info_size[0], position[1]
 
     def update_fuel(self):
@@ -949,7 +2700,7 @@ class Info(Handler):
         screen = self.screen
         empty_width = math.ceil((self.fuel_capacity - self.player.fuel) * self.fuel_unit)
         full_width = int(self.player.fuel * self.fuel_unit)
-        screen.fill(self.info_colour, pygame.Rect(self.fuel_position, self.fuel_size))
+        mark_dirty(screen, screen.fill(self.info_colour, pygame.Rect(self.fuel_position, self.fuel_size)))
         screen.fill(self.player.fuel_colour, pygame.Rect((self.fuel_position[0] + empty_width, self.fuel_position[1]), (full_width, self.fuel_size[1])))
 
     def drain_fuel(self):
@@ -963,7 +2714,6 @@ class Info(Handler):
         if self.player.fuel > 0:
             self.player.fuel -= self.fuel_score_unit
             self.score += 20
-            self.reset_markers()
             self.update_fuel()
             self.update_markers()
             self.update_score()
@@ -971,6 +2721,34 @@ class Info(Handler):
         else:
             return 0
 
+class HeadlessInfo(Info):
+
+    """
+    An information panel managing the same information as Info but without a
+    screen, showing nothing.
+    """
+
+    def start_level(self, map_size=None):
+        pass
+
+    def show(self):
+        pass
+
+    def show_level(self):
+        pass
+
+    def _write_score(self, score, y, colour):
+        pass
+
+    def update_markers(self):
+        pass
+
+    def update_lives(self):
+        pass
+
+    def update_fuel(self):
+        pass
+
 class Titles(Handler):
 
     "The game title screen, showing the different game objects."
@@ -982,7 +2760,7 @@ class Titles(Handler):
         screen = self.screen
         screen.fill((255, 160, 90))
         self.info.show()
-        screen.blit(Config.specials["logo"], cpos(9, 0.5))
+        blit_image(screen, Config.specials["logo"], cpos(9, 0.5))
         write(screen, cpos(10, 4.5), (255, 255, 255), "CAST")
         write(screen, cpos(8, 6.5), (255, 255, 255), "MY CAR")
         write(screen, cpos(8, 8.5), (255, 255, 255), "RED CAR")
@@ -992,13 +2770,13 @@ class Titles(Handler):
         write(screen, cpos(8, 16.5), (255, 255, 255), "ROCK (DANGER!)")
         write(screen, cpos(8, 18.5), (255, 255, 255), "SMOKE SCREEN")
         write(screen, cpos(10, 21.5), (240, 0, 0), "INFUKOR")
-        screen.blit(Config.objects["car"], cpos(4, 6))
-        screen.blit(Config.objects["car-red"], cpos(4, 8))
-        screen.blit(Config.objects["flag"], cpos(4, 10))
-        screen.blit(Config.objects["flag-S"], cpos(4, 12))
-        screen.blit(Config.objects["flag-L"], cpos(4, 14))
-        screen.blit(Config.objects["rock"], cpos(4, 16))
-        screen.blit(Config.objects["smoke"], cpos(4, 18))
+        blit_image(screen, Config.objects["car"], cpos(4, 6))
+        blit_image(screen, Config.objects["car-red"], cpos(4, 8))
+        blit_image(screen, Config.objects["flag"], cpos(4, 10))
+        blit_image(screen, Config.objects["flag-S"], cpos(4, 12))
+        blit_image(screen, Config.objects["flag-L"], cpos(4, 14))
+        blit_image(screen, Config.objects["rock"], cpos(4, 16))
+        blit_image(screen, Config.objects["smoke"], cpos(4, 18))
 
     def mainloop(self):
 
@@ -1009,7 +2787,7 @@ class Titles(Handler):
 
         screen = self.screen
         self.show()
-        pygame.display.flip()
+        flip_display()
 
         set_next_screen(1)
         while 1:
@@ -1028,6 +2806,8 @@ class Titles(Handler):
                     return SHOW_INSTRUCTIONS
                 elif snapshot_requested(event):
                     save_screen(screen)
+                elif profile_requested(event):
+                    toggle_profiler()
                 elif demo_requested(event):
                     return START_DEMO
 
@@ -1057,7 +2837,7 @@ class Help(Handler):
         if state:
             write(screen, cpos(2, 21), (255, 255, 255), "ESCAPE     - EXIT")
         else:
-            screen.fill((0, 0, 0), pygame.Rect(cpos(2, 21), cpos(17, 1)))
+            mark_dirty(screen, screen.fill((0, 0, 0), pygame.Rect(cpos(2, 21), cpos(17, 1))))
 
     def mainloop(self):
 
@@ -1068,7 +2848,7 @@ class Help(Handler):
 
         screen = self.screen
         self.show()
-        pygame.display.flip()
+        flip_display()
 
         counter = 0
         state = 0
@@ -1086,6 +2866,8 @@ class Help(Handler):
                     return SHOW_START
                 elif snapshot_requested(event):
                     save_screen(screen)
+                elif profile_requested(event):
+                    toggle_profiler()
                 elif demo_requested(event):
                     return START_DEMO
 
@@ -1098,7 +2880,7 @@ class Help(Handler):
             if counter == 0:
                 state = not state
                 self.show_text(state)
-                pygame.display.flip()
+                update_display()
 
 class Instructions(Handler):
 
@@ -1126,7 +2908,7 @@ class Instructions(Handler):
         "Show some text according to the given 'index'."
 
         screen = self.screen
-        screen.fill(Config.bgcolour, pygame.Rect(cpos(8, 21.5), cpos(11, 1)))
+        mark_dirty(screen, screen.fill(Config.bgcolour, pygame.Rect(cpos(8, 21.5), cpos(11, 1))))
         if index == 0:
             write(screen, cpos(10, 21.5), (240, 0, 0), "INFUKOR")
         else:
@@ -1137,8 +2919,8 @@ class Instructions(Handler):
         "Show a particular kind of flag, indicated by 'name'."
 
         screen = self.screen
-        screen.fill(Config.bgcolour, pygame.Rect(cpos(7, 14), Config.object_size))
-        screen.blit(Config.objects[name], cpos(7, 14))
+        mark_dirty(screen, screen.fill(Config.bgcolour, pygame.Rect(cpos(7, 14), Config.object_size)))
+        blit_image(screen, Config.objects[name], cpos(7, 14))
 
     def show_flag_score(self, name, name2=None):
 
@@ -1149,12 +2931,12 @@ class Instructions(Handler):
 
         screen = self.screen
         position = cpos(11, 14)
-        screen.fill(Config.bgcolour, pygame.Rect(position, Config.object_size))
-        screen.blit(Config.objects[name], position)
+        mark_dirty(screen, screen.fill(Config.bgcolour, pygame.Rect(position, Config.object_size)))
+        blit_image(screen, Config.objects[name], position)
         new_position = (position[0] + Config.object_size[0], position[1])
-        screen.fill(Config.bgcolour, pygame.Rect(new_position, Config.object_size))
+        mark_dirty(screen, screen.fill(Config.bgcolour, pygame.Rect(new_position, Config.object_size)))
         if name2:
-            screen.blit(Config.objects[name2], new_position)
+            blit_image(screen, Config.objects[name2], new_position)
 
     def mainloop(self):
 
@@ -1166,7 +2948,7 @@ class Instructions(Handler):
 
         screen = self.screen
         self.show()
-        pygame.display.flip()
+        flip_display()
 
         set_next_screen(1, 12000)
         counter = 0
@@ -1189,6 +2971,8 @@ class Instructions(Handler):
                     return START_DEMO
                 elif snapshot_requested(event):
                     save_screen(screen)
+                elif profile_requested(event):
+                    toggle_profiler()
                 elif demo_requested(event):
                     return START_DEMO
 
@@ -1214,7 +2998,7 @@ class Instructions(Handler):
                     self.show_flag_score(str(100 * (counter / Config.framerate) % 1000 + 100), "x2")
                 else:
                     self.show_flag_score("???")
-                pygame.display.flip()
+                update_display()
 
 class Challenging(Handler):
 
@@ -1241,7 +3025,7 @@ class Challenging(Handler):
         "Show a game object with the given 'name' at the given 'position'."
 
         screen = self.screen
-        screen.blit(Config.objects[name], position)
+        mark_dirty(screen, blit_image(screen, Config.objects[name], position))
 
     def mainloop(self):
 
@@ -1253,7 +3037,7 @@ class Challenging(Handler):
 
         screen = self.screen
         self.show()
-        pygame.display.flip()
+        flip_display()
 
         play_music("challenging_intro_theme")
 
@@ -1272,6 +3056,8 @@ class Challenging(Handler):
                     return END_SEQUENCE
                 elif snapshot_requested(event):
                     save_screen(screen)
+                elif profile_requested(event):
+                    toggle_profiler()
 
             # Loop counter every 2s.
 
@@ -1287,7 +3073,7 @@ class Challenging(Handler):
                 elif state == 2:
                     write(screen, cpos(14, 14.5), (255, 255, 255), "= %d" % self.nrocks)
                     self.show_object("rock", cpos(10, 14))
-                pygame.display.flip()
+                update_display()
 
         pygame.time.delay(2000)
 
@@ -1299,7 +3085,7 @@ class Start(Handler):
         screen = self.screen
         screen.fill((0, 0, 0))
         self.info.show()
-        screen.blit(Config.specials["logo"], cpos(9, 0.5))
+        blit_image(screen, Config.specials["logo"], cpos(9, 0.5))
         self.show_text(1)
         self.show_credits()
 
@@ -1308,17 +3094,17 @@ class Start(Handler):
         if state:
             write(screen, cpos(6, 8.5), (255, 255, 255), "PRESS 1UP TO START")
         else:
-            screen.fill((0, 0, 0), pygame.Rect(cpos(6, 8.5), cpos(18, 1)))
+            mark_dirty(screen, screen.fill((0, 0, 0), pygame.Rect(cpos(6, 8.5), cpos(18, 1))))
 
     def show_credits(self):
         screen = self.screen
-        screen.fill((0, 0, 0), pygame.Rect(cpos(10, 21.5), cpos(10, 1)))
+        mark_dirty(screen, screen.fill((0, 0, 0), pygame.Rect(cpos(10, 21.5), cpos(10, 1))))
         write(screen, cpos(10, 21.5), (255, 0, 0), "CREDITS %2d" % min(Config.credits, 99))
 
     def mainloop(self):
         screen = self.screen
         self.show()
-        pygame.display.flip()
+        flip_display()
 
         set_next_screen(0)
         state = 1
@@ -1331,12 +3117,14 @@ class Start(Handler):
                 elif coin_inserted(event):
                     Config.credits += 1
                     self.show_credits()
-                    pygame.display.flip()
+                    update_display()
                 elif start_requested(event):
                     Config.credits -= 1
                     return START_GAME
                 elif snapshot_requested(event):
                     save_screen(screen)
+                elif profile_requested(event):
+                    toggle_profiler()
 
             # Loop counter every 1s.
 
@@ -1347,7 +3135,7 @@ class Start(Handler):
             if counter == 0:
                 state = not state
                 self.show_text(state)
-                pygame.display.flip()
+                update_display()
 
 class GameOver(Handler):
 
@@ -1361,18 +3149,18 @@ class GameOver(Handler):
 
     def show_text(self, state):
         screen = self.screen
-        screen.fill((0, 0, 0), pygame.Rect(cpos(10, 10.5), cpos(10, 1)))
+        mark_dirty(screen, screen.fill((0, 0, 0), pygame.Rect(cpos(10, 10.5), cpos(10, 1))))
         write(screen, cpos(10, 10.5), (255, 255 * state, 255 * state), "GAME OVER!")
 
     def show_credits(self):
         screen = self.screen
-        screen.fill((0, 0, 0), pygame.Rect(cpos(10, 21.5), cpos(10, 1)))
+        mark_dirty(screen, screen.fill((0, 0, 0), pygame.Rect(cpos(10, 21.5), cpos(10, 1))))
         write(screen, cpos(10, 21.5), (255, 0, 0), "CREDITS %2d" % min(Config.credits, 99))
 
     def mainloop(self):
         screen = self.screen
         self.show()
-        pygame.display.flip()
+        flip_display()
 
         set_next_screen(1)
         state = 1
@@ -1385,11 +3173,13 @@ class GameOver(Handler):
                 elif coin_inserted(event):
                     Config.credits += 1
                     self.show_credits()
-                    pygame.display.flip()
+                    update_display()
                 elif next_screen_requested(event):
                     return END_GAME
                 elif snapshot_requested(event):
                     save_screen(screen)
+                elif profile_requested(event):
+                    toggle_profiler()
 
             # Loop counter every 1s.
 
@@ -1400,7 +3190,7 @@ class GameOver(Handler):
             if counter == 0:
                 state = not state
                 self.show_text(state)
-                pygame.display.flip()
+                update_display()
 
 class HighScore(Handler):
 
@@ -1410,13 +3200,13 @@ class HighScore(Handler):
         screen = self.screen
         screen.fill((0, 0, 0))
         self.info.show()
-        screen.blit(Config.specials["logo"], cpos(9, 0.5))
+        blit_image(screen, Config.specials["logo"], cpos(9, 0.5))
         self.show_text(0)
 
     def show_text(self, state):
         screen = self.screen
         on = [(255 * (state == n)) for n in range(1, 5)]
-        screen.fill((0, 0, 0), pygame.Rect(cpos(7.5, 8.5), cpos(17, 7)))
+        mark_dirty(screen, screen.fill((0, 0, 0), pygame.Rect(cpos(7.5, 8.5), cpos(17, 7))))
         write(screen, cpos(8, 8.5), (255, on[0], on[0]), "YOU SET TODAY'S")
         write(screen, cpos(10, 10.5), (255, 255, on[1]), "HIGH SCORE!")
         write(screen, cpos(9, 12.5), (on[2], 255, on[2]), "NOW TRY FOR A")
@@ -1424,13 +3214,13 @@ class HighScore(Handler):
 
     def show_credits(self):
         screen = self.screen
-        screen.fill((0, 0, 0), pygame.Rect(cpos(10, 21.5), cpos(10, 1)))
+        mark_dirty(screen, screen.fill((0, 0, 0), pygame.Rect(cpos(10, 21.5), cpos(10, 1))))
         write(screen, cpos(10, 21.5), (255, 0, 0), "CREDITS %2d" % min(Config.credits, 99))
 
     def mainloop(self):
         screen = self.screen
         self.show()
-        pygame.display.flip()
+        flip_display()
 
         set_next_screen(1, 10000)
         state = 0
@@ -1443,11 +3233,13 @@ class HighScore(Handler):
                 elif coin_inserted(event):
                     Config.credits += 1
                     self.show_credits()
-                    pygame.display.flip()
+                    update_display()
                 elif next_screen_requested(event):
                     return GAME_OVER
                 elif snapshot_requested(event):
                     save_screen(screen)
+                elif profile_requested(event):
+                    toggle_profiler()
 
             # Loop counter every 1s.
 
@@ -1458,7 +3250,27 @@ class HighScore(Handler):
             if counter == 0:
                 state = (state + 1) % 5
                 self.show_text(state)
-                pygame.display.flip()
+                update_display()
+
+class GameRandom(random.Random):
+
+    """
+    A random number generator making the same choices for a given seed with any
+    version of Python, deriving each choice from a single call to 'random'.
+    """
+
+    def randint(self, a, b):
+        return a + int(self.random() * (b - a + 1))
+
+    def sample(self, population, k):
+        pool = list(population)
+        n = len(pool)
+        result = []
+        for i in range(0, k):
+            j = int(self.random() * (n - i))
+            result.append(pool[j])
+            pool[j] = pool[n - i - 1]
+        return result
 
 class GameEngine(Handler):
 
@@ -1478,28 +3290,62 @@ class GameEngine(Handler):
     Generally, only the 'mainloop' method is called by other objects, and it
     ensures the correct invocation of the other methods, notably 'show' and
     'update'.
+
+    All random choices made by the game use the 'rng' attribute, seeded with
+    the given 'seed' or a randomly chosen seed, so that a game can be repeated
+    exactly given the same seed and inputs.
     """
 
-    def __init__(self, *args):
-        Handler.__init__(self, *args)
+    def __init__(self, screen, info=None, seed=None):
+        Handler.__init__(self, screen, info)
+
+        if seed is None:
+            seed = random.randint(0, 0x7fffffff)
+        self.seed = seed
+        self.rng = GameRandom(seed)
+        self.tick = 0
+
+        # Time owed to the game when running late, and the number of ticks not
+        # shown as a result.
+
+        self.lag = 0.0
+        self.skipped_frames = 0
 
         # Get the offset of the player from the top left of the view.
 
         self.view_size = cpos(28, 24)
         self.player_centre = self.view_size[0] / 2, self.view_size[1] / 2
         self.player_offset = (self.view_size[0] - Config.object_size[0]) / 2, (self.view_size[1] - Config.object_size[1]) / 2
-        self.view_map_size = self.view_size[0] / Config.object_size[0], self.view_size[1] / Config.object_size[1]
 
         self.info.start_game() # sets in_game mode for the object
 
+    def mainloop(self):
+
+        """
+        Play using the 'play' method, returning its status, and then discard the
+        level's map and its pre-rendered chunks, since finished games can be
+        kept alive by references between the cars and the game.
+        """
+
+        try:
+            return self.play()
+        finally:
+            self.renderer = None
+            self.walkable = self.flow = self.paths = None
+
     def start_level(self):
 
         # Level attributes.
 
-        self.current_map = Config.map[:]
-        switch_map(self.current_map, self.info.is_challenging_level())
-        convert_map(self.current_map)
-        Config.objects.update(Config.wall_sets[(self.info.level - 1) % len(Config.wall_sets)])
+        if Config.generated_maps:
+            source = generate_map(self.seed * 1000 + self.info.level)
+        else:
+            source = None
+        self.current_map = make_map(self.info.is_challenging_level(), source)
+        self.walkable = WalkableGrid(self.current_map, Config.object_size)
+        self.flow = FlowField(self.walkable)
+        self.paths = PathFinder(self.walkable)
+        self.prepare_view()
 
         # Set the flag and rock counts.
 
@@ -1509,13 +3355,13 @@ class GameEngine(Handler):
         # Randomly generate the rows upon which flags and rocks occur.
 
         flags_samples = (
-            random.sample(range(0, 10), nflags),
-            random.sample(range(0, 10), nflags)
+            self.rng.sample(range(0, 10), nflags),
+            self.rng.sample(range(0, 10), nflags)
             )
             
         rocks_samples = (
-            random.sample(range(0, 10), nrocks),
-            [random.randint(0, 1) for i in range(0, nrocks)]
+            self.rng.sample(range(0, 10), nrocks),
+            [self.rng.randint(0, 1) for i in range(0, nrocks)]
             )
 
         # Flags and radar markers. Note that the markers disappear before the
@@ -1537,6 +3383,17 @@ class GameEngine(Handler):
 
         self.info.start_level()
 
+    def prepare_view(self):
+
+        "Prepare the scenery and the pre-rendered map for the current level."
+
+        Config.objects.update(Config.wall_sets[(self.info.level - 1) % len(Config.wall_sets)])
+
+        # Release the previous level's chunks before drawing new ones.
+
+        self.renderer = None
+        self.renderer = LevelRenderer(self.current_map)
+
     def next_level(self):
         self.info.next_level()
 
@@ -1548,29 +3405,35 @@ class GameEngine(Handler):
 
         # Cars and smoke.
 
-        self.player = self.player_class((bx + 15, by + 50), Config.objects["car"], self)
+        self.player = self.player_class((bx + 15, by + 50), Config.objects.get("car"), self)
         self.red_cars = [
-            Computer((0, -1), (bx + 13, by + 54), Config.objects["car-red"], self),
-            Computer((0, -1), (bx + 15, by + 54), Config.objects["car-red"], self),
-            Computer((0, -1), (bx + 17, by + 54), Config.objects["car-red"], self),
+            Computer((0, -1), (bx + 13, by + 54), Config.objects.get("car-red"), self),
+            Computer((0, -1), (bx + 15, by + 54), Config.objects.get("car-red"), self),
+            Computer((0, -1), (bx + 17, by + 54), Config.objects.get("car-red"), self),
             ]
         self.smoke = []
 
         # Additional cars.
 
         if self.info.level % 2 == 0:
-            self.red_cars.append(Computer((0, -1), (bx + 11, by + 54), Config.objects["car-red"], self))
-            self.red_cars.append(Computer((0, -1), (bx + 19, by + 54), Config.objects["car-red"], self))
+            self.red_cars.append(Computer((0, -1), (bx + 11, by + 54), Config.objects.get("car-red"), self))
+            self.red_cars.append(Computer((0, -1), (bx + 19, by + 54), Config.objects.get("car-red"), self))
 
         if self.info.is_challenging_level():
-            self.red_cars.append(Computer((0, 1), (bx + 13, by + 1), Config.objects["car-red"], self))
-            self.red_cars.append(Computer((0, 1), (bx + 15, by + 1), Config.objects["car-red"], self))
-            self.red_cars.append(Computer((0, 1), (bx + 17, by + 1), Config.objects["car-red"], self))
+            self.red_cars.append(Computer((0, 1), (bx + 13, by + 1), Config.objects.get("car-red"), self))
+            self.red_cars.append(Computer((0, 1), (bx + 15, by + 1), Config.objects.get("car-red"), self))
+            self.red_cars.append(Computer((0, 1), (bx + 17, by + 1), Config.objects.get("car-red"), self))
 
         # Groups.
 
         self.opponents = self.red_cars + self.rocks
 
+        # Index the objects for collision detection and searching.
+
+        self.index = SpatialIndex(Config.object_size)
+        for obj in [self.player] + self.opponents + self.flags:
+            self.index.add(obj)
+
         # Play status.
 
         self.bang = 0
@@ -1595,17 +3458,17 @@ class GameEngine(Handler):
 
     def place_flags(self, map, samples):
         flags = []
-        specials = random.sample(range(0, len(samples[0])), 2)
+        specials = self.rng.sample(range(0, len(samples[0])), 2)
         i = 0
-        for x, y in self._place_objects(map, samples):
+        for x, y in find_space_cells(map, samples):
             if i == specials[0]:
-                flag = Config.objects["flag-S"]
+                flag = Config.objects.get("flag-S")
                 flag_type = "S"
             elif i == specials[1]:
-                flag = Config.objects["flag-L"]
+                flag = Config.objects.get("flag-L")
                 flag_type = "L"
             else:
-                flag = Config.objects["flag"]
+                flag = Config.objects.get("flag")
                 flag_type = None
             flags.append(Flag(flag_type, (x, y), flag, self))
             i += 1
@@ -1613,51 +3476,93 @@ class GameEngine(Handler):
 
     def place_rocks(self, map, samples):
         rocks = []
-        for group, occurrence in zip(*samples):
-            nfound = 0
-            for y in range(0, Config.map_size[1]):
-                y = y + Config.map_border[1]
-                row = map[y]
-                count = row.count(str(group))
-                if occurrence < nfound + count:
-                    x = nfound + count - occurrence - 1
-                    index = row.index(str(group))
-                    while x > 0:
-                        index = row.index(str(group), index + 1)
-                        x -= 1
-                    rocks.append(Rock((index, y), Config.objects["rock"], self))
-                    break
-                nfound += count
+        for x, y in find_group_cells(map, samples):
+            rocks.append(Rock((x, y), Config.objects.get("rock"), self))
         return rocks
 
-    def _place_objects(self, map, samples):
+    def advance(self):
 
-        # Produce the objects as coordinates in the results list.
+        """
+        Advance the game state by one tick without showing anything, returning
+        whether the view onto the game needs updating.
+        """
 
-        results = []
-        for y, x in zip(*samples):
-            y = int(float(y)/10 * Config.map_size[1]) + Config.map_border[1]
-            row = map[y]
+        timer = Config.timer
+
+        if not self.draining_fuel:
+            if not self.bang:
+                self.player.update()
+                self.index.update(self.player)
+                if timer is not None:
+                    timer.lap("player")
+                for red_car in self.red_cars:
+                    red_car.control()
+                    red_car.update()
+                    self.index.update(red_car)
+                for smoke in self.smoke:
+                    smoke.update()
+                for flag in self.flags:
+                    flag.update()
+                if timer is not None:
+                    timer.lap("cars")
+                self.info.update(self.red_cars + self.radar_flags + [self.player])
+                if timer is not None:
+                    timer.lap("info")
+                self.collisions()
+                if timer is not None:
+                    timer.lap("collisions")
+            return 1
+        else:
+            self.draining_fuel = self.info.drain_fuel()
+            if not self.draining_fuel:
+                self.player.fuel = self.draining_fuel_level
+            return 0
 
-            # Do not place objects in the start area.
+    def pause(self, delay):
+        pygame.time.delay(delay)
+
+    def due_ticks(self):
+
+        """
+        Wait for the clock and return the number of game ticks due, so that the
+        game advances at the framerate even when frames take too long to show.
+        Only the last of the ticks is shown, with no more than
+        Config.max_frame_skip ticks being skipped before the game slows down.
+        """
 
-            if Config.start_area_y[1] >= y >= Config.start_area_y[0]:
-                count = (row[:Config.start_area_x[0]] + row[Config.start_area_x[1] + 1:]).count(" ")
-            else:
-                count = row.count(" ")
+        tick_time = 1000.0 / Config.framerate
+        self.lag += Config.clock.tick(Config.framerate)
+        ticks = max(1, int(self.lag // tick_time))
+        if ticks > Config.max_frame_skip + 1:
+            ticks = Config.max_frame_skip + 1
+            self.lag = 0.0
+        else:
+            self.lag = max(0.0, self.lag - ticks * tick_time)
+        self.skipped_frames += ticks - 1
 
-            x = int(float(x)/10 * count)
-            index = row.index(" ")
-            while x > 0:
-                index = row.index(" ", index + 1)
+        if Config.timer is not None:
+            Config.timer.start_frame()
+        return ticks
 
-                # Do not place objects in the start area.
+    def show_frame(self, refresh):
 
-                if y < Config.start_area_y[0] or index < Config.start_area_x[0] or index > Config.start_area_x[1]:
-                    x -= 1
-            results.append((index, y))
+        """
+        Show the view onto the game if 'refresh' is set, together with any
+        timing overlay, and update the display, timing these phases if frames
+        are being timed.
+        """
 
-        return results
+        timer = Config.timer
+        if refresh:
+            self.update()
+        if timer is not None:
+            if timer.overlay:
+                self.info.show_timing(timer)
+            timer.lap("render")
+        update_display()
+        if timer is not None:
+            timer.lap("display")
+            timer.end_frame()
 
     def show(self):
 
@@ -1675,65 +3580,35 @@ class GameEngine(Handler):
         """
 
         screen = self.screen.subsurface(pygame.Rect((0, 0), self.view_size))
-        screen.fill(Config.bgcolour)
 
-        map_x, offset_x, map_y, offset_y = exact_to_map(
+        # Show the pre-rendered map with the player at the centre of the view.
+
+        self.renderer.blit(screen,
             (self.player.position[0] - self.player_offset[0], self.player.position[1] - self.player_offset[1])
             )
 
-        # NOTE: If the character or object size changes, the view size will
-        # NOTE: change, resulting in a different number of map cells being shown
-        # NOTE: and the possible need to review this.
-
-        map_x_start, map_x_end = map_x, map_x + self.view_map_size[0] + 2 # includes extra column
-        map_y_start, map_y_end = map_y, map_y + self.view_map_size[1] + 1
-
-        # Start off the top with a partial row.
-
-        blit_y = -offset_y
-
-        for y in range(map_y_start, map_y_end):
-            blit_x = -offset_x
-
-            # Any partial leftmost column plus the remaining "guaranteed" columns.
-
-            for x in range(map_x_start, map_x_end):
-                self._blit_symbol(screen, x, y, blit_x, blit_y)
-                blit_x += Config.object_size[0]
-
-            blit_y += Config.object_size[1]
-
-        # Show the game objects.
+        # Show the game objects near the view, with flags below smoke and smoke
+        # below other objects, and with the player on top.
 
-        for other in self.flags + self.smoke + self.opponents:
-            other.blit(screen, self.player_centre, self.player.position)
-        self.player.blit(screen, self.player_centre)
+        objects = self.index.in_area(
+            (self.player.position[0] - self.player_offset[0], self.player.position[1] - self.player_offset[1]),
+            self.view_size)
+        objects.sort(key=get_layer)
 
-    def _blit_symbol(self, screen, x, y, blit_x, blit_y):
+        entries = []
+        for other in objects:
+            if other is not self.player:
+                entries.append(other.blit_entry(self.player_centre, self.player.position))
+        entries.append(self.player.blit_entry(self.player_centre))
+        blit_all(screen, entries)
 
-        """
-        Missing cells should be avoided with a suitably big map, but not if the
-        character or object size changes. One strategy is to use exceptions,
-        possibly with a speed penalty:
-
-        try:
-            c = self.current_map[y][x]
-        except IndexError:
-            c = "*"
-        """
-
-        c = self.current_map[y][x]
-        symbol = Config.symbols.get(c)
-        image = Config.objects.get(symbol)
-        if image is not None:
-            screen.blit(image, (blit_x, blit_y))
+        mark_dirty(self.screen, pygame.Rect((0, 0), self.view_size))
 
     def check(self, position):
-        map_x, offset_x, map_y, offset_y = exact_to_map(position)
-        return self.check_map(map_x, map_y)
+        return self.walkable.passable(position)
 
     def check_map(self, map_x, map_y):
-        return self.current_map[map_y][map_x] in Config.space_or_group_symbols
+        return self.walkable.passable_cell(map_x, map_y)
 
     def make_smoke(self, position, direction):
         if not exact(position):
@@ -1742,13 +3617,16 @@ class GameEngine(Handler):
             Config.object_size[1]/2 + sign(-direction[1]) * Config.object_size[1]
         map_x, offset_x, map_y, offset_y = exact_to_map((position[0] + direction[0], position[1] + direction[1]))
         if self.check_map(map_x, map_y):
-            self.smoke.append(Smoke((map_x, map_y), Config.objects["smoke"], self))
+            smoke = Smoke((map_x, map_y), Config.objects.get("smoke"), self)
+            self.smoke.append(smoke)
+            self.index.add(smoke)
             return 1
         else:
             return 0
 
     def remove_smoke(self, smoke):
         self.smoke.remove(smoke)
+        self.index.remove(smoke)
 
     def flag_collected(self, flag):
         self.radar_flags.remove(flag)
@@ -1761,6 +3639,7 @@ class GameEngine(Handler):
 
     def remove_flag(self, flag):
         self.flags.remove(flag)
+        self.index.remove(flag)
 
     def player_collided(self, player, other):
         self.bang = 1
@@ -1775,17 +3654,46 @@ class GameEngine(Handler):
         self.stopped = 1
 
     def collisions(self):
-        participants = [self.player] + self.opponents + self.smoke + self.flags
-        while participants:
-            participant = participants[0]
-            for other in participants[1:]:
-                diff_x = participant.position[0] - other.position[0]
-                diff_y = participant.position[1] - other.position[1]
-                if abs(diff_x) < Config.object_size[0] and \
-                    abs(diff_y) < Config.object_size[1]:
-                    participant.collide(other, (sign(diff_x), sign(diff_y)))
-                    other.collide(participant, (sign(-diff_x), sign(-diff_y)))
-            participants.remove(participant)
+
+        """
+        Make overlapping objects collide, with pairs of objects colliding in the
+        order of the player, opponents, smoke and flags. Since only cars react
+        to other objects, only objects in map cells neighbouring the cars are
+        considered.
+        """
+
+        cars = [self.player] + self.red_cars
+        numbers = {}
+        for i, car in enumerate(cars):
+            numbers[car] = i
+
+        # Find overlapping pairs, with the cars preceding rocks, smoke and flags,
+        # each of which are in the order they were added to the index, as they
+        # are in their lists.
+
+        order = self.index.order
+        overlapping = []
+        for i, car in enumerate(cars):
+            x, y = car.position
+            for other in self.index.near(car.position):
+                if other is not car and abs(x - other.position[0]) < Config.object_size[0] and \
+                    abs(y - other.position[1]) < Config.object_size[1]:
+                    if other in numbers:
+                        if numbers[other] > i:
+                            overlapping.append((i, 0, numbers[other], car, other))
+                    elif isinstance(other, Rock):
+                        overlapping.append((i, 1, order[other], car, other))
+                    elif isinstance(other, Smoke):
+                        overlapping.append((i, 2, order[other], car, other))
+                    else:
+                        overlapping.append((i, 3, order[other], car, other))
+        overlapping.sort(key=lambda pair: pair[:3])
+
+        for i, group, added, participant, other in overlapping:
+            diff_x = participant.position[0] - other.position[0]
+            diff_y = participant.position[1] - other.position[1]
+            participant.collide(other, (sign(diff_x), sign(diff_y)))
+            other.collide(participant, (sign(-diff_x), sign(-diff_y)))
 
     def switch_music(self):
         if self.stopping:
@@ -1807,17 +3715,22 @@ class Object:
 
     "A generic game object supporting blitting and collisions."
 
+    layer = 2 # shown above flags (0) and smoke (1)
+
     def __init__(self, position, image, game):
         self.position = map_to_exact(position)
         self.image = image
         self.game = game
 
     def blit(self, screen, centre, position=None):
+        screen.blit(*self.blit_entry(centre, position))
+
+    def blit_entry(self, centre, position=None):
         if position is not None:
             centre = (centre[0] + self.position[0] - position[0]), (centre[1] + self.position[1] - position[1])
         x = centre[0] - self.image.get_rect().width / 2
         y = centre[1] - self.image.get_rect().height / 2
-        screen.blit(self.image, (x, y))
+        return image_entry(self.image, (x, y))
 
     def collide(self, other, rebound):
         pass
@@ -1849,39 +3762,34 @@ class Car(Object):
         else:
             self.angle_step = 15 * sign(da)
 
-    def blit(self, screen, centre, position=None):
-        rotated = pygame.transform.rotate(self.image, self.angle)
+    def blit_entry(self, centre, position=None):
+        if self.angle == 0:
+            rotated = self.image
+        else:
+            rotated = rotate(self.image, self.angle)
         if position is not None:
             centre = (centre[0] + self.position[0] - position[0]), (centre[1] + self.position[1] - position[1])
         x = centre[0] - rotated.get_rect().width / 2
         y = centre[1] - rotated.get_rect().height / 2
-        screen.blit(rotated, (x, y))
+        return image_entry(rotated, (x, y))
 
     def opposite(self, direction):
         return direction[0] == -self.direction[0] and direction[1] == -self.direction[1]
 
-    def detect(self, position, direction):
-        x1, y1 = position
-        x2, y2 = x1 + Config.object_size[0] - 1, y1 + Config.object_size[1] - 1
-        dx, dy = direction
+    def next_cell(self):
 
-        if dy == 0:
-            new_x1, new_x2 = x1 + dx, x2 + dx
-            if dx < 0:
-                if self.game.check((new_x1, y1)) and self.game.check((new_x1, y2)):
-                    return new_x1, y1
-            else:
-                if self.game.check((new_x2, y1)) and self.game.check((new_x2, y2)):
-                    return new_x1, y1
-        else:
-            new_y1, new_y2 = y1 + dy, y2 + dy
-            if dy < 0:
-                if self.game.check((x1, new_y1)) and self.game.check((x2, new_y1)):
-                    return x1, new_y1
-            else:
-                if self.game.check((x1, new_y2)) and self.game.check((x2, new_y2)):
-                    return x1, new_y1
+        "Return the map cell that the car is in or is about to enter."
+
+        map_x, offset_x, map_y, offset_y = exact_to_map(self.position)
+        if offset_x and self.direction[0] > 0:
+            map_x += 1
+        if offset_y and self.direction[1] > 0:
+            map_y += 1
+        return map_x, map_y
 
+    def detect(self, position, direction):
+        if self.game.walkable.can_move(position, direction):
+            return position[0] + direction[0], position[1] + direction[1]
         return None
 
     def move(self, direction):
@@ -1924,7 +3832,7 @@ class Car(Object):
             ]
 
     def _update_turns(self, turns):
-        if random.randint(0, 1):
+        if self.game.rng.randint(0, 1):
             turns.insert(0, turns[1])
             del turns[2]
 
@@ -2000,23 +3908,30 @@ class Player(Car):
         self.initial_speed = self.speed
 
     def control(self, event):
-        if event.type == pygame.KEYDOWN:
-            if event.key in Config.left_buttons:
-                self.requested_direction = (-self.speed, 0)
-            elif event.key in Config.right_buttons:
-                self.requested_direction = (self.speed, 0)
-            elif event.key in Config.up_buttons:
-                self.requested_direction = (0, -self.speed)
-            elif event.key in Config.down_buttons:
-                self.requested_direction = (0, self.speed)
-            elif event.key in Config.smoke_buttons:
-                if self.more_smoke == 0:
-                    self.more_smoke = 3
+        action = player_action(event)
+        if action is not None:
+            self.request(action)
+
+    def request(self, action):
+
+        "Request the given 'action': left, right, up, down or smoke."
+
+        if action == "left":
+            self.requested_direction = (-self.speed, 0)
+        elif action == "right":
+            self.requested_direction = (self.speed, 0)
+        elif action == "up":
+            self.requested_direction = (0, -self.speed)
+        elif action == "down":
+            self.requested_direction = (0, self.speed)
+        elif action == "smoke":
+            if self.more_smoke == 0:
+                self.more_smoke = 3
 
     def collide(self, other, rebound):
         if isinstance(other, Computer) or isinstance(other, Rock):
             self.game.player_collided(self, other)
-            self.image = Config.objects["bang"]
+            self.image = Config.objects.get("bang")
             self.angle = 0
 
     def update_fuel(self, n):
@@ -2056,22 +3971,13 @@ class DemoPlayer(Player):
     which works without events).
     """
 
+    laziness = 8
+
     def __init__(self, *args):
         Player.__init__(self, *args)
-        self.laziness = 8
         self.nearest_flag = None
         self.nearest_red_car = None
 
-    def _get_distances(self, objects):
-        distances = []
-        for obj in objects:
-            x, y = obj.position[0], obj.position[1]
-            dx = x - self.position[0]
-            dy = y - self.position[1]
-            distances.append((math.sqrt(dx ** 2 + dy ** 2), obj))
-        distances.sort()
-        return distances
-
     def _retarget(self, old, new):
         if old is not None:
             old.targeted = 0
@@ -2081,90 +3987,124 @@ class DemoPlayer(Player):
     def control(self, event):
         pass
 
+    def request(self, action):
+        pass
+
+    def _get_nearest_flag(self, start):
+
+        """
+        Return a (path, flag) tuple for the flag nearest to the 'start' cell by
+        path length, or leading towards the flag nearest across the map if it is
+        too far away for paths to be compared, ignoring flags already collected
+        where possible, or None for both if no flag can be reached.
+        """
+
+        flags = [flag for flag in self.game.flags if flag.timer is None] or self.game.flags
+
+        # Consider the flags in order of their distance across the map, which
+        # no path can be shorter than, until no nearer flag can remain.
+
+        heap = []
+        for i, flag in enumerate(flags):
+            map_x, offset_x, map_y, offset_y = exact_to_map(flag.position)
+            heap.append((abs(map_x - start[0]) + abs(map_y - start[1]), i, (map_x, map_y)))
+        heapq.heapify(heap)
+
+        best_path, best_flag = None, None
+        while heap:
+            estimate, i, cell = heapq.heappop(heap)
+            if best_path is not None and estimate >= len(best_path) - 1:
+                break
+            path = self.game.paths.path(start, cell)
+            if path is not None and (best_path is None or len(path) < len(best_path)):
+                best_path, best_flag = path, flags[i]
+
+            # A path only leading towards a flag means that every remaining flag
+            # is too far away to be compared.
+
+            if path is not None and path[-1] != cell:
+                break
+
+        return best_path, best_flag
+
     def update(self):
 
         """
         A complicated update method which attempts to make the demo player
-        moderately intelligent, looking for the nearest flag whilst avoiding the
-        nearest car.
+        moderately intelligent, following the shortest path to the nearest flag
+        whilst avoiding the nearest car.
         """
 
-        if not random.randint(0, self.laziness):
+        if not self.game.rng.randint(0, self.laziness):
 
-            # Get the flag distances and objects.
+            # Get the nearest flag and car.
 
-            distances = self._get_distances(self.game.flags)
-            distance, nearest_flag = distances[0]
-            destination = nearest_flag.position
-            self.nearest_flag = self._retarget(self.nearest_flag, nearest_flag)
+            path, nearest_flag = self._get_nearest_flag(self.next_cell())
+            if nearest_flag is not None:
+                self.nearest_flag = self._retarget(self.nearest_flag, nearest_flag)
 
-            # Get the car distances and objects.
+            # Look for cars in range before looking further afield.
 
-            distances = self._get_distances(self.game.red_cars)
-            red_car_distance, nearest_red_car = distances[0]
+            red_car_range = Config.object_size[0] * 5
+            nearby = [item for item in self.game.index.within(self.position, red_car_range)
+                if isinstance(item[1], Computer)]
+            if nearby:
+                red_car_distance, nearest_red_car = nearby[0]
+            else:
+                red_car_distance, nearest_red_car = self.game.index.nearest(self.position, self.game.red_cars)
             non_destination = nearest_red_car.position
             self.nearest_red_car = self._retarget(self.nearest_red_car, nearest_red_car)
 
             # Work out if the nearest car is in range.
 
-            if red_car_distance < Config.object_size[0] * 5:
+            if red_car_distance < red_car_range:
                 if self.more_smoke == 0:
                     self.more_smoke = 3
                 red_car_in_range = 1
             else:
                 red_car_in_range = 0
 
-            # Work out preferred and non-preferred directions.
+            # Work out the non-preferred directions.
 
-            dir_x = sign(destination[0] - self.position[0])
-            dir_y = sign(destination[1] - self.position[1])
             non_dir_x = sign(non_destination[0] - self.position[0])
             non_dir_y = sign(non_destination[1] - self.position[1])
 
-            # Vertical motion...
+            # Evasive action, reversing vertical direction of motion.
 
-            if self.direction[0] == 0:
+            if self.direction[0] == 0 and non_dir_y == sign(self.direction[1]) and red_car_in_range and \
+                -1 <= self.position[0] - non_destination[0] <= 1:
 
-                # Evasive action, reversing vertical direction of motion.
+                self.requested_direction = (0, -non_dir_y * self.speed)
 
-                if non_dir_y == sign(self.direction[1]) and red_car_in_range and -1 <= self.position[0] - non_destination[0] <= 1:
-                    self.requested_direction = (0, -non_dir_y * self.speed)
+            # Evasive action, reversing horizontal direction of motion.
 
-                # Request horizontal motion in the direction of the flag.
+            elif self.direction[1] == 0 and non_dir_x == sign(self.direction[0]) and red_car_in_range and \
+                -1 <= self.position[1] - non_destination[1] <= 1:
 
-                elif dir_y == sign(self.direction[1]):
-                    if dir_x > 0:
-                        self.requested_direction = (self.speed, 0)
-                    elif dir_x < 0:
-                        self.requested_direction = (-self.speed, 0)
+                self.requested_direction = (-non_dir_x * self.speed, 0)
 
-            # Horizontal motion...
+            # Follow the path to the flag.
 
-            elif self.direction[1] == 0:
-
-                # Evasive action, reversing horizontal direction of motion.
-
-                if non_dir_x == sign(self.direction[0]) and red_car_in_range and -1 <= self.position[1] - non_destination[1] <= 1:
-                    self.requested_direction = (-non_dir_x * self.speed, 0)
-
-                # Request vertical motion in the direction of the flag.
-
-                elif dir_x == sign(self.direction[0]):
-                    if dir_y > 0:
-                        self.requested_direction = (0, self.speed)
-                    elif dir_y < 0:
-                        self.requested_direction = (0, -self.speed)
+            elif path is not None and len(path) > 1:
+                direction = (path[1][0] - path[0][0]) * self.speed, (path[1][1] - path[0][1]) * self.speed
+                if direction == self.direction:
+                    self.requested_direction = None
+                else:
+                    self.requested_direction = direction
 
         Player.update(self)
 
 class Computer(Car):
 
     """
-    A computer-controlled version of the car game object, with simple player
-    seeking behaviour.
+    A computer-controlled version of the car game object, with player seeking
+    behaviour either following the shortest paths through the map ("flow") or
+    just heading in the general direction of the player ("direct").
     """
 
     radar_colour = (255, 0, 0)
+    laziness = 5
+    pursuit = "flow"
 
     def __init__(self, direction, *args):
         Car.__init__(self, Config.car_speed + Config.computer_speed_advantage, direction, *args)
@@ -2172,7 +4112,6 @@ class Computer(Car):
         self.delay = 50
         self.rebound_direction = None
         self.smoked = 0
-        self.laziness = 5
 
     def update(self):
         if self.delay > 0:
@@ -2193,9 +4132,18 @@ class Computer(Car):
             Car.update(self)
 
     def control(self):
-        if self.delay > 0 or random.randint(0, self.laziness):
+        if self.delay > 0 or self.game.rng.randint(0, self.laziness):
             return
 
+        if self.pursuit == "flow":
+            direction = self._get_flow_direction()
+            if direction is not None:
+                if direction == self.direction:
+                    self.requested_direction = None
+                elif not self.opposite(direction):
+                    self.requested_direction = direction
+                return
+
         dir_x = sign(self.game.player.position[0] - self.position[0])
         dir_y = sign(self.game.player.position[1] - self.position[1])
 
@@ -2212,6 +4160,22 @@ class Computer(Car):
                 else:
                     self.requested_direction = (0, -self.speed)
 
+    def _get_flow_direction(self):
+
+        """
+        Return the direction leading towards the player from the map cell that
+        the car is in or is about to enter, or None if no such direction exists.
+        """
+
+        game = self.game
+        game.flow.update(game.walkable.centre_cell(game.player.position))
+
+        map_x, map_y = self.next_cell()
+        step = game.flow.step(map_x, map_y, (sign(self.direction[0]), sign(self.direction[1])))
+        if step is None:
+            return None
+        return step[0] * self.speed, step[1] * self.speed
+
     def collide(self, other, rebound):
         if isinstance(other, Flag):
             return
@@ -2227,6 +4191,8 @@ class Flag(Object):
 
     "A flag game object which awards points to players who collect it."
 
+    layer = 0
+
     radar_colour = (255, 255, 0)
 
     def __init__(self, flag_type, *args):
@@ -2251,6 +4217,8 @@ class Smoke(Object):
 
     "A smoke game object which exists for a short period of time."
 
+    layer = 1
+
     def __init__(self, *args):
         Object.__init__(self, *args)
         self.remaining = 50
@@ -2271,13 +4239,48 @@ class Rock(Object):
 
 class Game(GameEngine):
 
-    "The actual game involving a real player."
+    """
+    The actual game involving a real player. The player's actions can be
+    recorded in an InputLog, or taken from an InputLog given by Config.replay,
+    with the game then being replayed without waiting for the clock.
+    """
 
     player_class = Player
 
+    def __init__(self, screen, info=None):
+        self.replay = Config.replay
+        if self.replay is not None:
+            GameEngine.__init__(self, screen, info, self.replay.seed)
+            self.recording = None
+        else:
+            GameEngine.__init__(self, screen, info)
+            self.recording = InputLog(self.seed, Config.size_dir, Config.scale,
+                Config.generated_maps and Config.map_size or None)
+
+    def next_tick(self):
+
+        "Wait for the next tick unless replaying, counting the ticks."
+
+        if self.replay is None:
+            Config.clock.tick(Config.framerate)
+        self.tick += 1
+
+    def due_ticks(self):
+        if self.replay is not None:
+            if Config.timer is not None:
+                Config.timer.start_frame()
+            return 1
+        return GameEngine.due_ticks(self)
+
+    def pause(self, delay):
+        if self.replay is None:
+            pygame.time.delay(delay)
+
     def handle_events(self, in_game):
         for event in pygame.event.get():
             if quit_requested(event):
+                if self.recording is not None:
+                    self.recording.add(self.tick, "quit")
                 return QUIT_GAME
             elif coin_inserted(event):
                 Config.credits += 1
@@ -2288,11 +4291,28 @@ class Game(GameEngine):
                     return END_SEQUENCE
             elif snapshot_requested(event):
                 save_screen(self.screen)
-            elif in_game and not self.bang:
-                self.player.control(event)
+            elif profile_requested(event):
+                toggle_profiler()
+            elif timing_requested(event):
+                self.info.toggle_timing()
+            elif in_game and not self.bang and self.replay is None:
+                action = player_action(event)
+                if action is not None:
+                    self.recording.add(self.tick, action)
+                    self.player.request(action)
+
+        # Apply any replayed actions for the current tick.
+
+        if self.replay is not None:
+            if self.replay.quit_tick is not None and self.tick >= self.replay.quit_tick:
+                return QUIT_GAME
+            if in_game and not self.bang:
+                for action in self.replay.get(self.tick):
+                    self.player.request(action)
+
         return None
 
-    def mainloop(self):
+    def play(self):
 
         """
         Monitor game events and return control to the caller when requested or
@@ -2308,7 +4328,7 @@ class Game(GameEngine):
 
         while self.info.lives > 0:
             self.show()
-            pygame.display.flip()
+            flip_display()
             set_next_screen(0)
 
             pygame.event.clear()
@@ -2318,11 +4338,11 @@ class Game(GameEngine):
 
             self.info.update(self.red_cars + self.radar_flags + [self.player])
             self.update()
-            pygame.display.flip()
+            flip_display()
 
             # Intro loop.
 
-            if intro and not Config.skip_intros:
+            if intro and not Config.skip_intros and self.replay is None:
                 self.music = "intro_theme"
                 play_music(self.music)
 
@@ -2340,40 +4360,36 @@ class Game(GameEngine):
 
                 intro = 0
             else:
-                pygame.time.delay(1000)
+                self.pause(1000)
 
             self.music = "main_theme"
             play_music(self.music)
 
+            # Start timing afresh, so that time spent on the introduction or
+            # the pause before play is not caught up by skipping frames.
+
+            Config.clock.tick()
+            self.lag = 0.0
+
             # Repeat until a definitive outcome.
 
             while not self.bang and not self.complete and not self.stopped:
-                Config.clock.tick(Config.framerate)
-                status = self.handle_events(1)
-                if status is not None:
-                    self.info.end_game()
-                    stop_music()
-                    return status
+                refresh = 0
+                for i in range(0, self.due_ticks()):
+                    self.tick += 1
+                    status = self.handle_events(1)
+                    if status is not None:
+                        self.info.end_game()
+                        stop_music()
+                        return status
+                    if Config.timer is not None:
+                        Config.timer.lap("events")
 
-                if not self.draining_fuel:
-                    if not self.bang:
-                        self.player.update()
-                        for red_car in self.red_cars:
-                            red_car.control()
-                            red_car.update()
-                        for smoke in self.smoke:
-                            smoke.update()
-                        for flag in self.flags:
-                            flag.update()
-                        self.info.update(self.red_cars + self.radar_flags + [self.player])
-                        self.collisions()
-                    self.update()
-                else:
-                    self.draining_fuel = self.info.drain_fuel()
-                    if not self.draining_fuel:
-                        self.player.fuel = self.draining_fuel_level
+                    refresh = self.advance() or refresh
+                    if self.bang or self.complete or self.stopped:
+                        break
 
-                pygame.display.flip()
+                self.show_frame(refresh)
 
             # Show the outcome.
 
@@ -2392,22 +4408,22 @@ class Game(GameEngine):
                 # Repeat until the fuel is drained.
 
                 while self.info.drain_fuel():
-                    Config.clock.tick(Config.framerate)
+                    self.next_tick()
                     status = self.handle_events(0)
                     if status is not None:
                         if status != END_SEQUENCE:
                             self.info.end_game()
                             return status
-                    pygame.display.flip()
+                    update_display()
 
                 self.next_level()
                 self.start_level()
 
                 # Interlude.
 
-                if self.info.is_challenging_level() and not Config.skip_intros:
+                if self.info.is_challenging_level() and not Config.skip_intros and self.replay is None:
                     challenging = Challenging(self.ncars, len(self.rocks), self.screen, self.info)
-                    pygame.display.flip()
+                    flip_display()
 
                     # Enter the interlude.
 
@@ -2418,7 +4434,7 @@ class Game(GameEngine):
                             self.info.end_game()
                             return status
 
-            pygame.time.delay(2000)
+            self.pause(2000)
 
         self.info.end_game()
         stop_music()
@@ -2443,11 +4459,15 @@ class Demo(GameEngine):
                 return SHOW_START
             elif snapshot_requested(event):
                 save_screen(self.screen)
+            elif profile_requested(event):
+                toggle_profiler()
+            elif timing_requested(event):
+                self.info.toggle_timing()
             elif in_game and not self.bang:
                 self.player.control(event)
         return None
 
-    def mainloop(self):
+    def play(self):
 
         """
         Monitor game events and return control to the caller when requested or
@@ -2463,7 +4483,7 @@ class Demo(GameEngine):
         demo_timer = 0
 
         self.show()
-        pygame.display.flip()
+        flip_display()
         set_next_screen(0)
 
         pygame.event.clear()
@@ -2473,42 +4493,438 @@ class Demo(GameEngine):
 
         self.info.update(self.red_cars + self.radar_flags + [self.player])
         self.update()
-        pygame.display.flip()
+        flip_display()
+
+        # Start timing afresh, so that time spent setting up the screen is not
+        # caught up by skipping frames.
+
+        Config.clock.tick()
+        self.lag = 0.0
 
         # Repeat until a definitive outcome.
 
         while not self.bang and not self.complete and not self.stopped and demo_timer < Config.demo_timer_limit:
-            demo_timer += 1
+            refresh = 0
+            for i in range(0, self.due_ticks()):
+                demo_timer += 1
+                status = self.handle_events(1)
+                if status is not None:
+                    self.info.end_game()
+                    return status
+                if Config.timer is not None:
+                    Config.timer.lap("events")
 
-            Config.clock.tick(Config.framerate)
-            status = self.handle_events(1)
-            if status is not None:
-                self.info.end_game()
-                return status
+                refresh = self.advance() or refresh
+                if self.bang or self.complete or self.stopped or demo_timer >= Config.demo_timer_limit:
+                    break
 
-            if not self.draining_fuel:
-                if not self.bang:
-                    self.player.update()
-                    for red_car in self.red_cars:
-                        red_car.control()
-                        red_car.update()
-                    for smoke in self.smoke:
-                        smoke.update()
-                    for flag in self.flags:
-                        flag.update()
-                    self.info.update(self.red_cars + self.radar_flags + [self.player])
-                    self.collisions()
-                self.update()
+            self.show_frame(refresh)
+
+        self.pause(1000)
+
+        return SHOW_TITLES
+
+# Frame timing.
+
+class FrameTimer:
+
+    """
+    A record of the time spent in each phase of recent game frames, providing
+    percentiles over a window of frames and optionally writing the times for
+    every frame to a file as comma-separated values (in milliseconds).
+
+    Each frame is started using 'start_frame', with the time since the start
+    or the previous lap being added to a phase using 'lap', and with the frame
+    being completed using 'end_frame'.
+    """
+
+    phases = ["events", "player", "cars", "info", "collisions", "render", "display"]
+    labels = ["EV", "PL", "CR", "IN", "CO", "RE", "DI"]
+    window = 300
+
+    try:
+        clock = staticmethod(time.perf_counter)
+    except AttributeError:
+        clock = staticmethod(time.time)
+
+    def __init__(self, filename=None):
+        self.times = {}
+        self.current = {}
+        for phase in self.phases + ["frame"]:
+            self.times[phase] = deque(maxlen=self.window)
+            self.current[phase] = 0.0
+        self.frames = 0
+        self.started = self.last = self.clock()
+        self.overlay = 0
+
+        if filename is not None:
+            self.out = open(filename, "w")
+            self.out.write("frame,%s,frame\n" % ",".join(self.phases))
+        else:
+            self.out = None
+
+    def start_frame(self):
+        self.started = self.last = self.clock()
+        for phase in self.phases:
+            self.current[phase] = 0.0
+
+    def lap(self, phase):
+        now = self.clock()
+        self.current[phase] += now - self.last
+        self.last = now
+
+    def end_frame(self):
+        self.current["frame"] = self.last - self.started
+        for phase in self.phases + ["frame"]:
+            self.times[phase].append(self.current[phase])
+        self.frames += 1
+
+        if self.out is not None:
+            self.out.write("%d,%s\n" % (self.frames,
+                ",".join(["%.3f" % (self.current[phase] * 1000) for phase in self.phases + ["frame"]])))
+
+    def percentile(self, phase, fraction):
+
+        "Return the time in seconds for 'phase' at the given 'fraction' of recent frames."
+
+        times = sorted(self.times[phase])
+        if not times:
+            return 0.0
+        return times[min(len(times) - 1, int(fraction * len(times)))]
+
+    def close(self):
+        if self.out is not None:
+            self.out.close()
+            self.out = None
+
+class Profiler:
+
+    """
+    A sampling profiler recording the stack of the thread starting it at regular
+    intervals from another thread, being cheap enough to leave the game playing
+    normally. When stopped, the samples are written to a file in the collapsed
+    stack format used by flame graph tools or, for filenames ending with .json,
+    in the speedscope format.
+    """
+
+    interval = 0.005
+
+    def __init__(self, filename, interval=None):
+        self.filename = filename
+        self.interval = interval or self.interval
+        self.stacks = {}
+        self.names = {}
+        self.samples = 0
+        self.thread_id = None
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def start(self):
+        self.thread_id = threading.current_thread().ident
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+
+        "Stop sampling and write the samples to the file."
+
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+            self.write()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.sample(frame)
+
+    def sample(self, frame):
+
+        "Record the stack ending with 'frame'."
+
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        stack = tuple(stack)
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.samples += 1
+
+    def get_name(self, code):
+        name = self.names.get(code)
+        if name is None:
+            name = self.names[code] = "%s (%s:%d)" % (code.co_name,
+                os.path.basename(code.co_filename), code.co_firstlineno)
+        return name
+
+    def write(self):
+        out = open(self.filename, "w")
+        try:
+            if self.filename.endswith(".json"):
+                self.write_speedscope(out)
             else:
-                self.draining_fuel = self.info.drain_fuel()
-                if not self.draining_fuel:
-                    self.player.fuel = self.draining_fuel_level
+                self.write_collapsed(out)
+        finally:
+            out.close()
 
-            pygame.display.flip()
+    def write_collapsed(self, out):
 
-        pygame.time.delay(1000)
+        "Write each stack from the outermost call with its number of samples."
 
-        return SHOW_TITLES
+        for stack, count in self.stacks.items():
+            out.write("%s %d\n" % (";".join([self.get_name(code) for code in reversed(stack)]), count))
+
+    def write_speedscope(self, out):
+
+        "Write the stacks as a sampled profile with times in seconds."
+
+        frames = []
+        indexes = {}
+        samples = []
+        weights = []
+
+        for stack, count in self.stacks.items():
+            sample = []
+            for code in reversed(stack):
+                index = indexes.get(code)
+                if index is None:
+                    index = indexes[code] = len(frames)
+                    frames.append({"name" : code.co_name, "file" : code.co_filename,
+                        "line" : code.co_firstlineno})
+                sample.append(index)
+            samples.append(sample)
+            weights.append(count * self.interval)
+
+        json.dump({
+            "$schema" : "https://www.speedscope.app/file-format-schema.json",
+            "shared" : {"frames" : frames},
+            "profiles" : [{
+                "type" : "sampled", "name" : "rally7", "unit" : "seconds",
+                "startValue" : 0, "endValue" : self.samples * self.interval,
+                "samples" : samples, "weights" : weights,
+                }],
+            }, out)
+
+# Input recording and replay.
+
+class InputLog:
+
+    """
+    A record of the player's actions in a game, together with the seed, screen
+    size and any generated map size needed to play the game again. In files, a
+    header line is followed by five bytes for each action: the tick (a four
+    byte, little-endian number) and the action code.
+    """
+
+    header = "RALLY7-INPUT 1"
+    actions = ["left", "right", "up", "down", "smoke", "quit"]
+    record_format = "<IB"
+
+    def __init__(self, seed, size_dir, scale, map_size=None):
+        self.seed = seed
+        self.size_dir = size_dir
+        self.scale = scale
+        self.map_size = map_size # the play area size of any generated maps
+        self.records = []
+        self.ticks = {}
+        self.quit_tick = None
+
+    def add(self, tick, action):
+
+        "Add the given 'action' performed before the given 'tick'."
+
+        self.records.append((tick, action))
+        if action == "quit":
+            if self.quit_tick is None:
+                self.quit_tick = tick
+        else:
+            if tick not in self.ticks:
+                self.ticks[tick] = []
+            self.ticks[tick].append(action)
+
+    def get(self, tick):
+
+        "Return the actions, other than quitting, performed before 'tick'."
+
+        return self.ticks.get(tick, [])
+
+    def set_screen(self):
+
+        "Set the screen size used when the actions were recorded."
+
+        if self.size_dir == "small":
+            set_small_screen()
+        elif self.size_dir == "medium":
+            set_medium_screen()
+        elif self.size_dir == "big":
+            set_big_screen()
+        else:
+            set_scaled_screen(self.scale)
+
+    def write(self, filename):
+        f = open(filename, "wb")
+        try:
+            f.write(("%s %d %s %r%s\n" % (self.header, self.seed, self.size_dir, self.scale,
+                self.map_size and (" generated %dx%d" % self.map_size) or "")).encode("ascii"))
+            for tick, action in self.records:
+                f.write(struct.pack(self.record_format, tick, self.actions.index(action)))
+        finally:
+            f.close()
+
+def read_input_log(filename):
+
+    "Return the InputLog stored in the given 'filename'."
+
+    f = open(filename, "rb")
+    try:
+        fields = f.readline().decode("ascii").split()
+        if " ".join(fields[:2]) != InputLog.header:
+            raise ValueError("Not an input log: %s" % filename)
+        log = InputLog(int(fields[2]), fields[3], float(fields[4]))
+        if fields[5:6] == ["generated"]:
+
+            # Logs recorded before the map size could be chosen give no size.
+
+            if fields[6:7]:
+                log.map_size = tuple([int(n) for n in fields[6].split("x")])
+            else:
+                log.map_size = Config.default_map_size
+        data = f.read()
+    finally:
+        f.close()
+
+    size = struct.calcsize(InputLog.record_format)
+    for offset in range(0, len(data) - size + 1, size):
+        tick, code = struct.unpack(InputLog.record_format, data[offset:offset + size])
+        log.add(tick, InputLog.actions[code])
+    return log
+
+# Headless simulation.
+
+class Simulation(GameEngine):
+
+    """
+    A game without a display, following the same rules as Game but advanced one
+    tick at a time using the 'step' method instead of being driven by events
+    and a clock. The 'player_class' can be Player (controlled by the inputs
+    given to 'step') or DemoPlayer (controlling itself).
+
+    Before simulations are created, set_headless should be called to configure
+    the object size, unless the game images have been loaded.
+    """
+
+    def __init__(self, player_class=Player, level=1, lives=3, seed=None):
+        GameEngine.__init__(self, None, HeadlessInfo(None), seed)
+        self.player_class = player_class
+        self.info.level = level
+        self.info.lives = lives
+
+        # Outcomes.
+
+        self.ticks = 0
+        self.flags_cleared = 0
+        self.deaths = []
+        self.finished = 0
+
+        self.start_level()
+        self.start_life()
+
+    def prepare_view(self):
+        pass
+
+    def start_life(self):
+        GameEngine.start_life(self)
+        self.info.update(self.red_cars + self.radar_flags + [self.player])
+
+    def flag_collected(self, flag):
+        GameEngine.flag_collected(self, flag)
+        self.flags_cleared += 1
+
+    def player_collided(self, player, other):
+
+        "Record only the first cause of the loss of a life."
+
+        if not self.bang and not self.stopped:
+            if isinstance(other, Rock):
+                self.deaths.append("rock")
+            else:
+                self.deaths.append("car")
+        GameEngine.player_collided(self, player, other)
+
+    def player_stopped(self, player):
+        if not self.bang and not self.stopped:
+            self.deaths.append("fuel")
+        GameEngine.player_stopped(self, player)
+
+    def end_life(self):
+        self.info.end_life()
+
+    def step(self, inputs=None):
+
+        """
+        Advance the game by one tick, applying the given 'inputs' (a sequence
+        of actions as accepted by Player.request) beforehand. Return whether the
+        game is still in progress.
+        """
+
+        if self.finished:
+            return 0
+
+        self.ticks += 1
+
+        # Drain the fuel after a level is completed.
+
+        if self.complete and not self.bang and not self.stopped:
+            if not self.info.drain_fuel():
+                self.next_level()
+                self.start_level()
+                self.start_life()
+            return 1
+
+        if inputs and not self.bang:
+            for action in inputs:
+                self.player.request(action)
+
+        self.advance()
+
+        # Test for fatal outcomes, although it is technically possible to lose
+        # a life whilst getting the last flag.
+
+        if self.bang or self.stopped:
+            self.end_life()
+            if self.complete:
+                while self.info.drain_fuel():
+                    pass
+                self.next_level()
+                self.start_level()
+
+            if self.info.lives > 0:
+                self.start_life()
+            else:
+                self.info.end_game()
+                self.finished = 1
+
+        return not self.finished
+
+    def run(self, ticks, inputs=None):
+
+        """
+        Run the game for up to the given number of 'ticks', obtaining inputs for
+        each tick from any 'inputs' callable, which is given the simulation.
+        Return whether the game is still in progress.
+        """
+
+        for i in range(0, ticks):
+            if inputs is not None:
+                actions = inputs(self)
+            else:
+                actions = None
+            if not self.step(actions):
+                return 0
+        return 1
 
 # Main program and associated functions.
 
@@ -2539,8 +4955,21 @@ def mainloop(screen, new_volume=None):
         # mainloop.
 
         handler = titles
+        if Config.replay is not None:
+            handler = Game(screen, info)
+
         while 1:
             status = handler.mainloop()
+
+            # Keep the last game played when recording, and stop after any game
+            # being replayed.
+
+            if isinstance(handler, Game):
+                if Config.replay is not None:
+                    return 1
+                elif Config.record_file is not None:
+                    handler.recording.write(Config.record_file)
+
             if status == QUIT_PRESENTATION:
                 return 1
             elif status == RESET_DISPLAY:
@@ -2596,6 +5025,23 @@ def main():
     elif "--medium" in sys.argv:
         set_medium_screen()
 
+    for arg in sys.argv:
+        if arg.startswith("--scale="):
+            set_scaled_screen(float(arg[len("--scale="):]))
+        elif arg.startswith("--record="):
+            Config.record_file = arg[len("--record="):]
+        elif arg.startswith("--replay="):
+            Config.replay = read_input_log(arg[len("--replay="):])
+            Config.replay.set_screen()
+        elif arg.startswith("--timing="):
+            Config.timer = FrameTimer(arg[len("--timing="):])
+        elif arg.startswith("--map-size="):
+            width, height = arg[len("--map-size="):].split("x")
+            Config.map_size = max(32, int(width)), max(56, int(height))
+        elif arg.startswith("--profile="):
+            Config.profiler = Profiler(arg[len("--profile="):])
+            Config.profiler.start()
+
     Config.sound = Config.have_audio and not ("--no-sound" in sys.argv)
     if not Config.sound:
         volume = 0
@@ -2603,13 +5049,24 @@ def main():
         volume = None
 
     Config.skip_intros = ("--no-intros" in sys.argv)
+    if Config.replay is not None and Config.replay.map_size is not None:
+        Config.map_size = Config.replay.map_size
+        Config.generated_maps = 1
+    else:
+        Config.generated_maps = ("--generated-maps" in sys.argv) or (Config.map_size != Config.default_map_size)
 
     Config.clock = pygame.time.Clock()
 
-    while 1:
-        screen = pygame.display.set_mode(Config.screen_size, Config.screen_flags)
-        if mainloop(screen, volume):
-            break
+    try:
+        while 1:
+            screen = pygame.display.set_mode(Config.screen_size, Config.screen_flags)
+            if mainloop(screen, volume):
+                break
+    finally:
+        if Config.timer is not None:
+            Config.timer.close()
+        if Config.profiler is not None:
+            Config.profiler.stop()
 
 if __name__ == "__main__":
     main()
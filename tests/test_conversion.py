@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+"""
+Tests of the conversion of map walls into the symbols used for display.
+"""
+
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.split(__file__)[0], os.pardir))
+
+import unittest
+import rally7
+
+Config = rally7.Config
+
+def stock_maps():
+
+    "Return the usual map with each kind of wall, before conversion."
+
+    maps = []
+    for challenging in (0, 1):
+        map = Config.map[:]
+        rally7.switch_map(map, challenging)
+        maps.append(map)
+    return maps
+
+def convert_by_matching(map):
+
+    "Convert 'map' by matching the neighbourhood of every cell."
+
+    converted = map[:]
+    for y in range(1, len(map) - 1):
+        row = map[y]
+        new_row = [row[0]]
+        for x in range(1, len(row) - 1):
+            symbol = rally7.match_conversion(map[y-1][x-1:x+2] + row[x-1:x+2] + map[y+1][x-1:x+2])
+            new_row.append(symbol or row[x])
+        new_row.append(row[-1])
+        converted[y] = "".join(new_row)
+    return converted
+
+class ConversionTest(unittest.TestCase):
+
+    def test_table(self):
+        table = rally7.get_conversion_table()
+        for map in stock_maps():
+            for y in range(1, len(map) - 1):
+                for x in range(1, len(map[y]) - 1):
+                    if map[y][x] != "#":
+                        continue
+                    pattern = map[y-1][x-1:x+2] + map[y][x-1:x+2] + map[y+1][x-1:x+2]
+                    mask = 0
+                    for c in range(0, 9):
+                        if pattern[c] in Config.space_or_group_symbols:
+                            mask |= 1 << c
+                    self.assertEqual(table[mask], rally7.match_conversion(pattern))
+
+    def test_convert_map(self):
+        numpy = rally7.numpy
+        try:
+            for map in stock_maps():
+                expected = convert_by_matching(map)
+                for module in (numpy, None):
+                    rally7.numpy = module
+                    converted = map[:]
+                    rally7.convert_map(converted)
+                    self.assertEqual(converted, expected)
+        finally:
+            rally7.numpy = numpy
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""
+Tests of the flow field followed by the red cars.
+"""
+
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.split(__file__)[0], os.pardir))
+
+import unittest
+import rally7
+
+def distances_from(walkable, target):
+
+    "Return a dictionary mapping reachable cells to their distances from 'target'."
+
+    width, height = walkable.width, len(walkable.cells) // walkable.width
+    distances = {target : 0}
+    queue = [target]
+    for x, y in queue:
+        for neighbour in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+            if 0 <= neighbour[0] < width and 0 <= neighbour[1] < height and \
+                neighbour not in distances and walkable.passable_cell(*neighbour):
+                distances[neighbour] = distances[(x, y)] + 1
+                queue.append(neighbour)
+    return distances
+
+class SmallFlowField(rally7.FlowField):
+    limit = 100
+
+class FlowFieldTest(unittest.TestCase):
+
+    def setUp(self):
+        self.walkable = rally7.WalkableGrid(rally7.make_map(0), (24, 24))
+        self.cells = [(x, y) for y in range(0, len(self.walkable.cells) // self.walkable.width)
+            for x in range(0, self.walkable.width) if self.walkable.passable_cell(x, y)]
+        self.target = 20, 55
+
+    def test_distances(self):
+        field = rally7.FlowField(self.walkable)
+        field.update(self.target)
+        expected = distances_from(self.walkable, self.target)
+        width = self.walkable.width
+        found = dict([((index % width, index // width), distance) for index, distance in field.distances.items()])
+        self.assertEqual(found, expected)
+
+    def test_steps_reach_target(self):
+        field = rally7.FlowField(self.walkable)
+        field.update(self.target)
+        expected = distances_from(self.walkable, self.target)
+        for cell in self.cells:
+            if cell not in expected:
+                self.assertEqual(field.step(cell[0], cell[1]), None)
+                continue
+            distance = expected[cell]
+            steps = 0
+            while cell != self.target and steps <= distance:
+                dx, dy = field.step(cell[0], cell[1])
+                cell = cell[0] + dx, cell[1] + dy
+                steps += 1
+            self.assertEqual(steps, distance)
+        self.assertEqual(field.step(self.target[0], self.target[1]), None)
+
+    def test_preferred_step(self):
+        field = rally7.FlowField(self.walkable)
+        field.update(self.target)
+        expected = distances_from(self.walkable, self.target)
+        for x, y in self.cells:
+            if (x, y) not in expected or (x, y) == self.target:
+                continue
+            for dx, dy in field.steps:
+                nearer = expected.get((x + dx, y + dy)) == expected[(x, y)] - 1
+                self.assertEqual(field.step(x, y, (dx, dy)) == (dx, dy), nearer)
+
+    def test_limit(self):
+        field = SmallFlowField(self.walkable)
+        field.update(self.target)
+        expected = distances_from(self.walkable, self.target)
+        width = self.walkable.width
+        self.assertEqual(len(field.distances), SmallFlowField.limit)
+        for index, distance in field.distances.items():
+            self.assertEqual(distance, expected[(index % width, index // width)])
+
+    def test_impassable_target(self):
+        field = rally7.FlowField(self.walkable)
+        field.update((0, 0))
+        self.assertEqual(field.distances, {})
+        self.assertEqual(field.step(self.target[0], self.target[1]), None)
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: tabstop=4 expandtab shiftwidth=4
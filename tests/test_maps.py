@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""
+Tests of the generation and validation of maps.
+"""
+
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.split(__file__)[0], os.pardir))
+
+import unittest
+import rally7
+
+Config = rally7.Config
+
+class GeneratedMapTest(unittest.TestCase):
+
+    sizes = [(32, 56), (41, 60), (64, 64)]
+
+    def setUp(self):
+        self.map_size = Config.map_size
+
+    def tearDown(self):
+        Config.map_size = self.map_size
+        Config.maze_cache = {}
+
+    def test_seeds(self):
+        bx, by = Config.map_border
+        for size in self.sizes:
+            Config.map_size = size
+            for seed in range(0, 10):
+                map = rally7.generate_map(seed)
+                self.assertEqual(len(map), size[1] + by * 2)
+                for row in map:
+                    self.assertEqual(len(row), size[0] + bx * 2)
+                self.assertTrue(rally7.validate_map(map))
+
+                # The start of the level is clear.
+
+                for x in range(Config.start_area_x[0], Config.start_area_x[1] + 1):
+                    self.assertEqual(map[by + 50][x], " ")
+
+    def test_same_map(self):
+        for size in self.sizes:
+            Config.map_size = size
+            maps = [rally7.generate_map(seed) for seed in range(0, 5)]
+            Config.maze_cache = {}
+            self.assertEqual([rally7.generate_map(seed) for seed in range(0, 5)], maps)
+            for i in range(1, len(maps)):
+                self.assertNotEqual(maps[i], maps[0])
+
+    def test_levels(self):
+        Config.map_size = 41, 60
+        for challenging in (0, 1):
+            map = rally7.make_map(challenging, rally7.generate_map(3))
+            walkable = rally7.WalkableGrid(map, (24, 24))
+            self.assertTrue(walkable.passable_cell(Config.map_border[0] + 15, Config.map_border[1] + 50))
+
+class ValidateMapTest(unittest.TestCase):
+
+    def test_stock_map(self):
+        self.assertTrue(rally7.validate_map(Config.map))
+
+    def test_rock_groups(self):
+        map = Config.map[:]
+        y = [i for i, row in enumerate(map) if "1" in row][0]
+        map[y] = map[y].replace("1", " ", 1)
+        self.assertFalse(rally7.validate_map(map))
+
+    def test_unreachable(self):
+        bx, by = Config.map_border
+        map = Config.map[:]
+        map[by // 2] = map[by // 2][:bx // 2] + " " + map[by // 2][bx // 2 + 1:]
+        self.assertFalse(rally7.validate_map(map))
+
+    def test_border(self):
+        bx, by = Config.map_border
+        for y, x in [(0, bx + 1), (by + 1, 0), (by + 1, -1), (-1, bx + 1)]:
+            map = Config.map[:]
+            row = list(map[y])
+            row[x] = " "
+            map[y] = "".join(row)
+            self.assertFalse(rally7.validate_map(map))
+            self.assertRaises(rally7.ConfigError, rally7.make_map, 0, map)
+
+class LargeMapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.map_size = Config.map_size
+        Config.map_size = 200, 200
+        self.walkable = rally7.WalkableGrid(rally7.make_map(0, rally7.generate_map(1)), (24, 24))
+
+    def tearDown(self):
+        Config.map_size = self.map_size
+        Config.maze_cache = {}
+
+    def test_flow_field(self):
+        field = rally7.FlowField(self.walkable)
+        field.update((Config.map_border[0] + 15, Config.map_border[1] + 50))
+        self.assertEqual(len(field.distances), field.limit)
+
+    def test_edges(self):
+
+        "Searches from cells next to the border stay within the map."
+
+        bx, by = Config.map_border
+        width, height = Config.map_size
+        field = rally7.FlowField(self.walkable)
+        paths = rally7.PathFinder(self.walkable)
+        corners = [(bx, by), (bx + width - 1, by), (bx, by + height - 1), (bx + width - 1, by + height - 1)]
+        for corner in corners:
+            if self.walkable.passable_cell(*corner):
+                field.update(corner)
+                self.assertTrue(field.distances)
+                for other in corners:
+                    if self.walkable.passable_cell(*other):
+                        self.assertNotEqual(paths.path(corner, other), None)
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: tabstop=4 expandtab shiftwidth=4
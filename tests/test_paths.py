@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""
+Tests of the path finder used by the demo player.
+"""
+
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.split(__file__)[0], os.pardir))
+
+import random
+import unittest
+import rally7
+from test_flow import distances_from
+
+class ShortPathFinder(rally7.PathFinder):
+    search_limit = 50
+
+class PathFinderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.walkable = rally7.WalkableGrid(rally7.make_map(0), (24, 24))
+        self.cells = [(x, y) for y in range(0, len(self.walkable.cells) // self.walkable.width)
+            for x in range(0, self.walkable.width) if self.walkable.passable_cell(x, y)]
+        self.rng = random.Random(3)
+
+    def assertPath(self, path, start, target):
+        self.assertEqual(path[0], start)
+        self.assertEqual(path[-1], target)
+        for (x, y), (next_x, next_y) in zip(path, path[1:]):
+            self.assertEqual(abs(next_x - x) + abs(next_y - y), 1)
+            self.assertTrue(self.walkable.passable_cell(next_x, next_y))
+
+    def test_shortest_paths(self):
+        paths = rally7.PathFinder(self.walkable)
+        for i in range(0, 20):
+            target = self.rng.choice(self.cells)
+            expected = distances_from(self.walkable, target)
+            for j in range(0, 20):
+                start = self.rng.choice(self.cells)
+                path = paths.path(start, target)
+                if start not in expected:
+                    self.assertEqual(path, None)
+                    continue
+                self.assertPath(path, start, target)
+                self.assertEqual(len(path) - 1, expected[start])
+                self.assertEqual(paths.length(start, target), expected[start])
+
+    def test_cached_paths(self):
+        paths = rally7.PathFinder(self.walkable)
+        start, target = (20, 55), (6, 6)
+        path = paths.path(start, target)
+        cached = len(paths.cache)
+        for i, cell in enumerate(path):
+            self.assertEqual(paths.path(cell, target), path[i:])
+        self.assertEqual(len(paths.cache), cached)
+
+    def test_impassable(self):
+        paths = rally7.PathFinder(self.walkable)
+        self.assertEqual(paths.path((0, 0), (20, 55)), None)
+        self.assertEqual(paths.path((20, 55), (0, 0)), None)
+        self.assertEqual(paths.length((20, 55), (0, 0)), None)
+
+    def test_partial_paths(self):
+        paths = ShortPathFinder(self.walkable)
+        start, target = (5, 6), (36, 61)
+        width = self.walkable.width
+        path = paths.path(start, target)
+        end = path[-1]
+        self.assertNotEqual(end, target)
+        self.assertTrue(abs(end[0] - target[0]) + abs(end[1] - target[1]) <
+            abs(start[0] - target[0]) + abs(start[1] - target[1]))
+
+        # Only the end of the path is left for a new search.
+
+        for cell in path[:-1]:
+            self.assertTrue((cell[1] * width + cell[0], target[1] * width + target[0]) in paths.cache)
+        self.assertFalse((end[1] * width + end[0], target[1] * width + target[0]) in paths.cache)
+
+        # Following the paths leads to the target.
+
+        cell = start
+        for i in range(0, 20):
+            path = paths.path(cell, target)
+            self.assertPath(path, cell, path[-1])
+            cell = path[-1]
+            if cell == target:
+                break
+        self.assertEqual(cell, target)
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: tabstop=4 expandtab shiftwidth=4
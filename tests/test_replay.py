@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+"""
+Tests of seeded random choices and of recording and replaying input.
+"""
+
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.split(__file__)[0], os.pardir))
+
+import random
+import shutil
+import tempfile
+import unittest
+import rally7
+
+Config = rally7.Config
+
+def play(seed, get_actions, ticks=1500):
+
+    """
+    Play a game with the given 'seed', taking the actions for each tick from
+    'get_actions', returning a list of the player's positions and the outcome.
+    """
+
+    simulation = rally7.Simulation(rally7.Player, 1, seed=seed)
+    positions = []
+    tick = 0
+    while tick < ticks:
+        tick += 1
+        if not simulation.step(get_actions(tick)):
+            break
+        positions.append(simulation.player.position)
+    return positions, (simulation.ticks, simulation.flags_cleared, simulation.deaths, simulation.info.score)
+
+class GameRandomTest(unittest.TestCase):
+
+    def test_choices(self):
+
+        "The choices for a seed are the same with any version of Python."
+
+        rng = rally7.GameRandom(42)
+        self.assertEqual([rng.randint(0, 99) for i in range(0, 8)], [63, 2, 27, 22, 73, 67, 89, 8])
+        self.assertEqual(rng.sample(range(0, 10), 4), [4, 0, 1, 3])
+
+    def test_games(self):
+        rally7.set_headless()
+        first = rally7.Simulation(rally7.DemoPlayer, 1, seed=9)
+        second = rally7.Simulation(rally7.DemoPlayer, 1, seed=9)
+        for i in range(0, 1000):
+            self.assertEqual(first.step(), second.step())
+            self.assertEqual(first.player.position, second.player.position)
+            self.assertEqual([car.position for car in first.red_cars], [car.position for car in second.red_cars])
+
+class InputLogTest(unittest.TestCase):
+
+    def setUp(self):
+        rally7.set_headless()
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "game.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        rng = random.Random(5)
+        log = rally7.InputLog(1234, Config.size_dir, Config.scale)
+
+        def record(tick):
+            actions = []
+            if rng.random() < 0.05:
+                actions.append(rng.choice(["left", "right", "up", "down", "smoke"]))
+            for action in actions:
+                log.add(tick, action)
+            return actions
+
+        recorded = play(log.seed, record)
+        log.add(len(recorded[0]) + 1, "quit")
+        log.write(self.filename)
+
+        replay = rally7.read_input_log(self.filename)
+        self.assertEqual((replay.seed, replay.size_dir, replay.scale, replay.map_size),
+            (log.seed, log.size_dir, log.scale, None))
+        self.assertEqual(replay.records, log.records)
+        self.assertEqual(replay.quit_tick, log.quit_tick)
+        self.assertEqual(play(replay.seed, replay.get), recorded)
+
+    def test_map_size(self):
+        log = rally7.InputLog(1, "small", 0.5, (200, 120))
+        log.write(self.filename)
+        self.assertEqual(rally7.read_input_log(self.filename).map_size, (200, 120))
+
+    def test_default_map_size(self):
+        f = open(self.filename, "wb")
+        try:
+            f.write(("%s 1 big 1 generated\n" % rally7.InputLog.header).encode("ascii"))
+        finally:
+            f.close()
+        self.assertEqual(rally7.read_input_log(self.filename).map_size, Config.default_map_size)
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: tabstop=4 expandtab shiftwidth=4
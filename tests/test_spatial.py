@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""
+Tests of the spatial index used for collisions and nearest object searches.
+"""
+
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.split(__file__)[0], os.pardir))
+
+import math
+import random
+import unittest
+import rally7
+
+class Thing:
+
+    "An object with only a position."
+
+    def __init__(self, position):
+        self.position = position
+
+def distance(position, obj):
+    return math.sqrt((obj.position[0] - position[0]) ** 2 + (obj.position[1] - position[1]) ** 2)
+
+class SpatialIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(7)
+        self.index = rally7.SpatialIndex((24, 24))
+        self.things = []
+        for i in range(0, 60):
+            thing = Thing((self.rng.randint(0, 2400), self.rng.randint(0, 2400)))
+            self.things.append(thing)
+            self.index.add(thing)
+
+    def position(self):
+        return self.rng.randint(-100, 2500), self.rng.randint(-100, 2500)
+
+    def test_nearest(self):
+        for i in range(0, 200):
+            position = self.position()
+            subset = [thing for thing in self.things if self.rng.random() < 0.3]
+            found = self.index.nearest(position, subset)
+            if not subset:
+                self.assertEqual(found, None)
+                continue
+            expected = min([(distance(position, thing), n) for n, thing in enumerate(subset)])
+            self.assertEqual(found, (expected[0], subset[expected[1]]))
+
+    def test_nearest_prefers_earlier_objects(self):
+        first, second = Thing((100, 50)), Thing((100, 150))
+        self.index.add(second)
+        self.index.add(first)
+        self.assertTrue(self.index.nearest((100, 100), [first, second])[1] is first)
+        self.assertTrue(self.index.nearest((100, 100), [second, first])[1] is second)
+
+    def test_within(self):
+        for i in range(0, 200):
+            position = self.position()
+            radius = self.rng.randint(0, 400)
+            expected = [(distance(position, thing), self.index.order[thing], thing)
+                for thing in self.things if distance(position, thing) <= radius]
+            expected.sort(key=lambda item: item[:2])
+            self.assertEqual(self.index.within(position, radius),
+                [(d, thing) for d, added, thing in expected])
+
+    def test_near(self):
+        for thing in self.things:
+            other = Thing((thing.position[0] + 23, thing.position[1] - 23))
+            self.index.add(other)
+            self.assertTrue(thing in self.index.near(other.position))
+            self.index.remove(other)
+
+    def test_in_area(self):
+        position, size = (600, 900), (640, 480)
+        found = self.index.in_area(position, size)
+        for thing in self.things:
+            if position[0] - 24 < thing.position[0] < position[0] + size[0] and \
+                position[1] - 24 < thing.position[1] < position[1] + size[1]:
+                self.assertTrue(thing in found)
+        self.assertEqual(found, sorted(found, key=self.index.order.get))
+
+    def test_update_and_remove(self):
+        thing = self.things[0]
+        thing.position = (5000, 5000)
+        self.index.update(thing)
+        self.assertEqual(self.index.nearest((5010, 5010), self.things)[1], thing)
+        self.index.remove(thing)
+        self.assertEqual(self.index.within((5000, 5000), 100), [])
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+"""
+Play a number of demo games without a display, using a pool of processes, and
+show the results of each game.
+
+Usage: python tools/batch.py [ <option>... ]
+
+Options:
+
+  --games=N       Play N games for each level and size (default 100).
+  --seed=N        Seed the first game with N, the next with N+1, and so on
+                  (default 1).
+  --levels=L,...  Start games at each of the given levels (default 1).
+  --sizes=S,...   Play games using each of the given screen sizes: big,
+                  medium, small (default big).
+  --ticks=N       Stop each game after N ticks (default is the demo time
+                  limit).
+  --laziness=N    Set the laziness of the demo player (default 8).
+  --computer-laziness=N
+                  Set the laziness of the red cars (default 5).
+  --speed-advantage=N
+                  Set the speed advantage of the red cars on the big screen
+                  (default 1).
+  --pursuit=P     Make the red cars pursue the player using the given
+                  behaviour: flow, direct (default flow).
+  --processes=N   Use N processes (default is the number of processors).
+  --summary       Show only a summary of the results for each level and size.
+
+Each game is played like a demo game, ending when the level is cleared, the
+car crashes or runs out of fuel, or the tick limit is reached. The results are
+shown as comma-separated values: size, level, seed, flags cleared, score,
+ticks survived, and the cause of the end of the game (rock, car, fuel, complete
+or timeout).
+"""
+
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.split(__file__)[0], os.pardir))
+
+import multiprocessing
+import rally7
+
+sizes = {
+    "big" : rally7.set_big_screen,
+    "medium" : rally7.set_medium_screen,
+    "small" : rally7.set_small_screen,
+    }
+
+def play(game):
+
+    """
+    Play the given 'game', described by a (size, level, seed, ticks, settings)
+    tuple, returning the results as a tuple.
+    """
+
+    size, level, seed, ticks, settings = game
+    laziness, computer_laziness, speed_advantage, pursuit = settings
+
+    rally7.DemoPlayer.laziness = laziness
+    rally7.Computer.laziness = computer_laziness
+    rally7.Computer.pursuit = pursuit
+    rally7.Config.big_computer_speed_advantage = speed_advantage
+    sizes[size]()
+    rally7.set_headless()
+
+    simulation = rally7.Simulation(rally7.DemoPlayer, level, 1, seed)
+    while simulation.ticks < ticks and not simulation.complete and simulation.step():
+        pass
+
+    if simulation.deaths:
+        cause = simulation.deaths[-1]
+    elif simulation.complete:
+        cause = "complete"
+    else:
+        cause = "timeout"
+
+    return size, level, seed, simulation.flags_cleared, simulation.info.score, simulation.ticks, cause
+
+def get_options(args):
+
+    "Return a dictionary of options from the given 'args'."
+
+    options = {
+        "games" : "100", "seed" : "1", "levels" : "1", "sizes" : "big",
+        "ticks" : str(rally7.Config.demo_timer_limit),
+        "laziness" : str(rally7.DemoPlayer.laziness),
+        "computer-laziness" : str(rally7.Computer.laziness),
+        "speed-advantage" : str(rally7.Config.big_computer_speed_advantage),
+        "pursuit" : rally7.Computer.pursuit,
+        "processes" : None, "summary" : None,
+        }
+
+    for arg in args:
+        if not arg.startswith("--"):
+            raise ValueError("Unrecognised argument: %s" % arg)
+        name, value = (arg[2:].split("=", 1) + ["1"])[:2]
+        if name not in options:
+            raise ValueError("Unrecognised option: %s" % arg)
+        options[name] = value
+
+    return options
+
+def summarise(results):
+
+    "Show a summary of the given 'results' for each size and level."
+
+    groups = {}
+    for size, level, seed, flags, score, ticks, cause in results:
+        key = size, level
+        if key not in groups:
+            groups[key] = []
+        groups[key].append((flags, score, ticks, cause))
+
+    print("size,level,games,mean flags,mean score,mean ticks,complete,rock,car,fuel,timeout")
+    keys = list(groups.keys())
+    keys.sort()
+    for key in keys:
+        group = groups[key]
+        n = len(group)
+        causes = [cause for flags, score, ticks, cause in group]
+        print("%s,%d,%d,%.2f,%.1f,%.1f,%d,%d,%d,%d,%d" % (key + (n,
+            float(sum([flags for flags, score, ticks, cause in group])) / n,
+            float(sum([score for flags, score, ticks, cause in group])) / n,
+            float(sum([ticks for flags, score, ticks, cause in group])) / n,
+            causes.count("complete"), causes.count("rock"), causes.count("car"),
+            causes.count("fuel"), causes.count("timeout"))))
+
+def main(args):
+    options = get_options(args)
+
+    if options["pursuit"] not in ("flow", "direct"):
+        raise ValueError("Unrecognised pursuit: %s" % options["pursuit"])
+
+    settings = int(options["laziness"]), int(options["computer-laziness"]), float(options["speed-advantage"]), \
+        options["pursuit"]
+    ticks = int(options["ticks"])
+    seed = int(options["seed"])
+
+    games = []
+    for size in options["sizes"].split(","):
+        if size not in sizes:
+            raise ValueError("Unrecognised size: %s" % size)
+        for level in options["levels"].split(","):
+            for i in range(0, int(options["games"])):
+                games.append((size, int(level), seed + i, ticks, settings))
+
+    if options["processes"] is not None:
+        pool = multiprocessing.Pool(int(options["processes"]))
+    else:
+        pool = multiprocessing.Pool()
+
+    try:
+        if options["summary"]:
+            summarise(pool.map(play, games))
+        else:
+            print("size,level,seed,flags,score,ticks,cause")
+            for result in pool.imap(play, games):
+                print("%s,%d,%d,%d,%d,%d,%s" % result)
+    finally:
+        pool.close()
+        pool.join()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
+
+# vim: tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+
+"""
+Measure the time taken by frequently used parts of the game without a display,
+using synthetic images, and save the results or compare them with previously
+saved results.
+
+Usage: python tools/benchmark.py [ <option>... ]
+
+Options:
+
+  --output=FILE   Write the results to FILE as JSON.
+  --baseline=FILE Compare the results with the saved results in FILE, showing
+                  any benchmarks slower by more than the threshold.
+  --results=FILE  Compare the saved results in FILE with the baseline instead
+                  of running the benchmarks.
+  --threshold=N   Treat benchmarks more than N percent slower than the baseline
+                  as regressions (default 10).
+  --only=B,...    Run only the given benchmarks.
+  --repeat=N      Time each benchmark N times, keeping the fastest (default 5).
+  --entities=N,...
+                  Measure collisions with each of the given numbers of extra
+                  rocks and red cars (default 0,50,200).
+  --size=S        Use the given screen size: big, medium, small (default big).
+  --data=DIR      Use the images in DIR instead of synthetic images.
+
+The results are shown as comma-separated values: benchmark, microseconds per
+call and, when comparing, the baseline time and the change as a percentage.
+The exit status is 1 if any regressions are found.
+"""
+
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.split(__file__)[0], os.pardir))
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import json
+import shutil
+import tempfile
+import timeit
+import pygame
+import rally7
+from batch import sizes
+from synthetic import make_data
+
+Config = rally7.Config
+
+# Benchmarks, each preparing and returning a function to be timed.
+
+def bench_convert_map(context):
+    source = Config.map[:]
+    rally7.switch_map(source, 0)
+    def run():
+        rally7.convert_map(source[:])
+    return run
+
+def bench_match_conversion(context):
+    source = Config.map[:]
+    rally7.switch_map(source, 0)
+    patterns = []
+    for y in range(1, len(source) - 1):
+        for x in range(1, len(source[y]) - 1):
+            patterns.append(source[y-1][x-1:x+2] + source[y][x-1:x+2] + source[y+1][x-1:x+2])
+    def run():
+        for pattern in patterns:
+            rally7.match_conversion(pattern)
+    return run
+
+def bench_recolour(context):
+    image = Config.objects["wall"].copy()
+    def run():
+        rally7.recolour(image, (180, 0, 0), (0, 255, 0))
+    return run
+
+def bench_write(context):
+    screen = context["screen"]
+    def run():
+        rally7.write(screen, rally7.cpos(28, 3), (0, 255, 255), "12345")
+    return run
+
+def bench_write_cold(context):
+    screen = context["screen"]
+    def run():
+        Config.glyph_cache = rally7.SurfaceCache(Config.glyph_cache_limit)
+        Config.text_cache = rally7.SurfaceCache(Config.text_cache_limit)
+        rally7.write(screen, rally7.cpos(28, 3), (0, 255, 255), "12345")
+    return run
+
+def bench_update(context):
+    game = context["game"]
+    def run():
+        game.update()
+    return run
+
+def bench_info_update(context):
+    game = context["game"]
+    objects = game.red_cars + game.radar_flags + [game.player]
+    def run():
+        game.info.update(objects)
+    return run
+
+def bench_car_update(context):
+    simulation = rally7.Simulation(rally7.DemoPlayer, 3, seed=1)
+    car = simulation.red_cars[0]
+    car.delay = 0
+    def run():
+        rally7.Car.update(car)
+    return run
+
+def bench_place_objects(context):
+    simulation = rally7.Simulation(rally7.DemoPlayer, 3, seed=1)
+    samples = list(range(0, 10)), list(range(0, 10))
+    rock_samples = list(range(0, 8)), [i % 2 for i in range(0, 8)]
+    def run():
+        simulation.place_flags(simulation.current_map, samples)
+        simulation.place_rocks(simulation.current_map, rock_samples)
+    return run
+
+def collisions(entities):
+
+    """
+    Return a benchmark of collisions with the given number of extra 'entities',
+    one in every five being a red car and the others being rocks.
+    """
+
+    def bench_collisions(context):
+        simulation = rally7.Simulation(rally7.DemoPlayer, 3, seed=1)
+        cells = []
+        for y, row in enumerate(simulation.current_map):
+            for x, symbol in enumerate(row):
+                if symbol == " ":
+                    cells.append((x, y))
+        for i, (x, y) in enumerate(simulation.rng.sample(cells, min(entities, len(cells)))):
+            if i % 5 == 4:
+                car = rally7.Computer((0, -1), rally7.map_to_exact((x, y)), Config.objects.get("car-red"), simulation)
+                simulation.red_cars.append(car)
+                simulation.opponents.insert(len(simulation.red_cars) - 1, car)
+                simulation.index.add(car)
+            else:
+                rock = rally7.Rock(rally7.map_to_exact((x, y)), Config.objects.get("rock"), simulation)
+                simulation.rocks.append(rock)
+                simulation.opponents.append(rock)
+                simulation.index.add(rock)
+        def run():
+            simulation.collisions()
+        return run
+    return bench_collisions
+
+benchmarks = [
+    ("convert_map", bench_convert_map),
+    ("match_conversion", bench_match_conversion),
+    ("recolour", bench_recolour),
+    ("write", bench_write),
+    ("write_cold", bench_write_cold),
+    ("update", bench_update),
+    ("info_update", bench_info_update),
+    ("car_update", bench_car_update),
+    ("place_objects", bench_place_objects),
+    ]
+
+def measure(run, repeat):
+
+    """
+    Return the fastest time in seconds per call of 'run' from 'repeat' timings,
+    each making enough calls to take a measurable time.
+    """
+
+    number = 1
+    while 1:
+        start = timeit.default_timer()
+        for i in range(0, number):
+            run()
+        elapsed = timeit.default_timer() - start
+        if elapsed >= 0.05:
+            break
+        number *= 2
+
+    times = [elapsed / number]
+    for i in range(1, repeat):
+        start = timeit.default_timer()
+        for i in range(0, number):
+            run()
+        times.append((timeit.default_timer() - start) / number)
+    return min(times), number
+
+def run_benchmarks(options):
+
+    "Run the benchmarks selected by 'options', returning the results."
+
+    size = options["size"]
+    if size not in sizes:
+        raise ValueError("Unrecognised size: %s" % size)
+
+    selected = benchmarks[:]
+    for entities in options["entities"].split(","):
+        selected.append(("collisions_%d" % int(entities), collisions(int(entities))))
+    if options["only"]:
+        names = options["only"].split(",")
+        selected = [(name, bench) for name, bench in selected if name in names]
+
+    # Prepare the game using synthetic images and a separate image cache.
+
+    temporary = tempfile.mkdtemp()
+    try:
+        if options["data"]:
+            Config.data_dir = options["data"]
+        else:
+            Config.data_dir = os.path.join(temporary, "data")
+            pygame.display.init()
+            pygame.display.set_mode((1, 1))
+            make_data(Config.data_dir)
+        Config.cache_dir = os.path.join(temporary, "cache")
+
+        pygame.init()
+        Config.have_audio = 0
+        sizes[size]()
+        screen = pygame.display.set_mode((int(Config.screen_size[0]), int(Config.screen_size[1])))
+        rally7.init(screen)
+
+        game = rally7.Demo(screen, rally7.Info(screen), 1)
+        game.start_level()
+        game.show()
+        game.start_life()
+        context = {"screen" : screen, "game" : game}
+
+        results = {}
+        for name, bench in selected:
+            seconds, number = measure(bench(context), int(options["repeat"]))
+            results[name] = {"seconds" : seconds, "calls" : number}
+            print("%s,%.2f" % (name, seconds * 1000000))
+            sys.stdout.flush()
+
+    finally:
+        shutil.rmtree(temporary)
+
+    return {
+        "python" : sys.version.split()[0],
+        "pygame" : pygame.version.ver,
+        "size" : size,
+        "benchmarks" : results,
+        }
+
+def compare(baseline, results, threshold):
+
+    """
+    Show the 'results' compared with the 'baseline', returning the names of
+    benchmarks slower by more than 'threshold' percent.
+    """
+
+    regressions = []
+    print("benchmark,microseconds,baseline,change")
+    names = list(results["benchmarks"].keys())
+    names.sort()
+    for name in names:
+        seconds = results["benchmarks"][name]["seconds"]
+        if name not in baseline["benchmarks"]:
+            print("%s,%.2f,," % (name, seconds * 1000000))
+            continue
+        old = baseline["benchmarks"][name]["seconds"]
+        change = (seconds - old) * 100 / old
+        if change > threshold:
+            regressions.append(name)
+        print("%s,%.2f,%.2f,%+.1f%%%s" % (name, seconds * 1000000, old * 1000000, change,
+            change > threshold and " REGRESSION" or ""))
+    return regressions
+
+def get_options(args):
+
+    "Return a dictionary of options from the given 'args'."
+
+    options = {
+        "output" : None, "baseline" : None, "results" : None, "threshold" : "10",
+        "only" : None, "repeat" : "5", "entities" : "0,50,200", "size" : "big",
+        "data" : None,
+        }
+
+    for arg in args:
+        if not arg.startswith("--"):
+            raise ValueError("Unrecognised argument: %s" % arg)
+        name, value = (arg[2:].split("=", 1) + ["1"])[:2]
+        if name not in options:
+            raise ValueError("Unrecognised option: %s" % arg)
+        options[name] = value
+
+    return options
+
+def read_results(filename):
+    f = open(filename)
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+def main(args):
+    options = get_options(args)
+
+    if options["results"]:
+        results = read_results(options["results"])
+    else:
+        results = run_benchmarks(options)
+
+    if options["output"]:
+        f = open(options["output"], "w")
+        try:
+            json.dump(results, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+
+    if options["baseline"]:
+        if compare(read_results(options["baseline"]), results, float(options["threshold"])):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
+
+# vim: tabstop=4 expandtab shiftwidth=4
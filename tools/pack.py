@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+
+"""
+Write a data bundle containing the game images and music, for use instead of
+the separate files in the data directory.
+
+Usage: python tools/pack.py [ <data directory> [ <bundle filename> ] ]
+"""
+
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.split(__file__)[0], os.pardir))
+
+import rally7
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        data_dir = sys.argv[1]
+    else:
+        data_dir = os.path.join(os.path.dirname(os.path.abspath(rally7.__file__)), "data")
+
+    if len(sys.argv) > 2:
+        filename = sys.argv[2]
+    else:
+        filename = os.path.join(data_dir, rally7.Config.bundle_name)
+
+    rally7.write_bundle(filename, data_dir)
+
+# vim: tabstop=4 expandtab shiftwidth=4
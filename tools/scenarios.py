@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+
+"""
+Play scripted games as quickly as possible without a display, using synthetic
+images, and show the frame rate, frame times and memory used for each screen
+size.
+
+Usage: python tools/scenarios.py [ <option>... ]
+
+Options:
+
+  --sizes=S,...   Play the scenarios using each of the given screen sizes: big,
+                  medium, small (default big,medium,small).
+  --scenarios=S,...
+                  Play only the given scenarios (default all).
+  --ticks=N       Play each scenario for N ticks (default 1500).
+  --seed=N        Seed the games with N (default 1).
+  --data=DIR      Use the images in DIR instead of synthetic images.
+
+The scenarios are as follows:
+
+  level1          The first level.
+  challenging     The first challenging level, with eight red cars.
+  smoke           The second level, making smoke as often as possible.
+  fuel            The first level with so little fuel that it soon runs out.
+  reset           The first level, resetting the display halfway through.
+  demo            The demo shown in attract mode, without the pause at the end
+                  of each demo.
+
+In each scenario, the player's car steers itself like the car in the demo,
+with other actions being scripted, and new games (or demos) are started until
+the given number of ticks have been played. The display is updated without waiting for
+the clock. The results are shown as comma-separated values: size, scenario,
+frames, frames per second, 99th percentile and maximum frame times (in
+milliseconds), the time taken by any display reset (in milliseconds, including
+the pause after the images are loaded) and the peak memory used by the process
+(in megabytes), which includes that of earlier scenarios for the same size.
+"""
+
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.split(__file__)[0], os.pardir))
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import multiprocessing
+import shutil
+import tempfile
+import timeit
+import pygame
+import rally7
+from batch import sizes
+from synthetic import make_data
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+Config = rally7.Config
+
+class ScriptedPlayer(rally7.DemoPlayer):
+
+    "A player steering itself like the demo player but accepting actions."
+
+    request = rally7.Player.request
+
+class ScenarioGame(rally7.Game):
+
+    "A game whose player is a scripted player."
+
+    player_class = ScriptedPlayer
+
+class ScenarioDemo(rally7.Demo):
+
+    "A demo counting its ticks and not pausing when it ends."
+
+    def advance(self):
+        self.tick += 1
+        return rally7.Demo.advance(self)
+
+    def pause(self, delay):
+        pass
+
+class NoLimitClock:
+
+    "A clock reporting no time passing, so that games advance once per frame."
+
+    def tick(self, framerate=0):
+        return 0
+
+# Scenarios, each being a (level, actions, interval, fuel length, reset, demo)
+# tuple describing the starting level, any action to be performed every given
+# number of ticks, any fuel length to be used, whether the display is reset and
+# whether the demo is played instead of a game.
+
+scenarios = [
+    ("level1", (1, None, 0, None, 0, 0)),
+    ("challenging", (3, None, 0, None, 0, 0)),
+    ("smoke", (2, "smoke", 5, None, 0, 0)),
+    ("fuel", (1, None, 0, 5, 0, 0)),
+    ("reset", (1, None, 0, None, 1, 0)),
+    ("demo", (1, None, 0, None, 0, 1)),
+    ]
+
+def get_peak_memory():
+
+    "Return the peak memory used by the process in megabytes, or None if unknown."
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024.0 * 1024)
+    else:
+        return peak / 1024.0
+
+def start_display():
+
+    "Set up the display and the game images for the current screen size."
+
+    rally7.reset_caches()
+    screen = pygame.display.set_mode((int(Config.screen_size[0]), int(Config.screen_size[1])))
+    rally7.init(screen)
+    return screen
+
+def play(screen, seed, level, action, interval, ticks):
+
+    """
+    Play a game on 'screen' with the given 'seed', starting at 'level' and
+    performing any 'action' every 'interval' ticks, for no more than 'ticks'.
+    Return the number of ticks played.
+    """
+
+    log = rally7.InputLog(seed, Config.size_dir, Config.scale)
+    if action is not None:
+        for tick in range(interval, ticks + 1, interval):
+            log.add(tick, action)
+    log.add(ticks + 1, "quit")
+
+    Config.replay = log
+    try:
+        game = ScenarioGame(screen, rally7.Info(screen))
+        game.info.level = level
+        game.mainloop()
+    finally:
+        Config.replay = None
+
+    return game.tick
+
+def play_demo(screen, seed, level, ticks):
+
+    """
+    Play the demo on 'screen' with the given 'seed', starting at 'level', for no
+    more than 'ticks'. Return the number of ticks played.
+    """
+
+    old_limit = Config.demo_timer_limit
+    Config.demo_timer_limit = ticks
+    try:
+        demo = ScenarioDemo(screen, rally7.Info(screen), seed)
+        demo.info.level = level
+        demo.mainloop()
+    finally:
+        Config.demo_timer_limit = old_limit
+
+    return demo.tick
+
+def run_scenario(screen, name, settings, options):
+
+    "Run the scenario with the given 'name' and 'settings', returning the results."
+
+    level, action, interval, fuel_length, reset, demo = settings
+    ticks = int(options["ticks"])
+    seed = int(options["seed"])
+
+    old_fuel_length = Config.game_fuel_length
+    if fuel_length is not None:
+        Config.game_fuel_length = fuel_length
+
+    Config.timer = rally7.FrameTimer()
+    reset_time = None
+    start = timeit.default_timer()
+
+    try:
+        played = 0
+        while played < ticks:
+
+            # Reset the display as is done when changing the screen size, not
+            # counting the time taken as part of the frames.
+
+            if reset and played >= ticks // 2:
+                reset = 0
+                reset_start = timeit.default_timer()
+                screen = start_display()
+                reset_time = timeit.default_timer() - reset_start
+                start += reset_time
+
+            remaining = ticks - played
+            if reset:
+                remaining = min(remaining, ticks // 2 - played)
+            if demo:
+                played += max(1, play_demo(screen, seed, level, remaining))
+            else:
+                played += max(1, play(screen, seed, level, action, interval, remaining))
+            seed += 1
+
+        elapsed = timeit.default_timer() - start
+        times = sorted(Config.timer.times["frame"])
+        frames = Config.timer.frames
+
+    finally:
+        Config.timer = None
+        Config.game_fuel_length = old_fuel_length
+
+    return (Config.size_dir, name, frames, frames / elapsed,
+        times[min(len(times) - 1, int(0.99 * len(times)))] * 1000, times[-1] * 1000,
+        reset_time, get_peak_memory())
+
+def run_size(task):
+
+    """
+    Run the scenarios for the screen size given by 'task', being a (size,
+    options) tuple, returning a list of results.
+    """
+
+    size, options = task
+
+    # Frame times are kept for every frame, not just recent ones.
+
+    rally7.FrameTimer.window = None
+
+    temporary = tempfile.mkdtemp()
+    try:
+        pygame.init()
+        Config.have_audio = 0
+        Config.skip_intros = 1
+        Config.clock = NoLimitClock()
+        Config.data_dir = options["data"]
+        Config.cache_dir = os.path.join(temporary, "cache")
+        sizes[size]()
+        screen = start_display()
+
+        names = options["scenarios"] and options["scenarios"].split(",") or None
+        results = []
+        for name, settings in scenarios:
+            if names is None or name in names:
+                results.append(run_scenario(screen, name, settings, options))
+        return results
+
+    finally:
+        shutil.rmtree(temporary)
+
+def get_options(args):
+
+    "Return a dictionary of options from the given 'args'."
+
+    options = {
+        "sizes" : "big,medium,small", "scenarios" : None, "ticks" : "1500",
+        "seed" : "1", "data" : None,
+        }
+
+    for arg in args:
+        if not arg.startswith("--"):
+            raise ValueError("Unrecognised argument: %s" % arg)
+        name, value = (arg[2:].split("=", 1) + ["1"])[:2]
+        if name not in options:
+            raise ValueError("Unrecognised option: %s" % arg)
+        options[name] = value
+
+    return options
+
+def main(args):
+    options = get_options(args)
+
+    for size in options["sizes"].split(","):
+        if size not in sizes:
+            raise ValueError("Unrecognised size: %s" % size)
+
+    temporary = tempfile.mkdtemp()
+    try:
+        if not options["data"]:
+            options["data"] = os.path.join(temporary, "data")
+            pygame.display.init()
+            pygame.display.set_mode((1, 1))
+            make_data(options["data"])
+            pygame.display.quit()
+
+        # Play each size in a new process so that the memory used is measured
+        # separately.
+
+        pool = multiprocessing.Pool(1, maxtasksperchild=1)
+        try:
+            print("size,scenario,frames,fps,p99 ms,max ms,reset ms,peak mb")
+            for results in pool.imap(run_size, [(size, options) for size in options["sizes"].split(",")]):
+                for result in results:
+                    reset_time, peak = result[6:]
+                    print("%s,%s,%d,%.1f,%.2f,%.2f,%s,%s" % (result[:6] + (
+                        reset_time is not None and ("%.1f" % (reset_time * 1000)) or "",
+                        peak is not None and ("%.1f" % peak) or "")))
+                sys.stdout.flush()
+        finally:
+            pool.close()
+            pool.join()
+
+    finally:
+        shutil.rmtree(temporary)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
+
+# vim: tabstop=4 expandtab shiftwidth=4
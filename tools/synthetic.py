@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""
+Make a data directory of synthetic images and music entries for the game, so
+that the game can be run or measured without the real images and music.
+
+Usage: python tools/synthetic.py <data-dir>
+
+Each image is a square of a distinct colour with a diagonal line, having the
+size of the corresponding real image for the big screen, from which the game
+derives the images for other screen sizes. The music files are empty, being
+usable only when audio is not used.
+"""
+
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.split(__file__)[0], os.pardir))
+
+import pygame
+
+# Image names and big screen sizes for each image directory.
+
+directories = [
+    (".", [
+        "car", "car-red", "flag", "flag-S", "flag-L", "rock", "smoke", "bang",
+        "corner", "edge", "end", "wall", "solid", "single",
+        "trees", "ocean", "mountains",
+        ], 60),
+    ("characters", list("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!'-=?%"), 20),
+    ("special", ["logo"], 200),
+    ("info", ["life"], 20),
+    ]
+
+music = ["intro_theme", "main_theme", "fuel_theme", "challenging_theme", "challenging_intro_theme"]
+
+def make_image(size, i):
+
+    "Return a synthetic image of the given 'size' for the 'i'th image."
+
+    image = pygame.Surface((size, size), pygame.SRCALPHA, 32)
+    image.fill(((i * 37) % 256, (i * 91) % 256, (i * 53) % 256, 255))
+    pygame.draw.line(image, (255, 255, 255, 255), (0, 0), (size - 1, size // 2))
+    return image
+
+def make_data(data_dir):
+
+    "Write synthetic images and music entries into 'data_dir'."
+
+    for directory, names, size in directories:
+        path = os.path.join(data_dir, directory, "big")
+        if not os.path.exists(path):
+            os.makedirs(path)
+        for i, name in enumerate(names):
+            pygame.image.save(make_image(size, i), os.path.join(path, name + os.extsep + "png"))
+
+    path = os.path.join(data_dir, "music")
+    if not os.path.exists(path):
+        os.makedirs(path)
+    for name in music:
+        open(os.path.join(path, name + os.extsep + "ogg"), "wb").close()
+
+def main(args):
+    if len(args) != 1:
+        print(__doc__)
+        sys.exit(1)
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+    make_data(args[0])
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
+
+# vim: tabstop=4 expandtab shiftwidth=4
@@ -0,0 +1,871 @@
+#!/usr/bin/env python
+
+"""
+Play many demo games at once without a display, keeping the state of all games
+in arrays and applying the game rules to all games using array operations.
+
+Usage: python tools/vector.py [ <option>... ]
+
+Options:
+
+  --games=N       Play N games (default 10000).
+  --seed=N        Seed the random number generator with N (default 1).
+  --level=N       Start the games at level N (default 1).
+  --size=S        Use the given screen size: big, medium, small (default big).
+  --ticks=N       Stop each game after N ticks (default is the demo time
+                  limit).
+  --laziness=N    Set the laziness of the demo player (default 8).
+  --computer-laziness=N
+                  Set the laziness of the red cars (default 5).
+  --speed-advantage=N
+                  Set the speed advantage of the red cars on the big screen
+                  (default 1).
+  --pursuit=P     Make the red cars pursue the player using the given
+                  behaviour: flow, direct (default flow).
+  --summary       Show only a summary of the results.
+
+Games are played like those run by tools/batch.py, following the rules of the
+Car, Player, DemoPlayer, Computer, Flag and Smoke classes, with the results
+shown in the same way. Since the games share a random number generator, the
+results differ from those of individual games using the same seed. The
+player's car follows the shortest paths to flags found from the distances
+between all pairs of map cells, and where several paths are equally short, it
+may take a different one to the one found by the game. Smoke and flags also
+disappear exactly when their time is up, rather than sometimes lingering for a
+tick as they do in the game.
+"""
+
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.split(__file__)[0], os.pardir))
+
+import numpy
+import rally7
+from batch import sizes, summarise
+
+Config = rally7.Config
+
+# Special values.
+
+NO_TIMER = -1
+NORMAL, SPECIAL, LUCKY = 0, 1, 2
+
+class Batch:
+
+    """
+    A batch of demo games starting at the same level, with the state of the
+    games held in arrays indexed by game and, where appropriate, by car, flag,
+    rock or smoke.
+    """
+
+    max_smoke = 16
+
+    # The arrays indexed by game, with those providing the outcomes of games
+    # listed first.
+
+    outcomes = ["ticks", "score", "flags_cleared", "bang", "rock_bang", "stopped", "complete"]
+    states = outcomes + [
+        "draining", "draining_level", "score_flag", "fuel", "more_smoke",
+        "speed", "x", "y", "dx", "dy", "rx", "ry", "requested",
+        "delay", "bx", "by", "rebound", "immobile",
+        "fx", "fy", "flag_type", "flag_timer", "flag_present", "radar_flag",
+        "rock_x", "rock_y", "rock_present",
+        "smoke_x", "smoke_y", "smoke_remaining", "smoke_order",
+        ]
+
+    def __init__(self, games, level=1, seed=None, laziness=None, computer_laziness=None, pursuit=None):
+        self.games = games
+        self.level = level
+        self.rng = numpy.random.RandomState(seed)
+
+        if laziness is None:
+            laziness = rally7.DemoPlayer.laziness
+        if computer_laziness is None:
+            computer_laziness = rally7.Computer.laziness
+        if pursuit is None:
+            pursuit = rally7.Computer.pursuit
+        self.laziness = laziness
+        self.computer_laziness = computer_laziness
+        self.pursuit = pursuit
+
+        self.size = Config.object_size
+        self.challenging = (level + 1) % 4 == 0
+
+        # The walkability grid shared by all games.
+
+        self.map = rally7.make_map(self.challenging)
+        width = max([len(row) for row in self.map])
+        self.grid = numpy.zeros(len(self.map) * width, bool)
+        for y, row in enumerate(self.map):
+            for x, c in enumerate(row):
+                self.grid[y * width + x] = c in Config.space_or_group_symbols
+
+        # Tables mapping whole pixel positions to map cells and grid offsets.
+
+        self.cell_x = numpy.arange(width * self.size[0]) // self.size[0]
+        self.cell_y = numpy.arange(len(self.map) * self.size[1]) // self.size[1]
+        self.row_y = self.cell_y * width
+        self.width = width
+
+        self.start_distances()
+
+        self.start_cars()
+        self.start_objects()
+        self.start_player()
+
+        # Outcomes.
+
+        self.ticks = numpy.zeros(games, int)
+        self.score = numpy.zeros(games, int)
+        self.flags_cleared = numpy.zeros(games, int)
+        self.bang = numpy.zeros(games, bool)
+        self.rock_bang = numpy.zeros(games, bool)
+        self.stopped = numpy.zeros(games, bool)
+        self.complete = numpy.zeros(games, bool)
+        self.draining = numpy.zeros(games, bool)
+        self.draining_level = numpy.zeros(games, int)
+        self.score_flag = numpy.zeros(games, int) + 100 * level
+
+        # Games still being played, with finished games having their outcomes
+        # copied into the results.
+
+        self.index = numpy.arange(games)
+        self.rows = games
+        self.results = {}
+        for name in self.outcomes:
+            self.results[name] = getattr(self, name).copy()
+
+    def start_cars(self):
+
+        "Set up the cars, with the player's car first, as done by GameEngine."
+
+        bx, by = Config.map_border
+        n = self.games
+
+        cells = [(bx + 15, by + 50, -1)]
+        cells += [(bx + 13, by + 54, -1), (bx + 15, by + 54, -1), (bx + 17, by + 54, -1)]
+        if self.level % 2 == 0:
+            cells += [(bx + 11, by + 54, -1), (bx + 19, by + 54, -1)]
+        if self.challenging:
+            cells += [(bx + 13, by + 1, 1), (bx + 15, by + 1, 1), (bx + 17, by + 1, 1)]
+
+        ncars = len(cells)
+        self.speed = numpy.zeros((n, ncars), float) + Config.car_speed + Config.computer_speed_advantage
+        self.speed[:, 0] = Config.car_speed
+
+        self.x = numpy.zeros((n, ncars), float)
+        self.y = numpy.zeros((n, ncars), float)
+        self.dx = numpy.zeros((n, ncars), float)
+        self.dy = numpy.zeros((n, ncars), float)
+        for i, (x, y, direction) in enumerate(cells):
+            self.x[:, i] = x * self.size[0]
+            self.y[:, i] = y * self.size[1]
+            self.dy[:, i] = direction * self.speed[:, i]
+
+        # Requested directions.
+
+        self.rx = numpy.zeros((n, ncars), float)
+        self.ry = numpy.zeros((n, ncars), float)
+        self.requested = numpy.zeros((n, ncars), bool)
+
+        # Red car status.
+
+        self.delay = numpy.zeros((n, ncars), int) + 50
+        self.delay[:, 0] = 0
+        self.bx = numpy.zeros((n, ncars), float)
+        self.by = numpy.zeros((n, ncars), float)
+        self.rebound = numpy.zeros((n, ncars), bool)
+        self.immobile = numpy.zeros((n, ncars), bool)
+        if self.challenging:
+            self.immobile[:, 1:] = 1
+
+    def start_objects(self):
+
+        "Place the flags and rocks for each game, as done by GameEngine."
+
+        n = self.games
+        nflags = 10
+        nrocks = (self.level - 1) % 10
+
+        self.fx = numpy.zeros((n, nflags), float)
+        self.fy = numpy.zeros((n, nflags), float)
+        self.flag_type = numpy.zeros((n, nflags), int)
+        self.flag_timer = numpy.zeros((n, nflags), int) + NO_TIMER
+        self.flag_present = numpy.ones((n, nflags), bool)
+        self.radar_flag = numpy.ones((n, nflags), bool)
+
+        self.rock_x = numpy.zeros((n, nrocks), float)
+        self.rock_y = numpy.zeros((n, nrocks), float)
+        self.rock_present = numpy.zeros((n, nrocks), bool)
+
+        for game in range(0, n):
+            samples = self.rng.permutation(10)[:nflags], self.rng.permutation(10)[:nflags]
+            for i, (x, y) in enumerate(rally7.find_space_cells(self.map, samples)):
+                self.fx[game, i] = x * self.size[0]
+                self.fy[game, i] = y * self.size[1]
+            special, lucky = self.rng.permutation(nflags)[:2]
+            self.flag_type[game, special] = SPECIAL
+            self.flag_type[game, lucky] = LUCKY
+
+            samples = self.rng.permutation(10)[:nrocks], self.rng.randint(0, 2, nrocks)
+            for i, (x, y) in enumerate(rally7.find_group_cells(self.map, samples)):
+                self.rock_x[game, i] = x * self.size[0]
+                self.rock_y[game, i] = y * self.size[1]
+                self.rock_present[game, i] = 1
+
+        # Smoke, with the order of creation being used for collisions.
+
+        self.smoke_x = numpy.zeros((n, self.max_smoke), float)
+        self.smoke_y = numpy.zeros((n, self.max_smoke), float)
+        self.smoke_remaining = numpy.zeros((n, self.max_smoke), int) + NO_TIMER
+        self.smoke_order = numpy.zeros((n, self.max_smoke), int)
+        self.smoke_counter = 0
+
+    def start_player(self):
+
+        "Fill the player's fuel tank, as done by Info."
+
+        n = self.games
+
+        if self.challenging:
+            capacity = Config.framerate * Config.challenging_fuel_length
+        else:
+            capacity = Config.framerate * Config.game_fuel_length
+
+        self.fuel_score_unit = capacity // (10 * Config.framerate)
+        self.fuel_empty = capacity // 5
+        self.initial_speed = Config.car_speed
+        self.fuel = numpy.zeros(n, int) + capacity
+        self.more_smoke = numpy.zeros(n, int)
+
+    def start_distances(self):
+
+        """
+        Find the distances between all pairs of walkable cells, providing the
+        flow fields used by Computer.control for every possible player cell and
+        the paths to flags followed by DemoPlayer.update.
+        """
+
+        width = self.width
+        size = len(self.grid)
+        cells = numpy.nonzero(self.grid)[0]
+
+        # Each walkable cell has a row of distances, with its own row given by
+        # the source table, and all other cells having no row.
+
+        self.source = numpy.zeros(size, int) - 1
+        self.source[cells] = numpy.arange(len(cells))
+        self.distances = numpy.zeros((len(cells), size), numpy.int16) - 1
+        self.distances[numpy.arange(len(cells)), cells] = 0
+
+        # Expand the search from every cell at once, as FlowField does for one.
+
+        left = numpy.arange(size) % width > 0
+        right = numpy.arange(size) % width < width - 1
+        frontier = self.distances == 0
+        distance = 0
+        while frontier.any():
+            distance += 1
+            reached = numpy.zeros(frontier.shape, bool)
+            reached[:, :-1] |= frontier[:, 1:] & left[1:]
+            reached[:, 1:] |= frontier[:, :-1] & right[:-1]
+            reached[:, :-width] |= frontier[:, width:]
+            reached[:, width:] |= frontier[:, :-width]
+            frontier = reached & self.grid & (self.distances < 0)
+            self.distances[frontier] = distance
+
+    # Map functions.
+
+    def walkable(self, x, y):
+
+        "Return whether the map cells at exact positions 'x' and 'y' can be entered."
+
+        return self.grid[self.row_y[y.astype(int)] + self.cell_x[x.astype(int)]]
+
+    def exact(self, x, y):
+        return (x == self.cell_x[x.astype(int)] * self.size[0]) & (y == self.cell_y[y.astype(int)] * self.size[1])
+
+    # Car movement.
+
+    def detect(self, x, y, dx, dy):
+
+        """
+        Return whether cars at 'x' and 'y' can move by 'dx' and 'dy', as done by
+        Car.detect.
+        """
+
+        x2 = x + self.size[0] - 1
+        y2 = y + self.size[1] - 1
+        probe_x = numpy.where(dx < 0, x + dx, x2 + dx)
+        probe_y = numpy.where(dy < 0, y + dy, y2 + dy)
+        return numpy.where(dy == 0,
+            self.walkable(probe_x, y) & self.walkable(probe_x, y2),
+            self.walkable(x, probe_y) & self.walkable(x2, probe_y))
+
+    def move_to_exact(self, x, y, dx, dy):
+
+        """
+        Return whether cars at 'x' and 'y' moving by 'dx' and 'dy' can be put on
+        the next exact map cell, together with the positions of those cells, as
+        done by Car.move_to_exact.
+        """
+
+        map_x, map_y = self.cell_x[x.astype(int)], self.cell_y[y.astype(int)]
+        offset_x, offset_y = x - map_x * self.size[0], y - map_y * self.size[1]
+        horizontal = dy == 0
+        moved_x, moved_y = offset_x + dx, offset_y + dy
+        ok = ((offset_x != 0) | (offset_y != 0)) & numpy.where(horizontal,
+            (moved_x < 0) | (moved_x >= self.size[0]),
+            (moved_y < 0) | (moved_y >= self.size[1]))
+        map_x = map_x + (horizontal & (dx > 0))
+        map_y = map_y + (~horizontal & (dy > 0))
+        return ok, map_x * self.size[0], map_y * self.size[1]
+
+    def move_cars(self, mask, cars):
+
+        """
+        Update the positions of the cars in the 'cars' slice of the car arrays
+        selected by 'mask', as done by Car.update.
+        """
+
+        x, y, dx, dy = self.x[:, cars], self.y[:, cars], self.dx[:, cars], self.dy[:, cars]
+        rx, ry = self.rx[:, cars], self.ry[:, cars]
+        requested_cars = self.requested[:, cars]
+
+        # Requested direction changes.
+
+        requested = mask & requested_cars
+        opposite = (rx == -dx) & (ry == -dy)
+        turned = requested & (opposite | self.exact(x, y)) & self.detect(x, y, rx, ry)
+        x += numpy.where(turned, rx, 0)
+        y += numpy.where(turned, ry, 0)
+        dx[turned] = rx[turned]
+        dy[turned] = ry[turned]
+        requested_cars &= ~turned
+
+        ok, exact_x, exact_y = self.move_to_exact(x, y, dx, dy)
+        placed = requested & ~turned & ok
+        x[placed] = exact_x[placed]
+        y[placed] = exact_y[placed]
+
+        # Normal movement.
+
+        remaining = mask & ~turned & ~placed
+        moved = remaining & self.detect(x, y, dx, dy)
+        x += numpy.where(moved, dx, 0)
+        y += numpy.where(moved, dy, 0)
+
+        remaining &= ~moved
+        ok, exact_x, exact_y = self.move_to_exact(x, y, dx, dy)
+        placed = remaining & ok
+        x[placed] = exact_x[placed]
+        y[placed] = exact_y[placed]
+
+        # Automatic turns, varying the choice of the first two turns.
+
+        remaining &= ~placed
+        swap = self.rng.randint(0, 2, remaining.shape).astype(bool)
+        turns = [
+            (numpy.where(swap, -dy, dy), numpy.where(swap, -dx, dx)),
+            (numpy.where(swap, dy, -dy), numpy.where(swap, dx, -dx)),
+            (-dx, -dy),
+            ]
+
+        for turn_x, turn_y in turns:
+            if not remaining.any():
+                break
+            moved = remaining & self.detect(x, y, turn_x, turn_y)
+            x += numpy.where(moved, turn_x, 0)
+            y += numpy.where(moved, turn_y, 0)
+            dx[remaining] = turn_x[remaining]
+            dy[remaining] = turn_y[remaining]
+            remaining &= ~moved
+
+    # Player behaviour.
+
+    def control_player(self, running):
+
+        "Choose directions for the player's car, as done by DemoPlayer.update."
+
+        active = running & (self.rng.randint(0, self.laziness + 1, self.rows) == 0)
+        if not active.any():
+            return
+
+        x, y = self.x[:, 0], self.y[:, 0]
+        dx, dy = self.dx[:, 0], self.dy[:, 0]
+        speed = self.speed[:, 0]
+        games = numpy.arange(self.rows)
+
+        # Find the cell that each car is in or is about to enter, as done by
+        # Car.next_cell.
+
+        map_x, map_y = self.cell_x[x.astype(int)], self.cell_y[y.astype(int)]
+        map_x = map_x + ((x != map_x * self.size[0]) & (dx > 0))
+        map_y = map_y + ((y != map_y * self.size[1]) & (dy > 0))
+        start = map_y * self.width + map_x
+        source = self.source[start]
+
+        # Find the nearest flags by path length, ignoring collected flags where
+        # possible and preferring flags nearer across the map and then the
+        # first of any equally near flags, as done by
+        # DemoPlayer._get_nearest_flag.
+
+        flag_x = self.cell_x[self.fx.astype(int)]
+        flag_y = self.cell_y[self.fy.astype(int)]
+        targets = flag_y * self.width + flag_x
+        lengths = self.distances[source[:, None], targets].astype(float)
+        lengths[(lengths < 0) | (source < 0)[:, None]] = numpy.inf
+
+        uncollected = self.flag_present & (self.flag_timer == NO_TIMER)
+        candidates = numpy.where(uncollected.any(axis=1)[:, None], uncollected, self.flag_present)
+        lengths[~candidates] = numpy.inf
+
+        estimates = numpy.abs(flag_x - map_x[:, None]) + numpy.abs(flag_y - map_y[:, None])
+        nflags = self.fx.shape[1]
+        order = (lengths * len(self.grid) + estimates) * nflags + numpy.arange(nflags)
+        nearest = numpy.argmin(order, axis=1)
+        length = lengths[games, nearest]
+        target = targets[games, nearest]
+
+        # Take the first step along a shortest path to each flag, trying the
+        # neighbouring cells in the order used by WalkableGrid.
+
+        found = active & (length > 0) & (length < numpy.inf)
+        step_x = numpy.zeros(self.rows, int)
+        step_y = numpy.zeros(self.rows, int)
+        for neighbour_x, neighbour_y in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
+            neighbour = numpy.clip(start + neighbour_x + neighbour_y * self.width, 0, len(self.grid) - 1)
+            neighbour_source = self.source[neighbour]
+            step = found & (neighbour_source >= 0) & (self.distances[neighbour_source, target] == length - 1)
+            step_x[step] = neighbour_x
+            step_y[step] = neighbour_y
+            found &= ~step
+
+        following = active & ((step_x != 0) | (step_y != 0))
+
+        # Find the nearest cars, preferring the first of any equally near cars.
+
+        distances = numpy.hypot(self.x[:, 1:] - x[:, None], self.y[:, 1:] - y[:, None])
+        nearest = numpy.argmin(distances, axis=1) + 1
+        car_distance = distances[games, nearest - 1]
+        non_dest_x, non_dest_y = self.x[games, nearest], self.y[games, nearest]
+
+        in_range = active & (car_distance < self.size[0] * 5)
+        self.more_smoke[in_range & (self.more_smoke == 0)] = 3
+
+        non_dir_x, non_dir_y = numpy.sign(non_dest_x - x), numpy.sign(non_dest_y - y)
+
+        # Evasive action, reversing vertical or horizontal motion.
+
+        evade_y = active & (dx == 0) & (non_dir_y == numpy.sign(dy)) & in_range & \
+            (numpy.abs(x - non_dest_x) <= 1)
+        evade_x = active & ~evade_y & (dy == 0) & (non_dir_x == numpy.sign(dx)) & in_range & \
+            (numpy.abs(y - non_dest_y) <= 1)
+        self.request(0, evade_y, 0, -non_dir_y * speed)
+        self.request(0, evade_x, -non_dir_x * speed, 0)
+
+        # Follow the path to the flag, cancelling any request for the current
+        # direction.
+
+        following &= ~evade_y & ~evade_x
+        rx, ry = step_x * speed, step_y * speed
+        same = (rx == dx) & (ry == dy)
+        self.request(0, following & ~same, rx, ry)
+        self.requested[:, 0] &= ~(following & same)
+
+    def request(self, car, mask, rx, ry):
+
+        "Request directions 'rx' and 'ry' for 'car' in the games selected by 'mask'."
+
+        self.rx[:, car] = numpy.where(mask, rx, self.rx[:, car])
+        self.ry[:, car] = numpy.where(mask, ry, self.ry[:, car])
+        self.requested[:, car] |= mask
+
+    def update_fuel(self, mask, n):
+
+        "Use 'n' units of fuel in the games selected by 'mask', as done by Player.update_fuel."
+
+        using = mask & (self.fuel > 0)
+        full = using & (self.fuel > self.fuel_empty)
+        self.fuel = numpy.where(using, numpy.maximum(0, self.fuel - n), self.fuel)
+
+        # Release any immobile cars when the fuel is low.
+
+        low = full & (self.fuel <= self.fuel_empty)
+        self.immobile[low] = 0
+
+        slowing = using & ~full
+        self.speed[slowing, 0] = (self.fuel[slowing].astype(float) / self.fuel_empty * self.initial_speed).astype(int)
+        self.stopped |= using & (self.fuel == 0)
+
+    def update_player(self, running):
+
+        "Update the player's car, as done by Player.update."
+
+        self.update_fuel(running, 1)
+
+        # Make smoke in the map cell behind the car.
+
+        x, y, dx, dy = self.x[:, 0], self.y[:, 0], self.dx[:, 0], self.dy[:, 0]
+        smoke_x = numpy.floor_divide(x + self.size[0] // 2 + numpy.sign(-dx) * self.size[0], self.size[0])
+        smoke_y = numpy.floor_divide(y + self.size[1] // 2 + numpy.sign(-dy) * self.size[1], self.size[1])
+        making = running & (self.more_smoke > 0) & (self.fuel > self.fuel_empty) & self.exact(x, y) & \
+            self.walkable(smoke_x * self.size[0], smoke_y * self.size[1])
+
+        if making.any():
+            self.make_smoke(making, smoke_x * self.size[0], smoke_y * self.size[1])
+            self.update_fuel(making, Config.smoke_penalty)
+            self.more_smoke -= making
+
+        self.move_cars(running[:, None], slice(0, 1))
+
+    def make_smoke(self, mask, x, y):
+
+        "Add smoke at 'x' and 'y' in the games selected by 'mask'."
+
+        # Use a free slot, or the oldest smoke if no slot is free.
+
+        order = numpy.where(self.smoke_remaining == NO_TIMER, -1, self.smoke_order)
+        slot = numpy.argmin(order, axis=1)
+        games = numpy.nonzero(mask)[0]
+        slot = slot[games]
+
+        self.smoke_counter += 1
+        self.smoke_x[games, slot] = x[games]
+        self.smoke_y[games, slot] = y[games]
+        self.smoke_remaining[games, slot] = 50
+        self.smoke_order[games, slot] = self.smoke_counter
+
+    # Red car behaviour.
+
+    def control_cars(self, running):
+
+        "Choose directions for the red cars, as done by Computer.control."
+
+        cars = running[:, None] & (self.delay == 0) & \
+            (self.rng.randint(0, self.computer_laziness + 1, self.x.shape) == 0)
+        cars[:, 0] = 0
+
+        if self.pursuit == "flow":
+            cars &= ~self.control_flow(cars)
+
+        dir_x = numpy.sign(self.x[:, :1] - self.x)
+        dir_y = numpy.sign(self.y[:, :1] - self.y)
+
+        vertical = cars & (self.dx == 0) & (dir_y != numpy.sign(self.dy))
+        horizontal = cars & (self.dx != 0) & (self.dy == 0) & (dir_x != numpy.sign(self.dx))
+
+        self.rx = numpy.where(vertical, numpy.where(dir_x > 0, self.speed, -self.speed), self.rx)
+        self.ry = numpy.where(vertical, 0, self.ry)
+        self.rx = numpy.where(horizontal, 0, self.rx)
+        self.ry = numpy.where(horizontal, numpy.where(dir_y > 0, self.speed, -self.speed), self.ry)
+        self.requested |= vertical | horizontal
+
+    def control_flow(self, cars):
+
+        """
+        Choose directions for the given 'cars' following the flow fields towards
+        the player, returning the cars for which directions could be chosen.
+        """
+
+        # The player's cell and the cells the cars are in or are entering.
+
+        half = self.size[0] // 2, self.size[1] // 2
+        target = self.row_y[(self.y[:, :1] + half[1]).astype(int)] + self.cell_x[(self.x[:, :1] + half[0]).astype(int)]
+        source = self.source[target]
+
+        map_x = self.cell_x[self.x.astype(int)]
+        map_y = self.cell_y[self.y.astype(int)]
+        map_x += (self.x != map_x * self.size[0]) & (self.dx > 0)
+        map_y += (self.y != map_y * self.size[1]) & (self.dy > 0)
+        cell = map_y * self.width + map_x
+
+        rows = numpy.where(source < 0, 0, source) + numpy.zeros(cell.shape, int)
+        distance = numpy.where(source < 0, -1, self.distances[rows, cell])
+
+        # Find the nearer neighbours, preferring the current direction and then
+        # the steps in the order used by FlowField.
+
+        current_x, current_y = numpy.sign(self.dx), numpy.sign(self.dy)
+        step_x = numpy.zeros(cell.shape, int)
+        step_y = numpy.zeros(cell.shape, int)
+        found = numpy.zeros(cell.shape, bool)
+
+        for preferred in (1, 0):
+            for sx, sy in rally7.FlowField.steps:
+                inside = (map_x + sx >= 0) & (map_x + sx < self.width)
+                neighbour = numpy.where(inside, cell + sy * self.width + sx, 0)
+                nearer = inside & (distance > 0) & (self.distances[rows, neighbour] == distance - 1)
+                if preferred:
+                    nearer &= (current_x == sx) & (current_y == sy)
+                choose = nearer & ~found
+                step_x[choose] = sx
+                step_y[choose] = sy
+                found |= choose
+
+        following = cars & found
+        rx = step_x * self.speed
+        ry = step_y * self.speed
+        same = following & (rx == self.dx) & (ry == self.dy)
+        turning = following & ~same & ~((rx == -self.dx) & (ry == -self.dy))
+
+        self.requested &= ~same
+        self.rx = numpy.where(turning, rx, self.rx)
+        self.ry = numpy.where(turning, ry, self.ry)
+        self.requested |= turning
+        return following
+
+    def update_cars(self, running):
+
+        "Update the red cars, as done by Computer.update."
+
+        cars = running[:, None] & numpy.ones(self.x.shape, bool)
+        cars[:, 0] = 0
+
+        # Delayed cars rebound when the delay ends.
+
+        delayed = cars & (self.delay > 0)
+        self.delay -= delayed
+        rebounding = delayed & (self.delay == 0) & self.rebound
+        self.dx[rebounding] = self.bx[rebounding]
+        self.dy[rebounding] = self.by[rebounding]
+        self.x += numpy.where(rebounding, self.dx, 0)
+        self.y += numpy.where(rebounding, self.dy, 0)
+        self.rebound &= ~rebounding
+
+        self.move_cars((cars & ~delayed & ~self.immobile)[:, 1:], slice(1, None))
+
+    # Other objects.
+
+    def update_objects(self, running):
+
+        "Update the smoke and flag timers, as done by Smoke.update and Flag.update."
+
+        smoke = running[:, None] & (self.smoke_remaining != NO_TIMER)
+        self.smoke_remaining -= smoke
+        self.smoke_remaining[smoke & (self.smoke_remaining < 0)] = NO_TIMER
+
+        flags = running[:, None] & (self.flag_timer != NO_TIMER)
+        self.flag_timer -= flags
+        self.flag_present[flags & (self.flag_timer == 0)] = 0
+
+    def overlaps(self, x1, y1, x2, y2):
+        return (numpy.abs(x1 - x2) < self.size[0]) & (numpy.abs(y1 - y2) < self.size[1])
+
+    def collisions(self, running):
+
+        "Detect collisions, as done by GameEngine.collisions."
+
+        x, y = self.x[:, :1], self.y[:, :1]
+        ncars = self.x.shape[1]
+
+        # The player crashes into red cars and rocks.
+
+        car_bang = running & self.overlaps(x, y, self.x[:, 1:], self.y[:, 1:]).any(axis=1)
+        rock_bang = running & (self.rock_present & self.overlaps(x, y, self.rock_x, self.rock_y)).any(axis=1)
+        self.rock_bang |= rock_bang & ~car_bang
+        self.bang |= car_bang | rock_bang
+
+        # The player collects flags.
+
+        for flag in range(0, self.fx.shape[1]):
+            collected = running & self.flag_present[:, flag] & (self.flag_timer[:, flag] == NO_TIMER) & \
+                self.overlaps(x[:, 0], y[:, 0], self.fx[:, flag], self.fy[:, flag])
+            if not collected.any():
+                continue
+
+            self.flag_timer[collected, flag] = 50
+            self.radar_flag[collected, flag] = 0
+            self.flags_cleared += collected
+
+            flag_type = self.flag_type[:, flag]
+            self.score_flag[collected & (flag_type == SPECIAL)] *= 2
+            self.score += numpy.where(collected, self.score_flag, 0)
+
+            remaining = self.radar_flag.any(axis=1)
+            draining = collected & (flag_type == LUCKY) & remaining
+            self.draining |= draining
+            self.draining_level[draining] = self.fuel[draining]
+            self.complete |= collected & ~remaining
+
+        # Red cars rebound from the first object they collide with, choosing
+        # from the player, other cars, rocks and smoke in that order.
+
+        # Only consider games with cars able to rebound, and only as much smoke
+        # as any of those games has, with the oldest smoke first.
+
+        games = numpy.nonzero(running & (self.delay[:, 1:] == 0).any(axis=1))[0]
+        if not len(games):
+            return
+
+        x, y, dx, dy = self.x[games], self.y[games], self.dx[games], self.dy[games]
+        smoke = self.smoke_remaining[games] != NO_TIMER
+        order = numpy.argsort(numpy.where(smoke, self.smoke_order[games], self.smoke_counter + 1), axis=1)
+        order = order[:, :smoke.sum(axis=1).max()]
+        rows = numpy.arange(len(games))[:, None]
+
+        others_x = numpy.concatenate([x, self.rock_x[games], self.smoke_x[games][rows, order]], axis=1)
+        others_y = numpy.concatenate([y, self.rock_y[games], self.smoke_y[games][rows, order]], axis=1)
+        present = numpy.concatenate([numpy.ones(x.shape, bool), self.rock_present[games], smoke[rows, order]], axis=1)
+
+        hits = present[:, None, :] & self.overlaps(x[:, :, None], y[:, :, None], others_x[:, None, :], others_y[:, None, :])
+        cars = numpy.arange(ncars)
+        hits[:, cars, cars] = 0
+
+        hitting = (self.delay[games] == 0) & hits.any(axis=2)
+        hitting[:, 0] = 0
+        if not hitting.any():
+            return
+
+        first = numpy.argmax(hits, axis=2)
+        other_x = others_x[rows, first]
+        other_y = others_y[rows, first]
+
+        delay = self.delay[games]
+        delay[hitting] = 50
+        self.delay[games] = delay
+        self.bx[games] = numpy.where(hitting, numpy.sign(x - other_x) * numpy.abs(dx), self.bx[games])
+        self.by[games] = numpy.where(hitting, numpy.sign(y - other_y) * numpy.abs(dy), self.by[games])
+        self.rebound[games] |= hitting
+        self.requested[games] &= ~hitting
+
+    # Game progress.
+
+    def running(self, limit):
+
+        "Return a mask selecting the games still in progress before 'limit' ticks."
+
+        return ~self.bang & ~self.stopped & ~self.complete & (self.ticks < limit)
+
+    def step(self, limit):
+
+        "Advance the games still in progress by one tick, as done by GameEngine.advance."
+
+        active = self.running(limit)
+        self.ticks += active
+
+        # Drain the fuel after lucky flags are collected.
+
+        draining = active & self.draining
+        if draining.any():
+            using = draining & (self.fuel > 0)
+            self.fuel -= numpy.where(using, self.fuel_score_unit, 0)
+            self.score += numpy.where(using, 20, 0)
+            finished = draining & ~using
+            self.fuel[finished] = self.draining_level[finished]
+            self.draining &= ~finished
+
+        running = active & ~draining
+        self.control_player(running)
+        self.update_player(running)
+        self.control_cars(running)
+        self.update_cars(running)
+        self.update_objects(running)
+        self.collisions(running)
+
+        return active.any()
+
+    def run(self, limit):
+
+        "Play the games until all of them have finished or reached 'limit' ticks."
+
+        while self.step(limit):
+
+            # Stop processing finished games once they dominate the arrays.
+
+            running = self.running(limit)
+            if running.sum() < self.rows / 2:
+                self.retire(running)
+
+        self.retire(numpy.zeros(self.rows, bool))
+
+    def retire(self, keep):
+
+        """
+        Copy the outcomes of the games not selected by 'keep' into the results,
+        removing them from the arrays.
+        """
+
+        finished = self.index[~keep]
+        for name in self.outcomes:
+            self.results[name][finished] = getattr(self, name)[~keep]
+        for name in self.states:
+            setattr(self, name, getattr(self, name)[keep])
+        self.index = self.index[keep]
+        self.rows = len(self.index)
+
+    def get_results(self, size, seed):
+
+        "Return a list of result tuples for finished games, as produced by tools/batch.py."
+
+        r = self.results
+        results = []
+        for game in range(0, self.games):
+            if r["stopped"][game]:
+                cause = "fuel"
+            elif r["rock_bang"][game]:
+                cause = "rock"
+            elif r["bang"][game]:
+                cause = "car"
+            elif r["complete"][game]:
+                cause = "complete"
+            else:
+                cause = "timeout"
+            results.append((size, self.level, seed, int(r["flags_cleared"][game]), int(r["score"][game]),
+                int(r["ticks"][game]), cause))
+        return results
+
+def get_options(args):
+
+    "Return a dictionary of options from the given 'args'."
+
+    options = {
+        "games" : "10000", "seed" : "1", "level" : "1", "size" : "big",
+        "ticks" : str(Config.demo_timer_limit),
+        "laziness" : str(rally7.DemoPlayer.laziness),
+        "computer-laziness" : str(rally7.Computer.laziness),
+        "speed-advantage" : str(Config.big_computer_speed_advantage),
+        "pursuit" : rally7.Computer.pursuit,
+        "summary" : None,
+        }
+
+    for arg in args:
+        if not arg.startswith("--"):
+            raise ValueError("Unrecognised argument: %s" % arg)
+        name, value = (arg[2:].split("=", 1) + ["1"])[:2]
+        if name not in options:
+            raise ValueError("Unrecognised option: %s" % arg)
+        options[name] = value
+
+    return options
+
+def main(args):
+    options = get_options(args)
+
+    size = options["size"]
+    if size not in sizes:
+        raise ValueError("Unrecognised size: %s" % size)
+    if options["pursuit"] not in ("flow", "direct"):
+        raise ValueError("Unrecognised pursuit: %s" % options["pursuit"])
+
+    Config.big_computer_speed_advantage = float(options["speed-advantage"])
+    sizes[size]()
+    rally7.set_headless()
+
+    seed = int(options["seed"])
+    batch = Batch(int(options["games"]), int(options["level"]), seed,
+        int(options["laziness"]), int(options["computer-laziness"]), options["pursuit"])
+    batch.run(int(options["ticks"]))
+    results = batch.get_results(size, seed)
+
+    if options["summary"]:
+        summarise(results)
+    else:
+        print("size,level,seed,flags,score,ticks,cause")
+        for result in results:
+            print("%s,%d,%d,%d,%d,%d,%s" % result)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
+
+# vim: tabstop=4 expandtab shiftwidth=4